@@ -0,0 +1,157 @@
+# ========================================================================
+# Streaming anomaly segmentation metrics (AUPRC, AUROC, FPR@TPR95)
+#
+# Scores are binned image by image into fixed-resolution histograms, one for
+# in-distribution pixels (label 0) and one for anomalous pixels (label 1), so
+# memory stays constant regardless of the number of evaluated images.
+# Curves are then obtained from cumulative sums over the bins, walking the
+# thresholds from the highest score to the lowest, exactly as sklearn does
+# over the distinct score values.
+#
+# Error bound w.r.t. the exact sklearn / ood_metrics numbers: binning only
+# merges thresholds that fall inside the same bin, so every metric is exact
+# up to the ordering of pixels sharing a bin. compute() returns, next to each
+# metric, a worst-case bound derived from the histogram itself:
+# - AUROC:  0.5 * sum_b(pos_b * neg_b) / (P * N)   (pairs tied inside a bin)
+# - AUPRC:  sum_b of the largest deviation of the bin contribution from its
+#           extremes: every positive of bin b ranked before its negatives
+#           (upper) or after all of them (lower, summed in closed form through
+#           the digamma function)
+# - FPR95:  neg_b / N of the bin in which the TPR crosses 0.95
+# Scores outside 'score_range' are clipped into the first/last bin; the bounds
+# above still hold since they are computed on the clipped histogram.
+# ========================================================================
+
+import numpy as np
+import torch
+
+from scipy.special import digamma
+
+
+class AnomalyHistogram:
+    """
+    Accumulate per-class histograms of anomaly scores and compute AUPRC, AUROC
+    and FPR@TPR95 from them.
+
+    Parameters:
+        - num_bins (int): Number of bins used to quantize the scores (default 2^16).
+        - score_range (tuple[float, float]): Range of the scores covered by the bins.
+            Values outside the range are clipped into the edge bins.
+    """
+    def __init__(self, num_bins: int = 2**16, score_range: tuple = (0.0, 1.0)):
+        assert score_range[1] > score_range[0], "Error: score_range must be (low, high) with low < high"
+        self.num_bins = num_bins
+        self.low, self.high = float(score_range[0]), float(score_range[1])
+        self.reset()
+
+    def reset(self):
+        self.hist = None    # [2, num_bins] counts: row 0 in-distribution, row 1 anomaly
+        self.clipped = 0
+
+    def add(self, scores, labels):
+        """
+        Add the scores of one or more images to the histograms.
+
+        Parameters:
+            - scores (torch.Tensor | np.ndarray): Anomaly scores, any shape.
+            - labels (torch.Tensor | np.ndarray): Ground truth with the same shape as 'scores',
+                1 for anomaly, 0 for in-distribution; any other value is ignored.
+        """
+        scores = torch.as_tensor(scores)
+        labels = torch.as_tensor(labels, device=scores.device)
+
+        valid = (labels == 0) | (labels == 1)
+        scores = scores[valid].double()
+        labels = labels[valid].long()
+
+        self.clipped += int(((scores < self.low) | (scores > self.high)).sum())
+        idx = ((scores - self.low) * (self.num_bins / (self.high - self.low))).long()
+        idx = idx.clamp_(0, self.num_bins - 1)
+
+        counts = torch.bincount(labels * self.num_bins + idx, minlength=2 * self.num_bins).view(2, self.num_bins)
+        if self.hist is None:
+            self.hist = counts
+        else:
+            self.hist += counts.to(self.hist.device)
+
+    def merge(self, other):
+        """Add the counts accumulated by another AnomalyHistogram with the same binning."""
+        assert (other.num_bins, other.low, other.high) == (self.num_bins, self.low, self.high), \
+            "Error: cannot merge histograms with different binning"
+        if other.hist is not None:
+            if self.hist is None:
+                self.hist = other.hist.clone()
+            else:
+                self.hist += other.hist.to(self.hist.device)
+        self.clipped += other.clipped
+        return self
+
+    def curves(self):
+        """
+        Compute ROC and PR curves over the bin thresholds, from the highest to the lowest score.
+
+        Returns:
+            - dict[str, np.ndarray]: 'fpr', 'tpr', 'precision' and 'recall' evaluated at every
+                non-empty bin, plus the per-bin counts 'neg' and 'pos' in the same order.
+        """
+        assert self.hist is not None, "Error: no scores have been added"
+        hist = self.hist.cpu().numpy().astype(np.float64)
+        neg, pos = hist[0][::-1], hist[1][::-1]     # descending scores
+        nonempty = (neg + pos) > 0
+        neg, pos = neg[nonempty], pos[nonempty]
+
+        tp = np.cumsum(pos)
+        fp = np.cumsum(neg)
+        assert tp[-1] > 0 and fp[-1] > 0, "Error: both anomaly and in-distribution pixels are required"
+
+        return {
+            'fpr': fp / fp[-1],
+            'tpr': tp / tp[-1],
+            'precision': tp / (tp + fp),
+            'recall': tp / tp[-1],
+            'neg': neg,
+            'pos': pos,
+        }
+
+    def compute(self):
+        """
+        Compute the anomaly metrics and their worst-case error w.r.t. the exact values.
+
+        Returns:
+            - dict[str, float]: 'auprc', 'auroc', 'fpr95' and the matching bounds
+                'auprc_err', 'auroc_err', 'fpr95_err', plus the number of 'clipped' scores.
+        """
+        c = self.curves()
+        neg, pos = c['neg'], c['pos']
+        P, N = pos.sum(), neg.sum()
+
+        # AUPRC as in sklearn.metrics.average_precision_score
+        recall_prev = np.concatenate(([0.0], c['recall'][:-1]))
+        auprc = np.sum((c['recall'] - recall_prev) * c['precision'])
+
+        # extremes of each bin contribution over the orderings of its pixels
+        tp_above = np.cumsum(pos) - pos
+        fp_above = np.cumsum(neg) - neg
+        binned = pos / P * c['precision']
+        upper = pos / P * (tp_above + pos) / np.maximum(tp_above + pos + fp_above, 1)
+        lower = (pos - (fp_above + neg) * (digamma(tp_above + fp_above + neg + pos + 1)
+                                           - digamma(tp_above + fp_above + neg + 1))) / P
+        auprc_err = np.sum(np.maximum(upper - binned, binned - lower))
+
+        # AUROC with the ROC curve starting from (0, 0), as in sklearn.metrics.roc_curve
+        fpr = np.concatenate(([0.0], c['fpr']))
+        tpr = np.concatenate(([0.0], c['tpr']))
+        auroc = np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2)
+        auroc_err = 0.5 * np.sum(pos * neg) / (P * N)
+
+        # FPR@TPR95 as in ood_metrics.fpr_at_95_tpr
+        fpr95 = np.interp(0.95, tpr, fpr)
+        crossing = np.searchsorted(c['tpr'], 0.95)  # first bin whose TPR reaches 0.95
+        fpr95_err = neg[crossing] / N
+
+        return {
+            'auprc': float(auprc), 'auprc_err': float(auprc_err),
+            'auroc': float(auroc), 'auroc_err': float(auroc_err),
+            'fpr95': float(fpr95), 'fpr95_err': float(fpr95_err),
+            'clipped': self.clipped,
+        }
@@ -0,0 +1,80 @@
+# ========================================================================
+# Post-hoc anomaly scoring functions for semantic segmentation logits
+#
+# Every scorer maps a batch of logits [B, C, H, W] (C = 19 classes + void)
+# to per-pixel anomaly scores [B, H, W], higher meaning more anomalous.
+# All the requested scorers and temperatures are computed from the same
+# logits, so the network runs once per image whatever the configuration.
+# ========================================================================
+
+import math
+import torch
+import torch.nn.functional as F
+
+METHODS = ["MSP", "MaxLogit", "MaxEntropy", "void"]
+
+# Methods whose ranking depends on the temperature (MaxLogit is invariant)
+TEMPERATURE_METHODS = ["MSP", "MaxEntropy", "void"]
+
+# Range of the anomaly scores binned by AnomalyHistogram for each method
+SCORE_RANGES = {
+    "MSP": (0.0, 1.0),
+    "MaxEntropy": (0.0, 1.0),
+    "void": (0.0, 1.0),
+    "MaxLogit": (-50.0, 50.0),
+}
+
+
+def scorer_configs(methods, temperatures):
+    """
+    Expand methods and temperatures into the list of scorers to evaluate.
+
+    Parameters:
+        - methods (list[str]): Scoring methods, any of METHODS.
+        - temperatures (list[float]): Temperatures swept for the methods in TEMPERATURE_METHODS.
+
+    Returns:
+        - list[tuple[str, str, float]]: (name, method, temperature) of each scorer. The name is
+            the method itself, suffixed with the temperature only when more than one is swept.
+    """
+    configs = []
+    for method in methods:
+        if method not in METHODS:
+            raise ValueError(f"Unsupported anomaly scoring method: {method}. Use one of {METHODS}.")
+        if method in TEMPERATURE_METHODS and len(temperatures) > 1:
+            configs += [(f"{method}_T{t:g}", method, t) for t in temperatures]
+        else:
+            configs.append((method, method, temperatures[0] if method in TEMPERATURE_METHODS else 1.0))
+    return configs
+
+
+def anomaly_scores(result, configs):
+    """
+    Compute the anomaly scores of every scorer from one batch of logits.
+
+    Parameters:
+        - result (torch.Tensor): Logits of shape [B, C, H, W], void class last.
+        - configs (list[tuple[str, str, float]]): Scorers as returned by scorer_configs.
+
+    Returns:
+        - dict[str, torch.Tensor]: Anomaly scores [B, H, W] for each scorer name.
+    """
+    scores = {}
+    log_probs = {}  # log-softmax over the 19 classes, shared by MSP and MaxEntropy
+
+    def class_log_probs(temperature):
+        if temperature not in log_probs:
+            log_probs[temperature] = F.log_softmax(result[:, :-1] / temperature, dim=1)
+        return log_probs[temperature]
+
+    for name, method, temperature in configs:
+        if method == "void":
+            scores[name] = F.softmax(result / temperature, dim=1)[:, -1]
+        elif method == "MSP":
+            scores[name] = 1.0 - torch.exp(torch.max(class_log_probs(temperature), dim=1)[0])
+        elif method == "MaxLogit":
+            scores[name] = -torch.max(result[:, :-1], dim=1)[0]
+        elif method == "MaxEntropy":
+            log_p = class_log_probs(temperature)
+            scores[name] = torch.sum(-torch.exp(log_p) * log_p, dim=1) / math.log(log_p.size(1))
+    return scores
@@ -4,6 +4,8 @@
 #######################
 
 import numpy as np
+import torch
+import glob
 import os
 
 from PIL import Image
@@ -99,3 +101,143 @@ class cityscapes(Dataset):
     def __len__(self):
         return len(self.filenames)
 
+
+
+def label_lut(mapping=None):
+    """256-entry uint8 lookup table, identity except for the values in 'mapping'."""
+    lut = np.arange(256, dtype=np.uint8)
+    for value, new_value in (mapping or {}).items():
+        lut[value] = new_value
+    return lut
+
+
+class AnomalyDatasetSpec:
+    """
+    Layout of an anomaly segmentation benchmark and decoding of its ground truth.
+
+    Parameters:
+        - name (str): Name of the dataset, matched against the image paths.
+        - image_ext (str): Extension of the input images.
+        - label_ext (str): Extension of the ground truth masks.
+        - lut (np.ndarray): 256-entry uint8 table mapping the mask values to
+            1 = anomaly, 0 = in-distribution, 255 = void.
+        - images_dir (str): Folder of the input images.
+        - labels_dir (str): Sibling folder of the ground truth masks.
+    """
+    def __init__(self, name, image_ext, label_ext, lut, images_dir='images', labels_dir='labels_masks'):
+        self.name = name
+        self.image_ext = image_ext
+        self.label_ext = label_ext
+        self.lut = lut
+        self.images_dir = images_dir
+        self.labels_dir = labels_dir
+
+    def label_path(self, filename):
+        """Path of the ground truth matching an image of the dataset."""
+        head, basename = os.path.split(filename)
+        root, folder = os.path.split(head)
+        if folder == self.images_dir:
+            head = os.path.join(root, self.labels_dir)
+        return os.path.join(head, os.path.splitext(basename)[0] + self.label_ext)
+
+    def decode(self, label):
+        """Remap a ground truth mask with a single indexed gather."""
+        return self.lut[np.asarray(label)]
+
+
+# LostAndFound: 0 void, 1 road, 2-200 obstacles
+LUT_LOSTANDFOUND = label_lut({0: 255, 1: 0, **{v: 1 for v in range(2, 201)}})
+# StreetHazards: class 14 is the anomaly, other classes in-distribution
+LUT_STREETHAZARD = label_lut({**{v: 0 for v in range(20)}, 14: 1, 255: 1})
+
+# Anomaly benchmarks, matched in order against the image paths
+ANOMALY_DATASETS = [
+    AnomalyDatasetSpec('RoadAnomaly21', '.png', '.png', label_lut({2: 1})),
+    AnomalyDatasetSpec('RoadAnomaly', '.jpg', '.png', label_lut({2: 1})),
+    AnomalyDatasetSpec('RoadObsticle21', '.webp', '.png', label_lut()),
+    AnomalyDatasetSpec('fs_static', '.jpg', '.png', label_lut()),
+    AnomalyDatasetSpec('FS_LostFound_full', '.png', '.png', label_lut()),
+    AnomalyDatasetSpec('LostAndFound', '.png', '.png', LUT_LOSTANDFOUND),
+    AnomalyDatasetSpec('Streethazard', '.png', '.png', LUT_STREETHAZARD),
+]
+DEFAULT_ANOMALY_DATASET = AnomalyDatasetSpec('default', '.png', '.png', label_lut())
+
+def anomaly_dataset_spec(filename):
+    """Registry entry of the benchmark an image belongs to."""
+    for spec in ANOMALY_DATASETS:
+        if spec.name in filename:
+            return spec
+    return DEFAULT_ANOMALY_DATASET
+
+def anomaly_dataset_name(filename):
+    """Dataset an image is reported under: its registry entry, or the folder holding its images folder."""
+    spec = anomaly_dataset_spec(filename)
+    if spec is not DEFAULT_ANOMALY_DATASET:
+        return spec.name
+    return os.path.basename(os.path.dirname(os.path.dirname(os.path.abspath(filename))))
+
+def anomaly_filenames(patterns):
+    """Expand glob patterns and dataset roots (globbed from their registry entry) into image paths."""
+    filenames = []
+    for pattern in patterns:
+        pattern = os.path.expanduser(pattern)
+        if os.path.isdir(pattern):  # dataset root, layout from the registry
+            spec = anomaly_dataset_spec(pattern)
+            pattern = os.path.join(pattern, spec.images_dir, '*' + spec.image_ext)
+        filenames += glob.glob(pattern)
+    return filenames
+
+
+class AnomalyDataset(Dataset):
+    """
+    Anomaly segmentation benchmark (RoadAnomaly, RoadObstacle, Fishyscapes, ...): images
+    and their binary ground truth, with layout and decoding taken from ANOMALY_DATASETS.
+
+    Parameters:
+        - filenames (list[str]): Paths of the input images.
+        - input_transform (callable): Transform applied to the RGB image.
+        - target_transform (callable): Transform applied to the ground truth PIL image,
+            before remapping it to 1 = anomaly, 0 = in-distribution.
+        - load_images (bool): If False only the ground truth is decoded and an empty tensor
+            is returned in place of the image (e.g. when the logits are already cached).
+        - mask_store (MaskStore): Precomputed ground truth (see mask_store.py), read in place
+            of decoding the label files; 'target_transform' is then not applied.
+    """
+    def __init__(self, filenames, input_transform=None, target_transform=None, load_images=True, mask_store=None):
+        self.filenames = sorted(filenames)
+        self.load_images = load_images
+        self.mask_store = mask_store
+
+        # resolved once here, shared by the loader workers
+        self.specs = [anomaly_dataset_spec(f) for f in self.filenames]
+        self.filenamesGt = [spec.label_path(f) for spec, f in zip(self.specs, self.filenames)]
+
+        self.input_transform = input_transform
+        self.target_transform = target_transform
+
+    def read_image(self, filename):
+        with open(filename, 'rb') as f:
+            image = load_image(f).convert('RGB')
+        if self.input_transform is not None:
+            image = self.input_transform(image)
+        return image
+
+    def __getitem__(self, index):
+        filename = self.filenames[index]
+        filenameGt = self.filenamesGt[index]
+
+        image = self.read_image(filename) if self.load_images else torch.empty(0)
+
+        if self.mask_store is not None:
+            label = self.mask_store.get(filename)
+        else:
+            label = load_image(filenameGt)
+            if self.target_transform is not None:
+                label = self.target_transform(label)
+
+            label = self.specs[index].decode(label)
+
+        return image, torch.from_numpy(label), filename
+
+    def __len__(self):
+        return len(self.filenames)
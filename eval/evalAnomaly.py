@@ -13,17 +13,24 @@ import torchvision.transforms as T
 
 from PIL import Image
 from argparse import ArgumentParser
+from torch.utils.data import DataLoader
 from ood_metrics import fpr_at_95_tpr, calc_metrics
 from plots import plot_roc, plot_pr, plot_barcode   # starting from ood_metrics original version
+from plots import plot_roc_hist, plot_pr_hist
+from anomaly_metrics import AnomalyHistogram
+from anomaly_scores import SCORE_RANGES, scorer_configs, anomaly_scores
+from logit_cache import LogitCache
+from mask_store import MaskStore
+from eval_utils import add_tiled_arguments, check_tiled_arguments
+from sharded_eval import run_sharded, shard_items
+from dataset import AnomalyDataset, anomaly_filenames, anomaly_dataset_name
 from sklearn.metrics import roc_auc_score, roc_curve, auc, precision_recall_curve, average_precision_score
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../train')))
 
 # Import networks
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from train.erfnet import ERFNet
-from train.bisenet import BiSeNet
-from train.enet import ENet
+from train.model_registry import load_model
 
 # general reproducibility
 seed = 42
@@ -38,13 +45,15 @@ NUM_CLASSES = 20
 torch.backends.cudnn.deterministic = True
 torch.backends.cudnn.benchmark = True
 
+INPUT_SIZE = (512, 1024)
+
 # Preprocessing
 image_transform = T.Compose([
-  T.Resize((512, 1024), Image.BILINEAR), T.ToTensor()
+  T.Resize(INPUT_SIZE, Image.BILINEAR), T.ToTensor()
 ])
 
 mask_transform = T.Compose([
-  T.Resize((512, 1024), Image.NEAREST)
+  T.Resize(INPUT_SIZE, Image.NEAREST)
 ])
 
 def main():
@@ -64,19 +73,59 @@ def main():
     parser.add_argument('--num-workers', type=int, default=4)
     parser.add_argument('--batch-size', type=int, default=1)
     parser.add_argument('--cpu', action='store_true')
+    parser.add_argument('--strict', action='store_true')  # fail on missing, unexpected or mismatched checkpoint keys
+    parser.add_argument('--fuse', action='store_true')  # fold BatchNorms and drop dropouts before inference
+    parser.add_argument('--quantized', type=str, default=None)  # int8 model of quantize_model.py, also scored
 
     # new arguments
-    parser.add_argument('--method', type=str, default='MSP')
-    parser.add_argument('--temperature', type=float, default=1.0)
+    parser.add_argument('--method', type=str, nargs='+', default=['MSP'])  # one or more of MSP, MaxLogit, MaxEntropy, void
+    parser.add_argument('--temperature', type=float, nargs='+', default=[1.0])  # temperature sweep for MSP, MaxEntropy, void
     parser.add_argument('--plotdir', type=str, default=None)    # where to save PR curve
+    parser.add_argument('--num-bins', type=int, default=2**16)  # resolution of the streaming metrics
+    parser.add_argument('--score-range', type=float, nargs=2, default=None)  # (low, high) binned scores, default by method
+    parser.add_argument('--exact-metrics', action='store_true')  # also keep every pixel and compute sklearn metrics (memory hungry)
+    parser.add_argument('--logit-cache', type=str, default=None)  # directory of the on-disk float16 logit cache
+    parser.add_argument('--logit-cache-gb', type=float, default=20.0)  # size limit of the logit cache
+    parser.add_argument('--mask-store', type=str, default=None)  # precomputed ground truth built by mask_store.py
+    add_tiled_arguments(parser)  # --tiled: native resolution, sliding-window inference (tiled_inference.py)
 
-    args = parser.parse_args()  # argparse.Namespace object that contained arguments
-    anomaly_score_list = []
-    ood_gts_list = []
+    parser.add_argument('--shards', type=int, default=1)  # CPU worker processes, each pinned to its own cores (sharded_eval.py)
+    parser.add_argument('--shard-threads', type=int, default=None)  # intra-op threads per shard, default its number of cores
 
-    if not os.path.exists('results.txt'):
-        open('results.txt', 'w').close()
-    file = open('results.txt', 'a')
+    args = parser.parse_args()  # argparse.Namespace object that contained arguments
+    if args.shards > 1 and not args.cpu:
+        parser.error("--shards evaluates on the CPU, add --cpu")
+    check_tiled_arguments(parser, args)
+    if not anomaly_filenames(args.input if isinstance(args.input, list) else [args.input]):
+        parser.error(f"no image matches --input {args.input}")
+
+    if args.shards > 1:
+        # each shard returns its histograms, merged into the metrics of the whole dataset
+        shards = run_sharded(evaluate, args, args.shards, args.shard_threads)
+        state = shards[0]
+        for shard in shards[1:]:
+            merge_state(state, shard)
+    else:
+        state = evaluate(args)
+    report(args, state)
+
+def scorer_hists(args, configs):
+    """One empty histogram per scorer, over the score range of its method unless --score-range."""
+    return {name: AnomalyHistogram(args.num_bins, args.score_range if args.score_range else SCORE_RANGES[method])
+            for name, method, _ in configs}
+
+def evaluate(args, shard_index=0, num_shards=1):
+    """
+    Anomaly score histograms (and, with --exact-metrics, the scored pixels) of one shard of the images,
+    keyed by dataset (see anomaly_dataset_name) and then by scorer.
+    """
+    # every scorer is computed from the same forward pass
+    configs = scorer_configs(args.method, args.temperature)
+    # int8 model of quantize_model.py, scored on the CPU next to the fp32 one
+    quantized = None
+    if args.quantized:
+        from quantize_model import load_quantized    # torch.ao.quantization only when needed
+        quantized = load_quantized(args.quantized)
 
     modelpath = args.loadDir + args.loadModel + ".py"
     weightspath = args.loadDir + args.loadWeights
@@ -84,133 +133,202 @@ def main():
     # print ("Loading model: " + modelpath)         # for ERFNet ../trained_models/erfnet.py
     # print ("Loading weights: " + weightspath)     # for ERFNet ../trained_models/erfnet_pretrained.pth
 
-    if args.loadModel == "erfnet":
-        model = ERFNet(NUM_CLASSES) 
-    elif args.loadModel == "erfnet_isomaxplus":
-        model = ERFNet(NUM_CLASSES, use_isomaxplus=True)
-    elif args.loadModel == "bisenet":
-        model = BiSeNet(NUM_CLASSES)
-    elif args.loadModel == "enet":
-        model = ENet(NUM_CLASSES)
-
+    device = torch.device('cpu' if args.cpu else 'cuda')
+    model = load_model(args.loadModel, weightspath, device, strict=args.strict)   # any checkpoint format, key mismatches reported
     if (not args.cpu):
-        model = torch.nn.DataParallel(model).cuda()
-
-    def load_my_state_dict(model, state_dict):  #custom function to load model when not all dict elements
-        own_state = model.state_dict()
-        # print(own_state.keys())
-        # print(state_dict.keys())
-        for name, param in state_dict.items():
-            if name not in own_state:
-                if name.startswith("module."):
-                    own_state[name.split("module.")[-1]].copy_(param)
-                else:
-                    print(name, " not loaded")
-                    continue
-            else:
-                own_state[name].copy_(param)
-        return model
-
-    checkpoint = torch.load(weightspath, map_location=lambda storage, loc: storage)
-    state_dict = checkpoint['state_dict'] if 'state_dict' in checkpoint else checkpoint
-    model = load_my_state_dict(model, state_dict)
+        model = torch.nn.DataParallel(model)
     # print ("Model and weights LOADED successfully")
     model.eval()
+    if args.fuse:
+        from fuse_model import fuse_model
+        model = fuse_model(model, inplace=True)    # BatchNorms folded into the convs
+    # Tiled inference: images and masks at their native resolution, logits blended from tiles
+    engine, quantized_engine = None, quantized
+    if args.tiled:
+        from tiled_inference import tiled_from_args
+        engine = tiled_from_args(model, args)
+        quantized_engine = tiled_from_args(quantized, args) if quantized is not None else None
+    resolution = engine.key() if args.tiled else INPUT_SIZE
+    input_transform, target_transform = (T.ToTensor(), None) if args.tiled else (image_transform, mask_transform)
     
-    for path in glob.glob(os.path.expanduser(str(args.input[0]))):
-        # images = torch.from_numpy(np.array(Image.open(path).convert('RGB'))).unsqueeze(0).float().cuda()
-        # images = images.permute(0,3,1,2)
-        images = image_transform(Image.open(path).convert('RGB')).unsqueeze(0).float().cuda()
-        with torch.no_grad():
-            if args.loadModel == "bisenet":
-                result = model(images)[0].squeeze(0)
-            else:
-                result = model(images).squeeze(0)
-        # print(result.shape) torch.Size([20, 512, 1024])
-
-        # methods
-        if args.method == "void":
-            anomaly_result = F.softmax(result, dim=0)[-1]
+    # Anomaly images with their ground truth, decoded by the loader workers
+    patterns = args.input if isinstance(args.input, list) else [args.input]
+    filenames = anomaly_filenames(patterns)
+
+    # one set of metrics per dataset, for all of them on every shard so that the shards merge key by key
+    datasets = sorted({anomaly_dataset_name(f) for f in filenames})
+    anomaly_hists = {dataset: scorer_hists(args, configs) for dataset in datasets}
+    quantized_hists = {dataset: scorer_hists(args, configs) for dataset in datasets}
+    anomaly_score_lists = {dataset: {name: [] for name, _, _ in configs} for dataset in datasets}
+    ood_gts_list = {dataset: [] for dataset in datasets}
+
+    # Precomputed masks: images without anomalies are dropped before loading anything
+    mask_store = None
+    if args.mask_store and args.tiled:
+        print(f"Warning: the mask store {args.mask_store} holds {INPUT_SIZE} masks, decoding the labels at native resolution")
+    elif args.mask_store:
+        mask_store = MaskStore(args.mask_store, INPUT_SIZE)
+        missing = [f for f in filenames if f not in mask_store]
+        if missing:
+            print(f"Warning: {len(missing)} images not in the mask store {args.mask_store}, decoding the labels")
+            mask_store = None
         else:
-            result = result[:-1]  # remove background class
-            if args.method == "MSP":
-                softmax_probs = F.softmax(result / args.temperature, dim=0)
-                anomaly_result = 1.0 - torch.max(softmax_probs, dim=0)[0]
-            elif args.method == "MaxLogit":
-                anomaly_result = -torch.max(result, dim=0)[0]
-            elif args.method == "MaxEntropy":
-                anomaly_result = torch.div(
-                    torch.sum(-F.softmax(result, dim=0) * F.log_softmax(result, dim=0), dim=0),
-                    torch.log(torch.tensor(result.size(0))),
-                )
-
-        anomaly_result = anomaly_result.data.cpu().numpy()
-        # anomaly_result = 1.0 - np.max(result.squeeze(0).data.cpu().numpy(), axis=0)            
-        pathGT = path.replace("images", "labels_masks")                
-        if "RoadObsticle21" in pathGT:
-           pathGT = pathGT.replace("webp", "png")
-        if "fs_static" in pathGT:
-           pathGT = pathGT.replace("jpg", "png")                
-        if "RoadAnomaly" in pathGT:
-           pathGT = pathGT.replace("jpg", "png")  
-
-        mask = Image.open(pathGT)
-        ood_gts = np.array(mask_transform(mask))    # (512, 1024)
-
-        if "RoadAnomaly" in pathGT:
-            ood_gts = np.where((ood_gts==2), 1, ood_gts)
-        if "LostAndFound" in pathGT:
-            ood_gts = np.where((ood_gts==0), 255, ood_gts)
-            ood_gts = np.where((ood_gts==1), 0, ood_gts)
-            ood_gts = np.where((ood_gts>1)&(ood_gts<201), 1, ood_gts)
-
-        if "Streethazard" in pathGT:
-            ood_gts = np.where((ood_gts==14), 255, ood_gts)
-            ood_gts = np.where((ood_gts<20), 0, ood_gts)
-            ood_gts = np.where((ood_gts==255), 1, ood_gts)
-
-        if 1 not in np.unique(ood_gts):
-            continue              
+            filenames = [f for f in filenames if mask_store.has_anomaly(f)]
+    filenames = shard_items(sorted(filenames), shard_index, num_shards)
+
+    # Logits of previous runs with the same weights, model and resolution (or tiling) are read back from disk
+    cache = None
+    if args.logit_cache:
+        cache = LogitCache(args.logit_cache, weightspath, args.loadModel, resolution,
+                           max_bytes=int(args.logit_cache_gb * 2**30))
+    # images are decoded unless every logit is cached; the network runs only on the images missing from the cache
+    all_cached = cache is not None and all(f in cache for f in filenames)
+    if all_cached:
+        print("All logits found in cache, skipping inference")
+
+    dataset = AnomalyDataset(filenames, input_transform, target_transform, load_images=not all_cached or quantized is not None,
+                             mask_store=mask_store)
+    loader = DataLoader(dataset, num_workers=args.num_workers, batch_size=args.batch_size, shuffle=False,
+                        pin_memory=not args.cpu)
+
+    cache_hits, cache_full = 0, False
+    for step, (images, labels, paths) in enumerate(loader):
+        labels = labels.to(device, non_blocking=True)
+        logits = [cache.get(path) for path in paths] if cache is not None else [None] * len(paths)
+        missing = [i for i, l in enumerate(logits) if l is None]
+        cache_hits += len(paths) - len(missing)
+        if missing and images.numel() == 0:    # evicted since the lookup by another run sharing the cache
+            images = torch.stack([loader.dataset.read_image(path) for path in paths])
+
+        if missing:
+            inputs = images[missing].to(device, non_blocking=True)
+            with torch.no_grad():
+                if engine is not None:
+                    outputs = engine(inputs)
+                elif args.loadModel == "bisenet":
+                    outputs = model(inputs)[0]
+                else:
+                    outputs = model(inputs)
+            for i, output in zip(missing, outputs):
+                logits[i] = output
+                if cache is not None and not cache.put(paths[i], output) and not cache_full:
+                    cache_full = True
+                    print(f"Warning: the logit cache is full (--logit-cache-gb {args.logit_cache_gb}), the logits of "
+                          f"the remaining images are not cached; about {len(filenames) * output.numel() * 2 / 2**30:.1f} "
+                          f"GB are needed for the {len(filenames)} images of this run")
+        if len(missing) == len(paths):
+            result = outputs
         else:
-             ood_gts_list.append(ood_gts)
-             anomaly_score_list.append(anomaly_result)
-        del result, anomaly_result, ood_gts, mask
-        torch.cuda.empty_cache()
-
-    file.write( "\n")
-
-    ood_gts = np.array(ood_gts_list)
-    anomaly_scores = np.array(anomaly_score_list)
-
-    ood_mask = (ood_gts == 1)
-    ind_mask = (ood_gts == 0)
-
-    ood_out = anomaly_scores[ood_mask]
-    ind_out = anomaly_scores[ind_mask]
-
-    ood_label = np.ones(len(ood_out))
-    ind_label = np.zeros(len(ind_out))
-    
-    val_out = np.concatenate((ind_out, ood_out))
-    val_label = np.concatenate((ind_label, ood_label))
-
-    prc_auc = average_precision_score(val_label, val_out)
-    fpr = fpr_at_95_tpr(val_out, val_label)
-
-    print(f'| AUPRC score: {prc_auc*100.0:>6.3f}', end = " ")
-    print(f'| FPR@TPR95: {fpr*100.0:>6.3f}')
+            result = torch.stack([l.to(device, torch.float32) for l in logits])
+        # print(result.shape) torch.Size([B, 20, 512, 1024])
+
+        anomaly_results = anomaly_scores(result, configs)
+        if quantized is not None:
+            with torch.inference_mode():
+                quantized_results = anomaly_scores(quantized_engine(images.cpu()).to(device), configs)
+
+        for i in range(labels.size(0)):
+            ood_gts = labels[i]     # (512, 1024)
+            if mask_store is None and not (ood_gts == 1).any():
+                continue
+            dataset = anomaly_dataset_name(paths[i])
+            for name, anomaly_result in anomaly_results.items():
+                anomaly_hists[dataset][name].add(anomaly_result[i], ood_gts)
+                if quantized is not None:
+                    quantized_hists[dataset][name].add(quantized_results[name][i], ood_gts)
+            if args.exact_metrics:
+                ood_gts_list[dataset].append(ood_gts.cpu().numpy())
+                for name, anomaly_result in anomaly_results.items():
+                    anomaly_score_lists[dataset][name].append(anomaly_result[i].cpu().numpy())
+
+    if cache is not None:
+        print(f"Logit cache: {cache_hits} of {len(filenames)} images read from {args.logit_cache}")
+
+    return {'anomaly_hists': anomaly_hists, 'quantized_hists': quantized_hists if quantized is not None else None,
+            'anomaly_score_lists': anomaly_score_lists, 'ood_gts_list': ood_gts_list}
+
+def merge_state(state, other):
+    """Merge the state of the next shard of evaluate() into 'state' (pixels of --exact-metrics kept in image order)."""
+    for dataset, hists in state['anomaly_hists'].items():
+        for name, hist in hists.items():
+            hist.merge(other['anomaly_hists'][dataset][name])
+            if state['quantized_hists'] is not None:
+                state['quantized_hists'][dataset][name].merge(other['quantized_hists'][dataset][name])
+            state['anomaly_score_lists'][dataset][name].extend(other['anomaly_score_lists'][dataset][name])
+        state['ood_gts_list'][dataset].extend(other['ood_gts_list'][dataset])
+    return state
+
+def report_scorer(args, file, dataset_name, name, hist, quantized_hist, anomaly_score_list, ood_gts_list):
+    """Print and write the row of one scorer in the results table of a dataset."""
+    metrics = hist.compute()
+    prc_auc = metrics['auprc']
+    fpr = metrics['fpr95']
+
+    print(f'{name:<16}', end = " ")
+    print(f'| AUPRC score: {prc_auc*100.0:>6.3f} (+/- {metrics["auprc_err"]*100.0:.3f})', end = " ")
+    print(f'| AUROC: {metrics["auroc"]*100.0:>6.3f} (+/- {metrics["auroc_err"]*100.0:.3f})', end = " ")
+    print(f'| FPR@TPR95: {fpr*100.0:>6.3f} (+/- {metrics["fpr95_err"]*100.0:.3f})')
+    if quantized_hist is not None:
+        quantized_metrics = quantized_hist.compute()
+        print(f'{"  int8":<16} | AUPRC score: {quantized_metrics["auprc"]*100.0:>6.3f} (delta {(quantized_metrics["auprc"]-prc_auc)*100.0:+.3f})', end = " ")
+        print(f'| FPR@TPR95: {quantized_metrics["fpr95"]*100.0:>6.3f} (delta {(quantized_metrics["fpr95"]-fpr)*100.0:+.3f})')
+    if metrics['clipped'] > 0:
+        print(f"Warning: {metrics['clipped']} {name} scores outside the range {hist.low, hist.high} were clipped, consider --score-range")
+
+    if args.exact_metrics:
+        ood_gts = np.array(ood_gts_list)
+        anomaly_scores_np = np.array(anomaly_score_list)
+
+        ood_mask = (ood_gts == 1)
+        ind_mask = (ood_gts == 0)
+
+        ood_out = anomaly_scores_np[ood_mask]
+        ind_out = anomaly_scores_np[ind_mask]
+
+        ood_label = np.ones(len(ood_out))
+        ind_label = np.zeros(len(ind_out))
+
+        val_out = np.concatenate((ind_out, ood_out))
+        val_label = np.concatenate((ind_label, ood_label))
+
+        print(f'{"":<16} | Exact AUPRC score: {average_precision_score(val_label, val_out)*100.0:>6.3f}', end = " ")
+        print(f'| Exact FPR@TPR95: {fpr_at_95_tpr(val_out, val_label)*100.0:>6.3f}')
 
     # Plot PR and ROC curve (see re-implementations in plots.py)
     if args.plotdir:
         os.makedirs(args.plotdir, exist_ok=True)    # True to avoid OSError if target already exists
-        plot_pr(val_out, val_label, title="Precision-Recall Curve", save_dir=args.plotdir, 
-                file_name=f"PR_curve_{args.method}_{args.loadModel}")
-        plot_roc(val_out, val_label, title="ROC Curve", save_dir=args.plotdir, 
-                file_name=f"ROC_curve_{args.method}_{args.loadModel}")
-        # plot_barcode(val_out, val_label, title="Barcode Plot", save_dir=args.plotdir, 
-        #         file_name=f"ROC_curve_{args.method}_{args.loadModel}")
-
-    file.write(('    AUPRC score:' + str(prc_auc*100.0) + '   FPR@TPR95:' + str(fpr*100.0) ))
+        plot_pr_hist(hist, title=f"Precision-Recall Curve ({dataset_name})", save_dir=args.plotdir, 
+                file_name=f"PR_curve_{dataset_name}_{name}_{args.loadModel}")
+        plot_roc_hist(hist, title=f"ROC Curve ({dataset_name})", save_dir=args.plotdir, 
+                file_name=f"ROC_curve_{dataset_name}_{name}_{args.loadModel}")
+
+    file.write(f"\n    {name:<16}" + '    AUPRC score:' + str(prc_auc*100.0) + '   FPR@TPR95:' + str(fpr*100.0) + '   AUROC:' + str(metrics['auroc']*100.0))
+
+def report(args, state):
+    """Print the metrics of the merged state of evaluate() and append them to results.txt."""
+    if not os.path.exists('results.txt'):
+        open('results.txt', 'w').close()
+    file = open('results.txt', 'a')
+
+    configs = scorer_configs(args.method, args.temperature)
+
+    # one results table per dataset, one row per scorer
+    for dataset_name in sorted(state['anomaly_hists']):
+        anomaly_hists = state['anomaly_hists'][dataset_name]
+        quantized_hists = state['quantized_hists'][dataset_name] if state['quantized_hists'] is not None else None
+        anomaly_score_lists, ood_gts_list = state['anomaly_score_lists'][dataset_name], state['ood_gts_list'][dataset_name]
+        if all(hist.hist is None for hist in anomaly_hists.values()):
+            print(f"Warning: no image of {dataset_name} has anomalous pixels, no metrics")
+            continue
+
+        file.write( "\n")
+        file.write(f"{dataset_name} ({args.loadModel}, {args.loadWeights})")
+
+        print(f"{dataset_name} ({args.loadModel}, {args.loadWeights})")
+        for name, _, _ in configs:
+            report_scorer(args, file, dataset_name, name, anomaly_hists[name],
+                          quantized_hists[name] if quantized_hists is not None else None,
+                          anomaly_score_lists[name], ood_gts_list)
     file.close()
 
 if __name__ == '__main__':
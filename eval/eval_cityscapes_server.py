@@ -6,6 +6,7 @@
 import numpy as np
 import torch
 import os
+import sys
 import importlib
 
 from PIL import Image
@@ -17,8 +18,11 @@ from torchvision.transforms import Compose, CenterCrop, Normalize, Resize
 from torchvision.transforms import ToTensor, ToPILImage
 
 from dataset import cityscapes
-from erfnet import ERFNet
-from transform import Relabel, ToLabel, Colorize
+from transform import Relabel, LabelMap, ToLabel, Colorize
+from result_writer import ResultWriter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from train.model_registry import MODELS, load_model
 
 
 NUM_CHANNELS = 3
@@ -36,30 +40,11 @@ target_transform_cityscapes = Compose([
     Relabel(255, 19),   #ignore label to 19
 ])
 
-cityscapes_trainIds2labelIds = Compose([
-    Relabel(19, 255),  
-    Relabel(18, 33),
-    Relabel(17, 32),
-    Relabel(16, 31),
-    Relabel(15, 28),
-    Relabel(14, 27),
-    Relabel(13, 26),
-    Relabel(12, 25),
-    Relabel(11, 24),
-    Relabel(10, 23),
-    Relabel(9, 22),
-    Relabel(8, 21),
-    Relabel(7, 20),
-    Relabel(6, 19),
-    Relabel(5, 17),
-    Relabel(4, 13),
-    Relabel(3, 12),
-    Relabel(2, 11),
-    Relabel(1, 8),
-    Relabel(0, 7),
-    Relabel(255, 0),
-    ToPILImage(),
-    Resize(1024, Image.NEAREST),
+# the 21 relabels compiled into a single gather, the resize to 1024 is done by the ResultWriter encoders
+cityscapes_trainIds2labelIds = LabelMap([
+    (19, 255), (18, 33), (17, 32), (16, 31), (15, 28), (14, 27), (13, 26),
+    (12, 25), (11, 24), (10, 23), (9, 22), (8, 21), (7, 20), (6, 19),
+    (5, 17), (4, 13), (3, 12), (2, 11), (1, 8), (0, 7), (255, 0),
 ])
 
 def main(args):
@@ -70,26 +55,10 @@ def main(args):
     print ("Loading model: " + modelpath)
     print ("Loading weights: " + weightspath)
 
-    #Import ERFNet model from the folder
-    #Net = importlib.import_module(modelpath.replace("/", "."), "ERFNet")
-    model = ERFNet(NUM_CLASSES)
-
-    model = torch.nn.DataParallel(model)
+    device = torch.device('cpu' if args.cpu else 'cuda')
+    model = load_model(args.model, weightspath, device, strict=args.strict)   # any checkpoint format, key mismatches reported
     if (not args.cpu):
-        model = model.cuda()
-
-    #model.load_state_dict(torch.load(args.state))
-    #model.load_state_dict(torch.load(weightspath)) #not working if missing key
-
-    def load_my_state_dict(model, state_dict):  #custom function to load model when not all dict elements
-        own_state = model.state_dict()
-        for name, param in state_dict.items():
-            if name not in own_state:
-                 continue
-            own_state[name].copy_(param)
-        return model
-
-    model = load_my_state_dict(model, torch.load(weightspath))
+        model = torch.nn.DataParallel(model)
     print ("Model and weights LOADED successfully")
 
     model.eval()
@@ -101,6 +70,9 @@ def main(args):
     loader = DataLoader(cityscapes(args.datadir, input_transform_cityscapes, target_transform_cityscapes, subset=args.subset),
         num_workers=args.num_workers, batch_size=args.batch_size, shuffle=False)
 
+    # predictions are resized and PNG-encoded in the background while the next batch runs
+    writer = ResultWriter(args.num_writers, args.compress_level, args.max_pending, args.writer_processes)
+
     for step, (images, labels, filename, filenameGt) in enumerate(loader):
         if (not args.cpu):
             images = images.cuda()
@@ -110,19 +82,21 @@ def main(args):
         #targets = Variable(labels)
         with torch.no_grad():
             outputs = model(inputs)
+            if isinstance(outputs, tuple):  # BiSeNet: main output first
+                outputs = outputs[0]
 
-        label = outputs[0].max(0)[1].byte().cpu().data
-        label_cityscapes = cityscapes_trainIds2labelIds(label.unsqueeze(0))
+        label = outputs.max(1)[1].byte()
+        label_cityscapes = cityscapes_trainIds2labelIds(label).cpu().numpy()
         #print (numpy.unique(label.numpy()))  #debug
 
-        filenameSave = "./save_results/" + filename[0].split("leftImg8bit/")[1]
-        os.makedirs(os.path.dirname(filenameSave), exist_ok=True)
-        #image_transform(label.byte()).save(filenameSave)
-        label_cityscapes.save(filenameSave)
+        for i in range(label_cityscapes.shape[0]):
+            filenameSave = "./save_results/" + filename[i].split("leftImg8bit/")[1]
+            writer.put(label_cityscapes[i], filenameSave, height=1024)
+
+            print (step, filenameSave)
 
-        print (step, filenameSave)
+    writer.close()
 
-    
 
 if __name__ == '__main__':
     parser = ArgumentParser()
@@ -132,10 +106,16 @@ if __name__ == '__main__':
     parser.add_argument('--loadDir',default="../trained_models/")
     parser.add_argument('--loadWeights', default="erfnet_pretrained.pth")
     parser.add_argument('--loadModel', default="erfnet.py")
+    parser.add_argument('--model', default="erfnet", choices=list(MODELS))
     parser.add_argument('--subset', default="val")  #can be val, test, train, demoSequence
     parser.add_argument('--datadir', default=os.getenv("HOME") + "/datasets/cityscapes/")
     parser.add_argument('--num-workers', type=int, default=4)
     parser.add_argument('--batch-size', type=int, default=1)
     parser.add_argument('--cpu', action='store_true')
+    parser.add_argument('--strict', action='store_true')  # fail on missing, unexpected or mismatched checkpoint keys
+    parser.add_argument('--num-writers', type=int, default=4)   # PNG encoder threads (or processes)
+    parser.add_argument('--writer-processes', action='store_true')  # encode in processes instead of threads
+    parser.add_argument('--compress-level', type=int, default=6)    # PNG compression level 0-9
+    parser.add_argument('--max-pending', type=int, default=32)  # results queued before the loop blocks
 
     main(parser.parse_args())
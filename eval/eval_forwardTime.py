@@ -1,70 +1,183 @@
-# Code to evaluate forward pass time in Pytorch
+# Code to benchmark forward pass latency and throughput in Pytorch
 # Sept 2017
 # Eduardo Romera
 #######################
+#
+# Runs every combination of models x batch sizes x resolutions x thread counts x
+# precisions for a fixed number of iterations after a warmup, and reports p50/p90/p99
+# latency, images per second and peak memory. Each configuration runs in a fresh
+# process (unless --no-isolate), so the peak RSS is that of the configuration alone.
+# Results are written to JSON and/or CSV to diff regressions between commits.
 
 import os
-import numpy as np
-import torch
+import sys
+import csv
+import json
 import time
+import torch
+import platform
+import resource
+import subprocess
+import numpy as np
+import multiprocessing
 
-from PIL import Image
 from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../train')))
+
+# Import networks
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from train.model_registry import build_model as registry_build_model
+
+NUM_CLASSES = 20
+
+MODELS = ["erfnet", "erfnet_isomaxplus", "enet", "bisenet",
+          "erfnet_fused", "erfnet_isomaxplus_fused", "enet_fused", "bisenet_fused"]
+
+PRECISIONS = {
+    "fp32": None,
+    "fp16": torch.float16,
+    "bf16": torch.bfloat16,
+}
+
+
+def build_model(name):
+    """Inference model of the given architecture, randomly initialized ('_fused': BatchNorms folded, see fuse_model.py)."""
+    if name.endswith("_fused"):
+        from fuse_model import fuse_model
+        return fuse_model(build_model(name[:-len("_fused")]), inplace=True)
+    elif name == "bisenet":
+        return registry_build_model(name, NUM_CLASSES, aux_mode='eval')    # no auxiliary heads at inference
+    return registry_build_model(name, NUM_CLASSES)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (ru_maxrss is in KB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def run_config(config, warmup, iters, device):
+    """
+    Benchmark one configuration.
+
+    Parameters:
+        - config (dict): 'model', 'batch_size', 'height', 'width', 'threads' and 'precision'.
+        - warmup (int): Untimed iterations run first (allocations, cudnn autotuning, ...).
+        - iters (int): Timed iterations.
+        - device (str): 'cpu' or 'cuda'.
+
+    Returns:
+        - dict: The configuration with the latency percentiles (ms), throughput and peak memory.
+    """
+    torch.set_num_threads(config['threads'])
+    torch.backends.cudnn.benchmark = True
+    torch.manual_seed(0)
+
+    model = build_model(config['model']).to(device).eval()
+    images = torch.randn(config['batch_size'], 3, config['height'], config['width'], device=device)
+    dtype = PRECISIONS[config['precision']]
+
+    def forward():
+        with torch.inference_mode(), torch.autocast(device, dtype=dtype, enabled=dtype is not None):
+            model(images)
+        if device == 'cuda':
+            torch.cuda.synchronize()    # wait for cuda to finish (cuda is asynchronous!)
+
+    for _ in range(warmup):
+        forward()
+    if device == 'cuda':
+        torch.cuda.reset_peak_memory_stats()
+
+    latencies = []
+    for _ in range(iters):
+        start_time = time.perf_counter()
+        forward()
+        latencies.append(time.perf_counter() - start_time)
+
+    latencies = np.array(latencies) * 1000.0
+    result = dict(config)
+    result.update({
+        'device': device,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p90_ms': float(np.percentile(latencies, 90)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'mean_ms': float(latencies.mean()),
+        'images_per_s': float(config['batch_size'] * 1000.0 / latencies.mean()),
+        'peak_rss_mb': peak_rss_mb(),
+    })
+    if device == 'cuda':
+        result['peak_cuda_mb'] = torch.cuda.max_memory_allocated() / 2**20
+    return result
+
+
+def environment():
+    """Metadata identifying the run: commit, library versions and machine."""
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except (subprocess.CalledProcessError, OSError):
+        commit = None
+    return {
+        'commit': commit,
+        'torch': torch.__version__,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+    }
 
-from torch.autograd import Variable
-
-from erfnet_nobn import ERFNet
-from transform import Relabel, ToLabel, Colorize
-
-import torch.backends.cudnn as cudnn
-cudnn.benchmark = True
 
 def main(args):
-    model = ERFNet(19)
-    if (not args.cpu):
-        model = model.cuda()#.half()	#HALF seems to be doing slower for some reason
-    #model = torch.nn.DataParallel(model).cuda()
-
-    model.eval()
-
-
-    images = torch.randn(args.batch_size, args.num_channels, args.height, args.width)
-
-    if (not args.cpu):
-        images = images.cuda()#.half()
-
-    time_train = []
-
-    i=0
-
-    while(True):
-    #for step, (images, labels, filename, filenameGt) in enumerate(loader):
-
-        start_time = time.time()
-
-        inputs = Variable(images)
-        with torch.no_grad():
-            outputs = model(inputs)
-
-        #preds = outputs.cpu()
-        if (not args.cpu):
-            torch.cuda.synchronize()    #wait for cuda to finish (cuda is asynchronous!)
-
-        if i!=0:    #first run always takes some time for setup
-            fwt = time.time() - start_time
-            time_train.append(fwt)
-            print ("Forward time per img (b=%d): %.3f (Mean: %.3f)" % (args.batch_size, fwt/args.batch_size, sum(time_train) / len(time_train) / args.batch_size))
-        
-        time.sleep(1)   #to avoid overheating the GPU too much
-        i+=1
+    device = 'cpu' if args.cpu else 'cuda'
+    resolutions = [tuple(int(v) for v in r.lower().split('x')) for r in args.resolutions]
+    configs = [
+        {'model': model, 'batch_size': batch_size, 'height': height, 'width': width,
+         'threads': threads, 'precision': precision}
+        for model in args.models
+        for batch_size in args.batch_sizes
+        for height, width in resolutions
+        for threads in args.threads
+        for precision in args.precisions
+    ]
+
+    results = []
+    for config in configs:
+        if args.no_isolate:
+            result = run_config(config, args.warmup, args.iters, device)
+        else:   # fresh process per configuration, so that peak RSS is not shared
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                result = executor.submit(run_config, config, args.warmup, args.iters, device).result()
+        results.append(result)
+        print(f"{result['model']:<18} b={result['batch_size']:<3} {result['height']}x{result['width']:<5} "
+              f"threads={result['threads']:<3} {result['precision']:<5} | p50 {result['p50_ms']:8.2f} ms "
+              f"| p90 {result['p90_ms']:8.2f} ms | p99 {result['p99_ms']:8.2f} ms "
+              f"| {result['images_per_s']:7.2f} img/s | peak RSS {result['peak_rss_mb']:7.1f} MB")
+
+    if args.output_json:
+        with open(args.output_json, 'w') as f:
+            json.dump({'environment': environment(), 'warmup': args.warmup, 'iters': args.iters,
+                       'results': results}, f, indent=2)
+    if args.output_csv:
+        with open(args.output_csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0].keys()))
+            writer.writeheader()
+            writer.writerows(results)
 
 if __name__ == '__main__':
     parser = ArgumentParser()
 
-    parser.add_argument('--width', type=int, default=1024)
-    parser.add_argument('--height', type=int, default=512)
-    parser.add_argument('--num-channels', type=int, default=3)
-    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--models', nargs='+', default=["erfnet", "erfnet_isomaxplus", "enet", "bisenet"])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1])
+    parser.add_argument('--resolutions', nargs='+', default=["512x1024"])    # HEIGHTxWIDTH
+    parser.add_argument('--threads', type=int, nargs='+', default=[torch.get_num_threads()])  # intra-op threads
+    parser.add_argument('--precisions', nargs='+', default=["fp32"], choices=list(PRECISIONS))
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--iters', type=int, default=50)
     parser.add_argument('--cpu', action='store_true')
+    parser.add_argument('--no-isolate', action='store_true')    # run every configuration in this process
+    parser.add_argument('--output-json', default=None)
+    parser.add_argument('--output-csv', default=None)
 
     main(parser.parse_args())
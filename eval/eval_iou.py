@@ -14,19 +14,19 @@ from PIL import Image
 from argparse import ArgumentParser
 
 from torch.autograd import Variable
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Subset
 from torchvision.transforms import ToTensor, ToPILImage
 from torchvision.transforms import Compose, CenterCrop, Normalize, Resize
 
 from dataset import cityscapes
 from transform import Relabel, ToLabel, Colorize
 from iouEval import iouEval, getColorEntry
+from eval_utils import add_tiled_arguments, check_tiled_arguments
+from sharded_eval import run_sharded, shard_items
 
 # Import networks
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from train.erfnet import ERFNet
-from train.enet import ENet
-from train.bisenet import BiSeNet
+from train.model_registry import MODELS, load_model
 
 
 NUM_CHANNELS = 3
@@ -45,8 +45,15 @@ target_transform_cityscapes = Compose([
     Relabel(255, 19),   #ignore label to 19
 ])
 
-def main(args):
+# native resolution (1024x2048), for tiled inference
+input_transform_native = ToTensor()
+target_transform_native = Compose([
+    ToLabel(),
+    Relabel(255, 19),
+])
 
+def evaluate(args, shard_index=0, num_shards=1):
+    """Confusion matrices (fp32 and int8 iouEval) of the images of one shard of the subset."""
     modelpath = args.loadDir + args.loadModel
     weightspath = args.loadDir + args.loadWeights
 
@@ -54,81 +61,45 @@ def main(args):
     print ("Loading weights: " + weightspath)
 
     device = torch.device('cuda' if torch.cuda.is_available() and not args.cpu else 'cpu')
-    if args.model == "erfnet":
-      model = ERFNet(NUM_CLASSES).to(device)
-    elif args.model == "erfnet_isomaxplus":
-      model = ERFNet(NUM_CLASSES, use_isomaxplus=True).to(device)
-    elif args.model =="enet":
-        model = ENet(NUM_CLASSES).to(device)
-    elif args.model == "bisenet":
-        model = BiSeNet(NUM_CLASSES).to(device)
-
-    #model = torch.nn.DataParallel(model) //non carica modello su gpu
-    if (not args.cpu):
-        model = torch.nn.DataParallel(model).cuda()
-
-    '''def load_my_state_dict(model, state_dict):  #custom function to load model when not all dict elements
-        own_state = model.state_dict()
-        for name, param in state_dict.items():
-            if name not in own_state:
-                if name.startswith("module."):
-                    own_state[name.split("module.")[-1]].copy_(param)
-                else:
-                    print(name, " not loaded")
-                    continue
-            else:
-                own_state[name].copy_(param)
-        return model'''
-    
-    def load_my_state_dict(model, state_dict):  #custom function to load model when not all dict elements
-        own_state = model.state_dict()
-        # ['module.encoder.initial_block.conv.weight', 'module.encoder.initial_block.conv.bias', 
-        # 'module.encoder.initial_block.bn.weight', 'module.encoder.initial_block.bn.bias', ... ]
-        # print(state_dict.keys())
-        # print(own_state.keys())
-        # Check if the model is 'erfnet_isomaxplus'and load the state dict for IsoMaxPlusLossFirstPart
-        if args.model == "erfnet_isomaxplus" and 'loss_first_part_state_dict' in state_dict:
-            # Get the state dict for IsoMaxPlusLossFirstPart
-            loss_first_part_state_dict = state_dict['loss_first_part_state_dict']
-            # Load the state dict for IsoMaxPlusLossFirstPart
-            if hasattr(model.module.decoder, 'loss_first_part'):
-                model.module.decoder.loss_first_part.load_state_dict(loss_first_part_state_dict)
-            else:
-                raise ValueError("IsoMaxPlusLossFirstPart not found in the model")
-
-        if 'state_dict' in state_dict:
-            load_dict = state_dict['state_dict'] 
-        else:
-            load_dict = state_dict
-
-        for name, param in load_dict.items():
-            if name not in own_state:
-                if name.startswith("module."):
-                    own_state[name.split("module.")[-1]].copy_(param)
-                else:
-                    print(name, " not loaded")
-                    continue
-            else:
-                own_state[name].copy_(param)
-        return model
-    
-    weightspath = args.loadDir + args.loadWeights # serve davvero?
-    model = load_my_state_dict(model, torch.load(weightspath, map_location=lambda storage, loc: storage))
+    model = load_model(args.model, weightspath, device, strict=args.strict)   # any checkpoint format, key mismatches reported
     print ("Model and weights LOADED successfully")
 
+    if (not args.cpu):
+        model = torch.nn.DataParallel(model)
+
     model.eval()
+    if args.fuse:
+        from fuse_model import fuse_model
+        model = fuse_model(model, inplace=True)    # BatchNorms folded into the convs
+
+    # int8 model of quantize_model.py, evaluated on the CPU next to the fp32 one
+    quantized = None
+    if args.quantized:
+        from quantize_model import load_quantized    # torch.ao.quantization only when needed
+        quantized = load_quantized(args.quantized)
+
+    # Tiled inference: images and labels at their native resolution, logits blended from tiles
+    if args.tiled:
+        from tiled_inference import tiled_from_args
+        model = tiled_from_args(model, args)
+        quantized = tiled_from_args(quantized, args) if quantized is not None else None
+        input_transform, target_transform = input_transform_native, target_transform_native
+    else:
+        input_transform, target_transform = input_transform_cityscapes, target_transform_cityscapes
 
     if(not os.path.exists(args.datadir)):
         print ("Error: datadir could not be loaded")
 
-    loader = DataLoader(cityscapes(args.datadir, input_transform_cityscapes, target_transform_cityscapes, subset=args.subset), num_workers=args.num_workers, batch_size=args.batch_size, shuffle=False)
+    dataset = cityscapes(args.datadir, input_transform, target_transform, subset=args.subset)
+    if num_shards > 1:
+        dataset = Subset(dataset, shard_items(range(len(dataset)), shard_index, num_shards))
+    loader = DataLoader(dataset, num_workers=args.num_workers, batch_size=args.batch_size, shuffle=False)
 
     if args.method == "void":
-        iouEvalVal = iouEval(NUM_CLASSES, 20)
+        iouEvalVal = iouEval(NUM_CLASSES, 20, legacy=args.legacy_iou)
     else:
-        iouEvalVal = iouEval(NUM_CLASSES)
-
-    start = time.time()
+        iouEvalVal = iouEval(NUM_CLASSES, legacy=args.legacy_iou)
+    iouEvalQuantized = iouEval(NUM_CLASSES, iouEvalVal.ignoreIndex, legacy=args.legacy_iou)
 
     for step, (images, labels, filename, filenameGt) in enumerate(loader):
         if (not args.cpu):
@@ -140,11 +111,31 @@ def main(args):
             outputs = model(inputs)
 
         iouEvalVal.addBatch(outputs.max(1)[1].unsqueeze(1).data, labels)
+        if quantized is not None:
+            with torch.inference_mode():
+                outputs_int8 = quantized(images.cpu())
+            iouEvalQuantized.addBatch(outputs_int8.max(1)[1].unsqueeze(1), labels.cpu())
 
         filenameSave = filename[0].split("leftImg8bit/")[1] 
 
         # print (step, filenameSave)
 
+    return iouEvalVal, (iouEvalQuantized if quantized is not None else None)
+
+def main(args):
+    start = time.time()
+
+    if args.shards > 1:
+        # each shard returns its confusion matrices, merged into the metrics of the whole subset
+        shards = run_sharded(evaluate, args, args.shards, args.shard_threads)
+        iouEvalVal, iouEvalQuantized = shards[0]
+        for shardVal, shardQuantized in shards[1:]:
+            iouEvalVal.merge(shardVal)
+            if iouEvalQuantized is not None:
+                iouEvalQuantized.merge(shardQuantized)
+    else:
+        iouEvalVal, iouEvalQuantized = evaluate(args)
+
     iouVal, iou_classes = iouEvalVal.getIoU()
 
     iou_classes_str = []
@@ -181,6 +172,14 @@ def main(args):
     print("=======================================")
     iouStr = getColorEntry(iouVal)+'{:0.2f}'.format(iouVal*100) + '\033[0m'
     print ("MEAN IoU: ", iouStr, "%")
+    precisionVal, _ = iouEvalVal.getPrecision()
+    recallVal, _ = iouEvalVal.getRecall()
+    print ("MEAN Precision: ", '{:0.2f}'.format(precisionVal*100), "%")
+    print ("MEAN Recall: ", '{:0.2f}'.format(recallVal*100), "%")
+    print ("Pixel Accuracy: ", '{:0.2f}'.format(iouEvalVal.getPixelAccuracy()*100), "%")
+    if iouEvalQuantized is not None:
+        iouQuantized, _ = iouEvalQuantized.getIoU()
+        print ("int8 MEAN IoU: ", '{:0.2f}'.format(iouQuantized*100), "% (delta", '{:+0.2f}'.format((iouQuantized-iouVal)*100), ")")
 
 if __name__ == '__main__':
     parser = ArgumentParser()
@@ -194,8 +193,19 @@ if __name__ == '__main__':
     parser.add_argument('--datadir', default="/home/shyam/ViT-Adapter/segmentation/data/cityscapes/")
     parser.add_argument('--num-workers', type=int, default=2)   # to avoid UserWarning of excessive worker creation
     parser.add_argument('--batch-size', type=int, default=1)
-    parser.add_argument('--model', default="erfnet") # can be erfnet, erfnet_isomaxplus, enet, bisenet
+    parser.add_argument('--model', default="erfnet", choices=list(MODELS))
     parser.add_argument('--method', action='store_true')  # can be MSP, MaxLogit, MaxEntropy, void
     parser.add_argument('--cpu', action='store_true')
-
-    main(parser.parse_args())
+    parser.add_argument('--strict', action='store_true')  # fail on missing, unexpected or mismatched checkpoint keys
+    parser.add_argument('--fuse', action='store_true')  # fold BatchNorms and drop dropouts before inference
+    parser.add_argument('--quantized', default=None)  # int8 model of quantize_model.py, also evaluated
+    parser.add_argument('--legacy-iou', action='store_true')  # original one-hot IoU accumulation, for regression comparison
+    add_tiled_arguments(parser)  # --tiled: native resolution, sliding-window inference (tiled_inference.py)
+    parser.add_argument('--shards', type=int, default=1)  # CPU worker processes, each pinned to its own cores (sharded_eval.py)
+    parser.add_argument('--shard-threads', type=int, default=None)  # intra-op threads per shard, default its number of cores
+
+    args = parser.parse_args()
+    if args.shards > 1 and not args.cpu:
+        parser.error("--shards evaluates on the CPU, add --cpu")
+    check_tiled_arguments(parser, args)
+    main(args)
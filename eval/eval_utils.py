@@ -0,0 +1,41 @@
+# ========================================================================
+# Small helpers shared by the evaluation scripts
+#
+# Kept apart from the modules using them (layer_profiler.py, fuse_model.py,
+# tiled_inference.py) so that importing a helper never pulls in a profiler or
+# an optional feature: this module only imports torch. The evaluation scripts
+# import the feature modules themselves lazily, when their flag is set.
+# ========================================================================
+
+import torch
+
+# blending windows of the tile logits of tiled_inference.TiledInference
+WINDOWS = ["gaussian", "hann", "uniform"]
+
+
+def tensors(output):
+    """Tensors of a module output (tensor, tuple, list or dict)."""
+    if torch.is_tensor(output):
+        return [output]
+    if isinstance(output, (list, tuple)):
+        return [t for o in output for t in tensors(o)]
+    if isinstance(output, dict):
+        return [t for o in output.values() for t in tensors(o)]
+    return []
+
+
+def add_tiled_arguments(parser):
+    """Command line options of tiled_inference.TiledInference, shared by eval_iou.py and evalAnomaly.py."""
+    parser.add_argument('--tiled', action='store_true')  # native resolution, sliding-window inference (needs --batch-size 1)
+    parser.add_argument('--tile-size', type=int, nargs=2, default=[512, 1024])  # HEIGHT WIDTH
+    parser.add_argument('--tile-overlap', type=float, default=0.25)
+    parser.add_argument('--scales', type=float, nargs='+', default=[1.0])
+    parser.add_argument('--flip', action='store_true')
+    parser.add_argument('--window', default="gaussian", choices=WINDOWS)
+    parser.add_argument('--memory-budget-mb', type=float, default=None)  # default half of the free memory
+
+
+def check_tiled_arguments(parser, args):
+    """Images keep their native (possibly different) sizes with --tiled, so they cannot be collated in batches."""
+    if args.tiled and args.batch_size > 1:
+        parser.error("--tiled evaluates every image at its native resolution, use --batch-size 1")
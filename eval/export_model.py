@@ -0,0 +1,144 @@
+# ========================================================================
+# TorchScript / ONNX export of the segmentation models
+#
+# Builds an architecture, loads a checkpoint (optionally folding its
+# BatchNorms, see fuse_model.py) and writes self-contained graphs that
+# run_exported.py executes without the Python model code of train/:
+# - {name}.pt    TorchScript (traced), metadata in the 'meta.json' extra file
+# - {name}.onnx  ONNX, metadata in the model metadata_props
+# With --anomaly, the anomaly scorer (MSP, MaxLogit, MaxEntropy or void,
+# anomaly_scores.py) is traced into the graph, so the output is directly the
+# per-pixel anomaly map [B, H, W] instead of the logits [B, C, H, W].
+#
+# The graphs are traced at --height x --width: the batch size is dynamic, the
+# resolution is fixed (ENet output sizes and ERFNet/BiSeNet upsampling are
+# recorded for that input size), and so is the device: export with --cuda the
+# graphs meant to run on a GPU.
+#
+# Example:
+#   python export_model.py --model erfnet --loadWeights ../trained_models/erfnet_pretrained.pth \
+#       --anomaly MaxLogit --fuse --output-dir ../exported
+# ========================================================================
+
+import os
+import sys
+import json
+import torch
+import torch.nn as nn
+
+from argparse import ArgumentParser
+
+from anomaly_scores import METHODS, anomaly_scores
+from eval_forwardTime import build_model, NUM_CLASSES
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from train.model_registry import load_checkpoint
+
+EXPORTABLE_MODELS = ["erfnet", "erfnet_isomaxplus", "enet", "bisenet"]
+
+
+class ExportWrapper(nn.Module):
+    """
+    Model followed by an optional anomaly scorer, returning a single tensor.
+
+    Parameters:
+        - model (torch.nn.Module): Segmentation model (BiSeNet in 'eval' mode returns a tuple, its first element is kept).
+        - method (str): Anomaly scoring method of anomaly_scores.py, None to return the logits.
+        - temperature (float): Temperature of the scorer.
+    """
+    def __init__(self, model, method=None, temperature=1.0):
+        super().__init__()
+        self.model = model
+        self.method = method
+        self.temperature = temperature
+
+    def forward(self, input):
+        logits = self.model(input)
+        if isinstance(logits, (tuple, list)):
+            logits = logits[0]
+        if self.method is None:
+            return logits
+        return anomaly_scores(logits, [(self.method, self.method, self.temperature)])[self.method]
+
+
+def export_metadata(args):
+    """Metadata stored next to the graphs, read back by run_exported.py."""
+    return {
+        'model': args.model,
+        'weights': os.path.basename(args.loadWeights),
+        'num_classes': NUM_CLASSES,
+        'height': args.height,
+        'width': args.width,
+        'output': 'anomaly' if args.anomaly else 'logits',
+        'method': args.anomaly,
+        'temperature': args.temperature if args.anomaly else None,
+        'fused': args.fuse,
+        'device': 'cuda' if args.cuda else 'cpu',
+    }
+
+
+def export_torchscript(wrapper, example, path, metadata):
+    with torch.no_grad():
+        traced = torch.jit.trace(wrapper, example, check_trace=False)
+    traced = torch.jit.freeze(traced)  # parameters as constants, dead branches removed
+    torch.jit.save(traced, path, _extra_files={'meta.json': json.dumps(metadata)})
+
+
+def export_onnx(wrapper, example, path, metadata, opset=17):
+    import onnx
+
+    output_name = metadata['output']
+    torch.onnx.export(wrapper, example, path, opset_version=opset, do_constant_folding=True,
+                      input_names=['image'], output_names=[output_name],
+                      dynamic_axes={'image': {0: 'batch'}, output_name: {0: 'batch'}})
+    graph = onnx.load(path)
+    for key, value in metadata.items():
+        graph.metadata_props.add(key=key, value=json.dumps(value))
+    onnx.save(graph, path)
+
+
+def main(args):
+    device = 'cuda' if args.cuda else 'cpu'
+    model = build_model(args.model)
+    load_checkpoint(model, args.loadWeights)
+    model = model.to(device).eval()
+    if args.fuse:
+        from fuse_model import fuse_model
+        model = fuse_model(model, inplace=True)
+    wrapper = ExportWrapper(model, args.anomaly, args.temperature).eval()
+    example = (torch.rand(1, 3, args.height, args.width, device=device),)
+    metadata = export_metadata(args)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    name = args.name or args.model + (f"_{args.anomaly}" if args.anomaly else "")
+    exporters = {
+        'torchscript': (export_torchscript, f"{name}.pt"),
+        'onnx': (lambda *a: export_onnx(*a, opset=args.opset), f"{name}.onnx"),
+    }
+    for fmt in args.formats:
+        export, filename = exporters[fmt]
+        path = os.path.join(args.output_dir, filename)
+        try:
+            export(wrapper, example, path, metadata)
+        except Exception as e:  # e.g. an op without ONNX symbolic, the other formats are still written
+            print(f"Error: {fmt} export of {args.model} failed: {e}")
+            continue
+        print(f"Exported {fmt} to {path} ({os.path.getsize(path) / 2**20:.1f} MB)")
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+
+    parser.add_argument('--model', default="erfnet", choices=EXPORTABLE_MODELS)
+    parser.add_argument('--loadWeights', required=True)
+    parser.add_argument('--formats', nargs='+', default=['torchscript', 'onnx'], choices=['torchscript', 'onnx'])
+    parser.add_argument('--anomaly', default=None, choices=METHODS)  # scorer fused into the graph, logits if not given
+    parser.add_argument('--temperature', type=float, default=1.0)
+    parser.add_argument('--fuse', action='store_true')  # fold BatchNorms before exporting
+    parser.add_argument('--height', type=int, default=512)
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--cuda', action='store_true')  # trace on the GPU, for graphs run on a GPU
+    parser.add_argument('--opset', type=int, default=17)
+    parser.add_argument('--output-dir', default="../exported")
+    parser.add_argument('--name', default=None)  # file name without extension, default model[_method]
+
+    main(parser.parse_args())
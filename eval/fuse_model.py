@@ -0,0 +1,264 @@
+# ========================================================================
+# Inference graph optimization of the segmentation models
+#
+# fuse_model() rewrites an eval-mode ERFNet, ENet or BiSeNet (any checkpoint,
+# wrapped in DataParallel or not) into an equivalent inference-only model:
+# - every BatchNorm following a conv or transposed conv is folded into its
+#   weight and bias, using the running statistics;
+# - in the concat-then-BN blocks (ERFNet DownsamplerBlock, ENet InitialBlock)
+#   the BN channels of the conv branch are folded into the conv, those of the
+#   max pooling branch become a per-channel scale and shift on the pooled input;
+# - Dropout/Dropout2d layers are removed;
+# - ReLUs run in place on the conv outputs, and the ERFNet residual blocks add
+#   the shortcut in place, so no activation tensor is allocated for them.
+# The result is not trainable (BN statistics are frozen into the weights) and
+# replaces the hand-maintained erfnet_nobn.py that was only used for timing.
+#
+# Numerical equivalence check (random BN statistics unless --loadWeights):
+#   python fuse_model.py --model erfnet --cpu
+#   python fuse_model.py --model enet --loadWeights ../trained_models/enet.pth --cpu
+# and for every model, bare and in DataParallel: python -m pytest tests/test_fuse_model.py
+# ========================================================================
+
+import os
+import sys
+import copy
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from argparse import ArgumentParser
+
+from eval_utils import tensors
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from train.model_registry import load_checkpoint
+
+CONVS = (nn.Conv2d, nn.ConvTranspose2d)
+
+# (conv, BatchNorm) attribute pairs of the blocks whose forward() chains them directly,
+# keyed by class name so that the eval/ and train/ copies of the models are both matched
+FOLD_PAIRS = {
+    'UpsamplingBottleneck': [('ext_tconv1', 'ext_tconv1_bnorm')],                           # ENet
+    'ConvBNReLU': [('conv', 'bn')],                                                         # BiSeNet
+    'AttentionRefinementModule': [('conv_atten', 'bn_atten')],
+    'FeatureFusionModule': [('conv', 'bn')],
+    'BasicBlock': [('conv1', 'bn1'), ('conv2', 'bn2')],                                     # ResNet18
+    'Resnet18': [('conv1', 'bn1')],
+}
+
+# blocks concatenating a conv and a max pooling before their BatchNorm: (conv, pool, bn)
+CONCAT_BN = {
+    'DownsamplerBlock': ('conv', 'pool', 'bn'),                                             # ERFNet
+    'InitialBlock': ('main_branch', 'ext_branch', 'batch_norm'),                            # ENet
+}
+
+
+def bn_affine(bn):
+    """Per-channel scale and shift (float64) computed by an eval-mode BatchNorm."""
+    if bn.running_mean is None:
+        raise ValueError("Cannot fold a BatchNorm without running statistics (track_running_stats=False)")
+    scale = torch.rsqrt(bn.running_var.detach().double() + bn.eps)
+    if bn.weight is not None:
+        scale = scale * bn.weight.detach().double()
+    shift = -bn.running_mean.detach().double() * scale
+    if bn.bias is not None:
+        shift = shift + bn.bias.detach().double()
+    return scale, shift
+
+
+def fold_affine(conv, scale, shift):
+    """Copy of a Conv2d / ConvTranspose2d followed by the per-channel affine 'scale * x + shift'."""
+    fused = copy.deepcopy(conv)
+    weight = conv.weight.detach().double()
+    if isinstance(conv, nn.ConvTranspose2d):    # weight [in, out / groups, kh, kw]
+        groups = conv.groups
+        weight = weight.view(groups, -1, *weight.shape[1:]) * scale.view(groups, 1, -1, 1, 1)
+        weight = weight.view_as(conv.weight)
+    else:                                       # weight [out, in / groups, kh, kw]
+        weight = weight * scale.view(-1, 1, 1, 1)
+    bias = conv.bias.detach().double() if conv.bias is not None else torch.zeros_like(scale)
+    fused.weight = nn.Parameter(weight.to(conv.weight.dtype))
+    fused.bias = nn.Parameter((bias * scale + shift).to(conv.weight.dtype))
+    return fused
+
+
+def fold_bn(conv, bn):
+    """Copy of 'conv' with the eval-mode BatchNorm 'bn' that follows it folded into its weight and bias."""
+    return fold_affine(conv, *bn_affine(bn))
+
+
+class FusedDownsampler(nn.Module):
+    """
+    Concatenation of a strided conv and a max pooling followed by a BatchNorm and an
+    activation, with the BN folded: into the conv for its channels, into a per-channel
+    scale and shift of the pooled input for the others.
+    """
+    def __init__(self, conv, pool, bn, activation):
+        super().__init__()
+        scale, shift = bn_affine(bn)
+        n = conv.out_channels
+        self.conv = fold_affine(conv, scale[:n], shift[:n])
+        self.pool = pool
+        self.register_buffer('scale', scale[n:].view(1, -1, 1, 1).to(conv.weight.dtype))
+        self.register_buffer('shift', shift[n:].view(1, -1, 1, 1).to(conv.weight.dtype))
+        self.activation = activation
+
+    def forward(self, input):
+        output = torch.cat([self.conv(input), torch.addcmul(self.shift, self.pool(input), self.scale)], 1)
+        return self.activation(output)
+
+
+class FusedNonBottleneck1d(nn.Module):
+    """ERFNet non_bottleneck_1d with bn1/bn2 folded into conv1x3_1/conv1x3_2, no dropout and in-place ReLUs."""
+    def __init__(self, block):
+        super().__init__()
+        self.conv3x1_1 = block.conv3x1_1
+        self.conv1x3_1 = fold_bn(block.conv1x3_1, block.bn1)
+        self.conv3x1_2 = block.conv3x1_2
+        self.conv1x3_2 = fold_bn(block.conv1x3_2, block.bn2)
+
+    def forward(self, input):
+        output = F.relu_(self.conv3x1_1(input))
+        output = F.relu_(self.conv1x3_1(output))
+        output = F.relu_(self.conv3x1_2(output))
+        output = self.conv1x3_2(output)
+        return F.relu_(output.add_(input))    # +input = identity (residual connection)
+
+
+def fold_sequential(sequential):
+    """nn.Sequential with every (conv, BatchNorm) pair folded and the Identity layers dropped."""
+    layers = []
+    for layer in sequential:
+        if isinstance(layer, nn.BatchNorm2d) and layers and isinstance(layers[-1], CONVS):
+            layers[-1] = fold_bn(layers[-1], layer)
+        elif not isinstance(layer, nn.Identity):
+            layers.append(layer)
+    return nn.Sequential(*layers)
+
+
+def _fuse(module):
+    """Fuse the children of 'module' (bottom-up), then 'module' itself; returns its replacement."""
+    for name, child in list(module.named_children()):
+        setattr(module, name, _fuse(child))
+
+    kind = type(module).__name__
+    if kind in CONCAT_BN:
+        conv, pool, bn = (getattr(module, name) for name in CONCAT_BN[kind])
+        activation = getattr(module, 'out_activation', None) or nn.ReLU(inplace=True)
+        return FusedDownsampler(conv, pool, bn, activation)
+    if kind == 'non_bottleneck_1d':
+        return FusedNonBottleneck1d(module)
+    if kind == 'UpsamplerBlock':
+        return nn.Sequential(fold_bn(module.conv, module.bn), nn.ReLU(inplace=True))
+    for conv_name, bn_name in FOLD_PAIRS.get(kind, []):
+        setattr(module, conv_name, fold_bn(getattr(module, conv_name), getattr(module, bn_name)))
+        setattr(module, bn_name, nn.Identity())
+
+    if isinstance(module, nn.Sequential):
+        return fold_sequential(module)
+    if isinstance(module, (nn.Dropout, nn.Dropout2d)):
+        return nn.Identity()
+    if isinstance(module, nn.ReLU):
+        # every ReLU of these models follows a conv, a BN or a sum whose output is not reused
+        module.inplace = True
+    return module
+
+
+def fuse_model(model, inplace=False):
+    """
+    Inference-only copy of an ERFNet, ENet or BiSeNet with BatchNorms folded, dropouts removed
+    and in-place ReLUs.
+
+    Parameters:
+        - model (torch.nn.Module): Model with loaded weights, optionally wrapped in DataParallel.
+        - inplace (bool): Rewrite 'model' itself instead of a deep copy.
+
+    Returns:
+        - torch.nn.Module: The fused model, in eval mode.
+    """
+    if not inplace:
+        model = copy.deepcopy(model)
+    model.eval()
+    if isinstance(model, nn.DataParallel):
+        model.module = _fuse(model.module)
+        return model
+    return _fuse(model)
+
+
+def count_batchnorms(model):
+    return sum(isinstance(m, nn.modules.batchnorm._BatchNorm) for m in model.modules())
+
+
+def randomize_batchnorms(model, seed=0):
+    """Random BN statistics and affine parameters, so that folding is checked on non-trivial values."""
+    generator = torch.Generator().manual_seed(seed)
+    with torch.no_grad():
+        for m in model.modules():
+            if isinstance(m, nn.modules.batchnorm._BatchNorm):
+                n = m.num_features
+                m.running_mean.copy_(0.1 * torch.randn(n, generator=generator))
+                m.running_var.copy_(0.5 + torch.rand(n, generator=generator))
+                if m.affine:
+                    m.weight.copy_(1.0 + 0.1 * torch.randn(n, generator=generator))
+                    m.bias.copy_(0.1 * torch.randn(n, generator=generator))
+    return model
+
+
+def check_equivalence(model, fused, images):
+    """
+    Compare the outputs of a model and of its fused version on the same images.
+
+    Returns:
+        - dict: 'max_abs_diff', 'max_rel_diff' (to the largest output magnitude) and
+            'argmax_agreement' (fraction of pixels with the same predicted class).
+    """
+    with torch.inference_mode():
+        outputs, fused_outputs = tensors(model(images)), tensors(fused(images))
+    diff = max((a.float() - b.float()).abs().max().item() for a, b in zip(outputs, fused_outputs))
+    magnitude = max(a.float().abs().max().item() for a in outputs)
+    agreement = [(a.argmax(1) == b.argmax(1)).float().mean().item()
+                 for a, b in zip(outputs, fused_outputs) if a.dim() == 4]
+    return {
+        'max_abs_diff': diff,
+        'max_rel_diff': diff / max(magnitude, 1e-12),
+        'argmax_agreement': min(agreement) if agreement else 1.0,
+    }
+
+
+def main(args):
+    from eval_forwardTime import build_model
+
+    device = 'cpu' if args.cpu else 'cuda'
+    torch.manual_seed(0)
+    model = build_model(args.model)
+    if args.loadWeights:
+        load_checkpoint(model, args.loadWeights)
+    else:
+        randomize_batchnorms(model)
+    model = model.to(device).eval()
+
+    fused = fuse_model(model)
+    print(f"BatchNorm layers: {count_batchnorms(model)} -> {count_batchnorms(fused)}")
+
+    images = torch.rand(args.batch_size, 3, args.height, args.width, device=device)
+    result = check_equivalence(model, fused, images)
+    print(f"max abs diff {result['max_abs_diff']:.3e} | max rel diff {result['max_rel_diff']:.3e} "
+          f"| argmax agreement {100 * result['argmax_agreement']:.4f} %")
+    if result['max_rel_diff'] > args.rtol:
+        print(f"Error: fused model differs from the original by more than rtol={args.rtol}")
+        sys.exit(1)
+    print("Fused model is numerically equivalent")
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+
+    parser.add_argument('--model', default="erfnet")  # erfnet, erfnet_isomaxplus, enet, bisenet
+    parser.add_argument('--loadWeights', default=None)  # checkpoint path, random BN statistics if not given
+    parser.add_argument('--batch-size', type=int, default=2)
+    parser.add_argument('--height', type=int, default=512)
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--rtol', type=float, default=1e-4)    # tolerated difference, relative to the largest output
+    parser.add_argument('--cpu', action='store_true')
+
+    main(parser.parse_args())
@@ -6,24 +6,62 @@
 import torch
 
 class iouEval:
-
-    def __init__(self, nClasses, ignoreIndex=19):
+    """
+    Accumulate a confusion matrix of predictions vs targets and compute IoU, precision,
+    recall and pixel accuracy from it.
+
+    Parameters:
+        - nClasses (int): Number of classes, including the ignore class.
+        - ignoreIndex (int): Target value excluded from the metrics, none if >= nClasses.
+        - legacy (bool): Use the original one-hot TP/FP/FN accumulation instead of the
+            confusion matrix (kept for regression comparison, ~60x the memory of the labels).
+    """
+
+    def __init__(self, nClasses, ignoreIndex=19, legacy=False):
         self.nClasses = nClasses
         self.ignoreIndex = ignoreIndex if nClasses>ignoreIndex else -1 #if ignoreIndex is larger than nClasses, consider no ignoreIndex
+        self.legacy = legacy
         self.reset()
 
     def reset (self):
         classes = self.nClasses if self.ignoreIndex==-1 else self.nClasses-1
+        self.conf = None    # [nClasses, nClasses] counts, rows targets, columns predictions, kept on the batch device
         self.tp = torch.zeros(classes).double()
         self.fp = torch.zeros(classes).double()
         self.fn = torch.zeros(classes).double()        
 
     def addBatch(self, x, y):   #x=preds, y=targets
-        #sizes should be "batch_size x nClasses x H x W"
+        #sizes should be "batch_size x nClasses x H x W" (one-hot) or "batch_size x 1 x H x W" (indices)
+        if self.legacy:
+            return self.addBatchOnehot(x, y)
+
+        if (x.is_cuda or y.is_cuda):
+            x = x.cuda()
+            y = y.cuda()
+
+        #one-hot inputs are turned back into indices
+        x = x.argmax(1) if x.size(1) > 1 else x.squeeze(1)
+        y = y.argmax(1) if y.size(1) > 1 else y.squeeze(1)
+        x = x.long().flatten()
+        y = y.long().flatten()
+
+        #ignored and out of range targets do not count, a prediction of the ignore class is a miss
+        valid = (y >= 0) & (y < self.nClasses)
+        if (self.ignoreIndex != -1):
+            valid &= (y != self.ignoreIndex)
+        conf = torch.bincount(y[valid] * self.nClasses + x[valid], minlength=self.nClasses**2)
+        conf = conf.view(self.nClasses, self.nClasses)
+
+        if self.conf is None:
+            self.conf = conf
+        else:
+            self.conf += conf.to(self.conf.device)
+
+    def addBatchOnehot(self, x, y):
+        #original implementation: float one-hot scatter and TP/FP/FN products
         
         #print ("X is cuda: ", x.is_cuda)
         #print ("Y is cuda: ", y.is_cuda)
-
         if (x.is_cuda or y.is_cuda):
             x = x.cuda()
             y = y.cuda()
@@ -68,12 +106,55 @@ class iouEval:
         self.fp += fp.double().cpu()
         self.fn += fn.double().cpu()
 
+    def merge(self, other):
+        """Add the counts accumulated by another iouEval with the same classes (e.g. of another shard)."""
+        assert (other.nClasses, other.ignoreIndex, other.legacy) == (self.nClasses, self.ignoreIndex, self.legacy), \
+            "Error: cannot merge iouEval with different classes"
+        if other.conf is not None:
+            if self.conf is None:
+                self.conf = other.conf.clone()
+            else:
+                self.conf += other.conf.to(self.conf.device)
+        self.tp += other.tp
+        self.fp += other.fp
+        self.fn += other.fn
+        return self
+
+    def getStats(self):
+        """Per-class TP, FP and FN counts (double, on the CPU), ignore class excluded."""
+        if self.legacy or self.conf is None:
+            return self.tp, self.fp, self.fn
+        conf = self.conf.double().cpu()
+        if (self.ignoreIndex != -1):
+            keep = [c for c in range(self.nClasses) if c != self.ignoreIndex]
+        else:
+            keep = list(range(self.nClasses))
+        tp = conf.diagonal()
+        fp = conf.sum(0) - tp
+        fn = conf.sum(1) - tp
+        return tp[keep], fp[keep], fn[keep]
+
     def getIoU(self):
-        num = self.tp
-        den = self.tp + self.fp + self.fn + 1e-15
+        tp, fp, fn = self.getStats()
+        num = tp
+        den = tp + fp + fn + 1e-15
         iou = num / den
         return torch.mean(iou), iou     #returns "iou mean", "iou per class"
 
+    def getPrecision(self):
+        tp, fp, fn = self.getStats()
+        precision = tp / (tp + fp + 1e-15)
+        return torch.mean(precision), precision     #returns "precision mean", "precision per class"
+
+    def getRecall(self):
+        tp, fp, fn = self.getStats()
+        recall = tp / (tp + fn + 1e-15)
+        return torch.mean(recall), recall     #returns "recall mean", "recall per class"
+
+    def getPixelAccuracy(self):
+        tp, fp, fn = self.getStats()
+        return tp.sum() / (tp.sum() + fn.sum() + 1e-15)     #correct pixels over the non ignored ones
+
 # Class for colors
 class colors:
     RED       = '\033[31;1m'
@@ -0,0 +1,235 @@
+# ========================================================================
+# Per-layer forward profiling of the segmentation models
+#
+# LayerProfiler registers forward hooks on every named module of a model
+# (ERFNet, ERFNet-IsoMaxPlus, ENet, BiSeNet or any nn.Module) and records, per
+# module and aggregated over the profiled runs: wall time, an estimate of the
+# FLOPs, the bytes of the activations it outputs and its parameter count.
+# Times of a container include its children (non_bottleneck_1d, RegularBottleneck,
+# ContextPath, FeatureFusionModule, ...); FLOPs are estimated on the leaf modules
+# (convolutions, transposed convolutions, batch norms, activations, pooling,
+# upsampling and the IsoMaxPlus cdist head) and summed into their containers,
+# functional ops called inside forward() are not counted.
+# Results are exported as a table sorted by time and as a Chrome trace
+# (chrome://tracing or https://ui.perfetto.dev).
+#
+# Example:
+#   python layer_profiler.py --model enet --cpu --runs 10 --trace enet_trace.json
+# ========================================================================
+
+import os
+import sys
+import json
+import time
+import torch
+import torch.nn as nn
+
+from argparse import ArgumentParser
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../train')))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from train.utils.losses.isomax_plus_loss import IsoMaxPlusLossFirstPart
+from eval_utils import tensors
+
+
+def tensor_bytes(output):
+    return sum(t.numel() * t.element_size() for t in tensors(output))
+
+
+def estimate_flops(module, inputs, output):
+    """Floating point operations of one call of a leaf module (a multiply-add counts 2), 0 if unknown."""
+    outs = tensors(output)
+    if not outs:
+        return 0
+    out = outs[0]
+    if isinstance(module, nn.Conv2d):
+        kh, kw = module.kernel_size
+        flops = 2 * out.numel() * (module.in_channels // module.groups) * kh * kw
+        return flops + (out.numel() if module.bias is not None else 0)
+    if isinstance(module, nn.ConvTranspose2d):
+        kh, kw = module.kernel_size
+        flops = 2 * inputs[0].numel() * (module.out_channels // module.groups) * kh * kw
+        return flops + (out.numel() if module.bias is not None else 0)
+    if isinstance(module, nn.Linear):
+        return 2 * out.numel() * module.in_features
+    if isinstance(module, nn.modules.batchnorm._BatchNorm):
+        return 2 * out.numel()
+    if isinstance(module, (nn.ReLU, nn.PReLU, nn.ReLU6, nn.LeakyReLU, nn.Sigmoid)):
+        return out.numel()
+    if isinstance(module, (nn.MaxPool2d, nn.AvgPool2d)):
+        k = module.kernel_size if isinstance(module.kernel_size, tuple) else (module.kernel_size,) * 2
+        return out.numel() * k[0] * k[1]
+    if isinstance(module, (nn.AdaptiveAvgPool2d, nn.AdaptiveMaxPool2d)):
+        return inputs[0].numel()
+    if isinstance(module, nn.Upsample):
+        return out.numel() * (4 if module.mode in ('bilinear', 'bicubic') else 1)
+    if isinstance(module, IsoMaxPlusLossFirstPart):
+        # normalization of features and prototypes, then cdist (difference, square, sum) and scale
+        B, C, H, W = inputs[0].shape
+        N, K = B * H * W, module.num_classes
+        return 3 * N * C + 3 * K * C + 3 * N * K * C + 2 * N * K
+    return 0
+
+
+class LayerProfiler:
+    """
+    Forward hooks on every named module of a model, recording time, FLOPs, activation
+    bytes and parameters per module.
+
+    Parameters:
+        - model (torch.nn.Module): Model to instrument.
+        - sync (bool): Synchronize CUDA around every module so that times are not
+            only kernel launches; default True if the model is on a CUDA device.
+    """
+    def __init__(self, model, sync=None):
+        self.model = model
+        if sync is None:
+            sync = any(p.is_cuda for p in model.parameters())
+        self.sync = sync
+        self.root = type(model).__name__
+        self.handles = []
+        self.reset()
+
+    def reset(self):
+        self.stats = {}     # module name -> calls, time, flops, bytes
+        self.events = []    # Chrome trace events
+        self.stack = []
+        self.runs = 0
+        self.t0 = time.perf_counter()
+
+    def attach(self):
+        for name, module in self.model.named_modules():
+            name = f"{self.root}.{name}" if name else self.root
+            self.handles.append(module.register_forward_pre_hook(self._pre_hook(name)))
+            self.handles.append(module.register_forward_hook(self._hook(name)))
+        return self
+
+    def detach(self):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+
+    def __enter__(self):
+        return self.attach()
+
+    def __exit__(self, *exc):
+        self.detach()
+
+    def _pre_hook(self, name):
+        def hook(module, inputs):
+            if self.sync:
+                torch.cuda.synchronize()
+            self.stack.append(time.perf_counter())
+        return hook
+
+    def _hook(self, name):
+        def hook(module, inputs, output):
+            if self.sync:
+                torch.cuda.synchronize()
+            end = time.perf_counter()
+            start = self.stack.pop()
+            leaf = next(module.children(), None) is None
+            flops = estimate_flops(module, inputs, output) if leaf else 0
+            activation_bytes = tensor_bytes(output)
+
+            stat = self.stats.setdefault(name, {
+                'type': type(module).__name__, 'leaf': leaf, 'calls': 0, 'time': 0.0, 'flops': 0, 'bytes': 0,
+                'params': sum(p.numel() for p in module.parameters()),
+            })
+            stat['calls'] += 1
+            stat['time'] += end - start
+            stat['flops'] += flops
+            stat['bytes'] += activation_bytes
+            self.events.append({
+                'name': name, 'cat': stat['type'], 'ph': 'X', 'pid': 0, 'tid': 0,
+                'ts': (start - self.t0) * 1e6, 'dur': (end - start) * 1e6,
+                'args': {'flops': flops, 'activation_bytes': activation_bytes},
+            })
+        return hook
+
+    def profile(self, inputs, runs=10, warmup=3, **kwargs):
+        """Run the model 'warmup' times without hooks, then 'runs' times with them."""
+        with torch.inference_mode():
+            for _ in range(warmup):
+                self.model(inputs, **kwargs)
+            self.reset()
+            with self:
+                for _ in range(runs):
+                    self.model(inputs, **kwargs)
+                    self.runs += 1
+        return self
+
+    def summary(self):
+        """
+        Per-module statistics averaged per run, sorted by time (descending).
+
+        Returns:
+            - list[dict]: 'name', 'type', 'calls', 'ms', 'percent', 'gflops', 'activation_mb', 'params',
+                FLOPs of the containers being the sum of their leaf modules.
+        """
+        runs = max(self.runs, 1)
+        total = self.stats[self.root]['time'] if self.root in self.stats else 1.0
+        rows = []
+        for name, stat in self.stats.items():
+            flops = stat['flops'] if stat['leaf'] else sum(
+                s['flops'] for n, s in self.stats.items() if s['leaf'] and n.startswith(name + '.'))
+            rows.append({
+                'name': name, 'type': stat['type'],
+                'calls': stat['calls'] / runs,
+                'ms': stat['time'] * 1000.0 / runs,
+                'percent': 100.0 * stat['time'] / total,
+                'gflops': flops / runs / 1e9,
+                'activation_mb': stat['bytes'] / runs / 2**20,
+                'params': stat['params'],
+            })
+        return sorted(rows, key=lambda row: row['ms'], reverse=True)
+
+    def table(self, limit=None):
+        """Summary as a text table."""
+        rows = self.summary()[:limit]
+        width = max(len(row['name']) for row in rows)
+        lines = [f"{'Module':<{width}}  {'Type':<28} {'Calls':>6} {'ms/run':>10} {'%':>7} "
+                 f"{'GFLOPs':>9} {'Act MB':>9} {'Params':>10}"]
+        for row in rows:
+            lines.append(f"{row['name']:<{width}}  {row['type']:<28} {row['calls']:>6.0f} {row['ms']:>10.3f} "
+                         f"{row['percent']:>7.2f} {row['gflops']:>9.3f} {row['activation_mb']:>9.2f} {row['params']:>10d}")
+        return "\n".join(lines)
+
+    def export_chrome_trace(self, path):
+        """Write the recorded module calls as a Chrome trace JSON file."""
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+
+def main(args):
+    from eval_forwardTime import build_model
+
+    device = 'cpu' if args.cpu else 'cuda'
+    model = build_model(args.model).to(device).eval()
+    images = torch.randn(args.batch_size, 3, args.height, args.width, device=device)
+
+    profiler = LayerProfiler(model).profile(images, runs=args.runs, warmup=args.warmup)
+    print(profiler.table(args.limit))
+
+    if args.table:
+        with open(args.table, 'w') as f:
+            f.write(profiler.table() + "\n")
+    if args.trace:
+        profiler.export_chrome_trace(args.trace)
+        print(f"Chrome trace saved to {args.trace}")
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+
+    parser.add_argument('--model', default="erfnet")  # erfnet, erfnet_isomaxplus, enet, bisenet
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--height', type=int, default=512)
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--limit', type=int, default=40)    # rows printed
+    parser.add_argument('--table', default=None)    # save the full table
+    parser.add_argument('--trace', default=None)    # save the Chrome trace
+    parser.add_argument('--cpu', action='store_true')
+
+    main(parser.parse_args())
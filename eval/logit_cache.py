@@ -0,0 +1,121 @@
+# ========================================================================
+# Persistent on-disk cache of the network logits for anomaly evaluation
+#
+# Post-hoc scoring (method, temperature, ...) never changes the network output,
+# so the logits of each image are stored once as a float16 .npy file and read
+# back with a memory map on the following runs instead of running the model.
+#
+# Entries are keyed by a hash of the weights file content, the model name, the
+# preprocessing resolution and the image path: a new checkpoint, model or
+# resolution never reads stale logits. The total size of the cache is bounded
+# by 'max_bytes', least recently used entries are evicted first. Entries read or
+# written by the current run are never evicted by it: when the logits of a
+# dataset do not fit, the images beyond the limit are simply not cached, so the
+# following runs still read the first ones instead of evicting each entry just
+# before it is needed (a sequential scan larger than an LRU cache never hits).
+# ========================================================================
+
+import os
+import hashlib
+import tempfile
+import numpy as np
+import torch
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """SHA-256 of the content of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LogitCache:
+    """
+    Cache of per-image logits stored as float16 .npy files.
+
+    Parameters:
+        - cache_dir (str): Root directory of the cache.
+        - weightspath (str): Path of the checkpoint producing the logits.
+        - model_name (str): Name of the architecture (erfnet, erfnet_isomaxplus, enet, bisenet).
+        - resolution (tuple[int, int]): (height, width) the images are resized to.
+        - max_bytes (int): Size limit of the cache, least recently used entries are evicted
+            when it is exceeded.
+    """
+    def __init__(self, cache_dir, weightspath, model_name, resolution, max_bytes=20 * 2**30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.model_key = hashlib.sha256(
+            f"{file_digest(weightspath)}|{model_name}|{tuple(resolution)}".encode('utf-8')).hexdigest()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.size = sum(entry.stat().st_size for entry in os.scandir(cache_dir) if entry.name.endswith('.npy'))
+        self.used = set()   # entries of the current run, kept by evict()
+
+    def path(self, image_path):
+        key = hashlib.sha256(f"{self.model_key}|{os.path.abspath(image_path)}".encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key + '.npy')
+
+    def __contains__(self, image_path):
+        return os.path.exists(self.path(image_path))
+
+    def get(self, image_path):
+        """
+        Read the logits of an image without copying them in memory.
+
+        Returns:
+            - torch.Tensor | None: float16 logits [C, H, W] backed by a copy-on-write memory map,
+                None if the image is not cached.
+        """
+        path = self.path(image_path)
+        try:
+            logits = np.load(path, mmap_mode='c')
+        except FileNotFoundError:
+            return None
+        os.utime(path)  # mark as recently used for the eviction
+        self.used.add(path)
+        return torch.from_numpy(logits)
+
+    def put(self, image_path, logits):
+        """
+        Store the logits [C, H, W] of an image as float16, then enforce the size limit.
+
+        Returns:
+            - bool: False if the entry was dropped because the cache is full of entries of the current run.
+        """
+        path = self.path(image_path)
+        logits = logits.detach().to('cpu', torch.float16).numpy()
+        # write to a temporary file and rename it, readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, logits)
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+        self.size += os.path.getsize(path) - old_size
+        self.used.add(path)
+        if self.size > self.max_bytes:
+            self.evict()
+        if self.size > self.max_bytes:  # only entries of this run are left: drop the new one
+            self.used.discard(path)
+            self.size -= os.path.getsize(path)
+            os.remove(path)
+            return False
+        return True
+
+    def evict(self):
+        """Remove the least recently used entries, except those of the current run, until the cache fits in 'max_bytes'."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            try:
+                if entry.name.endswith('.npy') and entry.path not in self.used:
+                    entries.append((entry.stat().st_mtime, entry.stat().st_size, entry.path))
+            except FileNotFoundError:   # evicted meanwhile by another process sharing the cache
+                continue
+        for _, size, path in sorted(entries):
+            if self.size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            self.size -= size
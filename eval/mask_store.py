@@ -0,0 +1,137 @@
+# ========================================================================
+# Precomputed store of the anomaly ground truth masks
+#
+# Every evaluation run used to decode each PNG/WEBP label, resize it, remap it
+# and check whether it contains anomalous pixels. The masks never change, so
+# they are decoded once by this script and written, already resized and
+# remapped, into a single bit-packed memory-mapped file:
+# - masks.npy  uint8 [N, 2, H*W/8]: per image two bit planes, 'valid' (label
+#              0 or 1) and 'anomaly' (label 1), packed with np.packbits, i.e.
+#              2 bits per pixel instead of 8
+# - index.json resolution, absolute image paths and whether each image
+#              contains anomalous pixels
+# Evaluation runs given --mask-store skip the images without anomalies before
+# loading anything and read the other masks back without decoding them.
+#
+# Build command:
+#   python mask_store.py --input '/home/datasets/RoadAnomaly21/images/*.png' --output ../masks/RoadAnomaly21
+# ========================================================================
+
+import os
+import json
+import tempfile
+import numpy as np
+import torch
+import torchvision.transforms as T
+
+from PIL import Image
+from argparse import ArgumentParser
+from torch.utils.data import DataLoader
+from dataset import AnomalyDataset, anomaly_filenames
+
+# (anomaly bit | valid bit << 1) -> label: 255 void, 0 in-distribution, 1 anomaly
+UNPACK_LUT = np.array([255, 255, 0, 1], dtype=np.uint8)
+
+
+class MaskStore:
+    """
+    Read-only view of a mask store built by build_mask_store.
+
+    Parameters:
+        - store_dir (str): Directory containing masks.npy and index.json.
+        - resolution (tuple[int, int]): (height, width) expected by the evaluation, the store
+            must have been built at the same resolution.
+    """
+    def __init__(self, store_dir, resolution):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'index.json')) as f:
+            index = json.load(f)
+        self.resolution = tuple(index['resolution'])
+        assert self.resolution == tuple(resolution), \
+            f"Error: mask store built at resolution {self.resolution}, expected {tuple(resolution)}"
+        self.rows = {path: row for row, path in enumerate(index['files'])}
+        self.anomaly = index['anomaly']
+        self.masks = None   # opened lazily, so that every loader worker maps the file itself
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['masks'] = None   # a pickled memmap would copy the whole store to the workers
+        return state
+
+    def __contains__(self, image_path):
+        return os.path.abspath(image_path) in self.rows
+
+    def has_anomaly(self, image_path):
+        """Whether the ground truth of an image contains anomalous pixels."""
+        return self.anomaly[self.rows[os.path.abspath(image_path)]]
+
+    def get(self, image_path):
+        """
+        Ground truth of an image, unpacked from the memory map.
+
+        Returns:
+            - np.ndarray: uint8 mask [H, W], 1 = anomaly, 0 = in-distribution, 255 = void.
+        """
+        if self.masks is None:
+            self.masks = np.load(os.path.join(self.store_dir, 'masks.npy'), mmap_mode='r')
+        height, width = self.resolution
+        planes = np.unpackbits(self.masks[self.rows[os.path.abspath(image_path)]], axis=1, count=height * width)
+        return UNPACK_LUT[planes[0] << 1 | planes[1]].reshape(height, width)
+
+
+def build_mask_store(store_dir, filenames, resolution, num_workers=4):
+    """
+    Decode, resize and remap the ground truth of 'filenames' once and write them to 'store_dir'.
+
+    Parameters:
+        - store_dir (str): Output directory, created if needed.
+        - filenames (list[str]): Paths of the anomaly dataset images.
+        - resolution (tuple[int, int]): (height, width) the masks are resized to.
+        - num_workers (int): Loader workers decoding the masks.
+    """
+    height, width = resolution
+    mask_transform = T.Compose([T.Resize(resolution, Image.NEAREST)])
+    dataset = AnomalyDataset(filenames, target_transform=mask_transform, load_images=False)
+    loader = DataLoader(dataset, num_workers=num_workers, batch_size=1, shuffle=False)
+
+    os.makedirs(store_dir, exist_ok=True)
+    # write to a temporary file and rename it, readers never see a partial store
+    fd, tmp_path = tempfile.mkstemp(dir=store_dir, suffix='.npy')
+    os.close(fd)
+    masks = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8,
+                                      shape=(len(dataset), 2, (height * width + 7) // 8))
+    anomaly = []
+    for row, (_, labels, _) in enumerate(loader):
+        label = labels[0].numpy()
+        assert label.shape == (height, width), f"Error: mask of shape {label.shape}, expected {(height, width)}"
+        valid = (label == 0) | (label == 1)
+        masks[row, 0] = np.packbits(valid)
+        masks[row, 1] = np.packbits(label == 1)
+        anomaly.append(bool((label == 1).any()))
+    masks.flush()
+    del masks
+    os.replace(tmp_path, os.path.join(store_dir, 'masks.npy'))
+
+    with open(os.path.join(store_dir, 'index.json'), 'w') as f:
+        json.dump({
+            'resolution': [height, width],
+            'files': [os.path.abspath(filename) for filename in dataset.filenames],
+            'anomaly': anomaly,
+        }, f)
+    print(f"Stored {len(anomaly)} masks ({sum(anomaly)} with anomalies) in {store_dir}")
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--input', nargs='+', required=True,
+                        help="Glob patterns of the anomaly images or dataset roots")
+    parser.add_argument('--output', required=True)  # directory of the mask store
+    parser.add_argument('--height', type=int, default=512)
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--num-workers', type=int, default=4)
+    args = parser.parse_args()
+
+    build_mask_store(args.output, anomaly_filenames(args.input), (args.height, args.width), args.num_workers)
+
+if __name__ == '__main__':
+    main()
@@ -114,4 +114,60 @@ def plot_barcode(preds, labels, save_dir=None, file_name=None):
     if save_dir is not None:
         plt.savefig(f"{save_dir}/{file_name}")
     else:
-        plt.show()
\ No newline at end of file
+        plt.show()
+
+def plot_roc_hist(hist, title="Receiver operating characteristic", save_dir=None, file_name=None):
+    """Plot an ROC curve from the bins of an anomaly_metrics.AnomalyHistogram.
+
+    Same chart as plot_roc, without materializing the per-pixel predictions.
+    """
+    curves = hist.curves()
+    metrics = hist.compute()
+    fpr = np.concatenate(([0.0], curves['fpr']))
+    tpr = np.concatenate(([0.0], curves['tpr']))
+    tpr95 = metrics['fpr95']
+
+    plt.figure()
+    lw = 2
+    plt.plot(fpr, tpr, color='darkorange',
+             lw=lw, label='AUROC = %0.2f' % metrics['auroc'])
+    plt.plot([0, 1], [0.95, 0.95], color='black', lw=lw, linestyle=':', label='FPR (95%% TPR) = %0.2f' % tpr95)
+    plt.plot([tpr95, tpr95], [0, 1], color='black', lw=lw, linestyle=':')
+    plt.plot([0, 1], [0, 1], color='navy', lw=lw, linestyle='--', label='Random detector ROC')
+    plt.xlim([0.0, 1.0])
+    plt.ylim([0.0, 1.05])
+    plt.xlabel('False Positive Rate')
+    plt.ylabel('True Positive Rate')
+    plt.title(title)
+    plt.legend(loc="lower right")
+    if save_dir is not None:
+        plt.savefig(f"{save_dir}/{file_name}")
+    else:
+        plt.show()
+
+
+def plot_pr_hist(hist, title="Precision recall curve", save_dir=None, file_name=None):
+    """Plot a Precision-Recall curve from the bins of an anomaly_metrics.AnomalyHistogram.
+
+    Same chart as plot_pr, without materializing the per-pixel predictions.
+    """
+    curves = hist.curves()
+    # precision_recall_curve ends with (recall=0, precision=1)
+    recall = np.concatenate((curves['recall'][::-1], [0.0]))
+    precision = np.concatenate((curves['precision'][::-1], [1.0]))
+    prc_auc = auc(recall, precision)
+
+    plt.figure()
+    lw = 2
+    plt.plot(recall, precision, color='darkorange',
+             lw=lw, label='PRC curve (area = %0.2f)' % prc_auc)
+    plt.xlim([0.0, 1.0])
+    plt.ylim([0.0, 1.05])
+    plt.xlabel('Recall')
+    plt.ylabel('Precision')
+    plt.title(title)
+    plt.legend(loc="lower right")
+    if save_dir is not None:
+        plt.savefig(f"{save_dir}/{file_name}")
+    else:
+        plt.show()
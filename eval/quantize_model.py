@@ -0,0 +1,161 @@
+# ========================================================================
+# Static int8 post-training quantization for CPU deployment
+#
+# Calibrates a trained ERFNet or ENet checkpoint on a few hundred Cityscapes
+# images and converts it to a static int8 model (FX graph mode quantization,
+# x86 backend, fbgemm on older PyTorch versions): convolutions, batch norms,
+# residual additions and concatenations run in int8, ops without an int8
+# kernel stay in fp32 behind (de)quantize nodes:
+# - ERFNet: the IsoMaxPlus head (cdist) of erfnet_isomaxplus;
+# - ENet: the DownsamplingBottleneck blocks (max pooling with indices), the
+#   max unpooling and the transposed convolutions called with output_size.
+# The converted model is saved with torch.save and loaded back by eval_iou.py
+# and evalAnomaly.py (--quantized), which evaluate it next to the fp32 model
+# and print the mIoU and AUPRC deltas. This script prints the CPU speedup.
+#
+# Example:
+#   python quantize_model.py --model erfnet --loadWeights ../trained_models/erfnet_pretrained.pth \
+#       --datadir /home/datasets/cityscapes/ --num-images 300 --output ../trained_models/erfnet_int8.pt
+# ========================================================================
+
+import os
+import sys
+import time
+import torch
+import numpy as np
+import torch.nn as nn
+
+from PIL import Image
+from argparse import ArgumentParser
+from torch.utils.data import DataLoader, Subset
+from torchvision.transforms import Compose, Resize, ToTensor
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+from torch.ao.quantization.fx.custom_config import PrepareCustomConfig
+
+from dataset import cityscapes
+from transform import ToLabel
+from eval_forwardTime import build_model
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from train.model_registry import load_checkpoint
+from train.enet import DownsamplingBottleneck
+from train.utils.losses.isomax_plus_loss import IsoMaxPlusLossFirstPart
+
+QUANTIZABLE_MODELS = ["erfnet", "erfnet_isomaxplus", "enet"]
+
+
+class TracedForward(nn.Module):
+    """Calls model(input), so that keyword arguments of its forward (ERFNet only_encode) keep their default when traced."""
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input):
+        return self.model(input)
+
+
+def float_modules(model):
+    """Module classes kept in fp32: those not traced at all, and those traced but not quantized."""
+    # DownsamplingBottleneck branches on main.is_cuda and returns max pooling indices, which int8 tensors have no kernel for
+    not_traced = [IsoMaxPlusLossFirstPart, DownsamplingBottleneck]
+    # quantized ConvTranspose2d has no output_size argument, MaxUnpool2d no int8 kernel
+    not_quantized = not_traced + ([nn.ConvTranspose2d, nn.MaxUnpool2d] if type(model).__name__ == 'ENet' else [])
+    return not_traced, not_quantized
+
+
+def quantize_model(model, calibration_loader, example_inputs, backend=None):
+    """
+    Static int8 version of an eval-mode ERFNet or ENet, calibrated on the images of a loader.
+
+    Parameters:
+        - model (torch.nn.Module): fp32 model with loaded weights, on the CPU.
+        - calibration_loader (DataLoader): Batches (images, ...) run through the observers.
+        - example_inputs (tuple): Inputs used to trace the model.
+        - backend (str): Quantized engine, default 'x86' if available else 'fbgemm'.
+
+    Returns:
+        - torch.fx.GraphModule: The int8 model.
+    """
+    if backend is None:
+        backend = 'x86' if 'x86' in torch.backends.quantized.supported_engines else 'fbgemm'
+    torch.backends.quantized.engine = backend
+
+    not_traced, not_quantized = float_modules(model)
+    qconfig_mapping = get_default_qconfig_mapping(backend)
+    for module_class in not_quantized:
+        qconfig_mapping.set_object_type(module_class, None)
+    prepare_custom_config = PrepareCustomConfig().set_non_traceable_module_classes(not_traced)
+
+    prepared = prepare_fx(TracedForward(model).eval(), qconfig_mapping, example_inputs,
+                          prepare_custom_config=prepare_custom_config)
+    with torch.no_grad():   # observers update their statistics in place
+        for step, batch in enumerate(calibration_loader):
+            prepared(batch[0])
+            if step % 50 == 0:
+                print(f"Calibration batch {step}/{len(calibration_loader)}")
+    return convert_fx(prepared)
+
+
+def load_quantized(path):
+    """int8 model saved by quantize_model.py, with its quantized engine selected."""
+    checkpoint = torch.load(path, map_location='cpu', weights_only=False)
+    torch.backends.quantized.engine = checkpoint['backend']
+    return checkpoint['model'].eval()
+
+
+def median_latency(model, images, iters=20, warmup=5):
+    """Median CPU forward time of a model, in ms."""
+    latencies = []
+    with torch.inference_mode():
+        for i in range(warmup + iters):
+            start_time = time.perf_counter()
+            model(images)
+            if i >= warmup:
+                latencies.append(time.perf_counter() - start_time)
+    return float(np.median(latencies)) * 1000.0
+
+
+def main(args):
+    torch.set_num_threads(args.threads)
+    model = build_model(args.model)
+    load_checkpoint(model, args.loadWeights)
+    model.eval()
+
+    input_transform = Compose([Resize(args.height, Image.BILINEAR), ToTensor()])
+    target_transform = Compose([Resize(args.height, Image.NEAREST), ToLabel()])
+    dataset = cityscapes(args.datadir, input_transform, target_transform, subset=args.subset)
+    # images evenly spaced over the subset, so that every city is represented
+    step = max(len(dataset) // args.num_images, 1)
+    dataset = Subset(dataset, list(range(0, len(dataset), step))[:args.num_images])
+    loader = DataLoader(dataset, num_workers=args.num_workers, batch_size=args.batch_size, shuffle=False)
+
+    example_inputs = (dataset[0][0].unsqueeze(0),)
+    quantized = quantize_model(model, loader, example_inputs, args.backend)
+    torch.save({'model': quantized, 'backend': torch.backends.quantized.engine,
+                'model_name': args.model, 'weights': args.loadWeights}, args.output)
+    print(f"Saved the int8 {args.model} ({torch.backends.quantized.engine}) to {args.output}")
+
+    images = torch.rand(1, 3, *example_inputs[0].shape[-2:])
+    fp32_ms = median_latency(model, images, args.iters)
+    int8_ms = median_latency(quantized, images, args.iters)
+    print(f"CPU latency ({args.threads} threads, {images.shape[-2]}x{images.shape[-1]}): "
+          f"fp32 {fp32_ms:.2f} ms | int8 {int8_ms:.2f} ms | speedup {fp32_ms / int8_ms:.2f}x")
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+
+    parser.add_argument('--model', default="erfnet", choices=QUANTIZABLE_MODELS)
+    parser.add_argument('--loadWeights', required=True)
+    parser.add_argument('--datadir', default="/home/shyam/ViT-Adapter/segmentation/data/cityscapes/")
+    parser.add_argument('--subset', default="val")  # calibration images
+    parser.add_argument('--num-images', type=int, default=300)
+    parser.add_argument('--height', type=int, default=512)
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--num-workers', type=int, default=4)
+    parser.add_argument('--backend', default=None)  # x86 or fbgemm, default x86 if available
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--threads', type=int, default=torch.get_num_threads())  # threads of the speedup measurement
+    parser.add_argument('--iters', type=int, default=20)
+
+    main(parser.parse_args())
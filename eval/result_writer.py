@@ -0,0 +1,73 @@
+# ========================================================================
+# Asynchronous PNG writer for the segmentation exporters
+#
+# eval_cityscapes_server.py and eval_cityscapes_color.py used to resize and
+# PNG-encode every prediction in the main loop, before the next forward pass.
+# ResultWriter hands the uint8 arrays to a pool of threads (PIL releases the
+# GIL while compressing) or processes that resize, encode and save them, while
+# the main loop keeps running the network. At most 'max_pending' results are
+# queued: put() blocks when the queue is full, so memory stays bounded
+# whatever the size of the subset.
+# ========================================================================
+
+import os
+import threading
+
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+def save_png(array, filename, compress_level=6, height=None):
+    """
+    Save a uint8 label [H, W] or color image [H, W, 3] as PNG, optionally resized
+    (nearest, smaller edge) to 'height' first.
+    """
+    image = Image.fromarray(array)
+    if height is not None and min(image.size) != height:
+        w, h = image.size
+        size = (int(height * w / h), height) if h <= w else (height, int(height * h / w))
+        image = image.resize(size, Image.NEAREST)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    image.save(filename, compress_level=compress_level)
+    return filename
+
+
+class ResultWriter:
+    """
+    Bounded queue of PNG results drained by a pool of encoders.
+
+    Parameters:
+        - num_workers (int): Number of encoder threads or processes.
+        - compress_level (int): PNG compression level, 0 (none, fastest) to 9.
+        - max_pending (int): Maximum number of results queued or being encoded.
+        - use_processes (bool): Encode in a process pool instead of a thread pool.
+    """
+    def __init__(self, num_workers=4, compress_level=6, max_pending=32, use_processes=False):
+        Executor = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        self.executor = Executor(max_workers=num_workers)
+        self.compress_level = compress_level
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.errors = []
+
+    def put(self, array, filename, height=None):
+        """Queue a uint8 array to be saved as 'filename', blocking while 'max_pending' results are queued."""
+        self.slots.acquire()
+        future = self.executor.submit(save_png, array, filename, self.compress_level, height)
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        self.slots.release()
+        if future.exception() is not None:
+            self.errors.append(future.exception())
+
+    def close(self):
+        """Wait for every queued result to be written, then raise the first encoding error if any."""
+        self.executor.shutdown(wait=True)
+        if self.errors:
+            raise self.errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
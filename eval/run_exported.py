@@ -0,0 +1,110 @@
+# ========================================================================
+# Standalone runner of the graphs written by export_model.py
+#
+# Only depends on torch (TorchScript) or onnxruntime (ONNX), numpy and PIL:
+# nothing from train/ or from the other eval modules is imported, so it can
+# be copied alone to a deployment machine with the .pt / .onnx artifact.
+# Images are resized to the export resolution as in evalAnomaly.py; for each
+# image the runner writes
+# - logits graphs: the predicted trainIds as a PNG;
+# - anomaly graphs (--anomaly at export): the float32 anomaly map as .npy.
+#
+# Example:
+#   python run_exported.py --model ../exported/erfnet_MaxLogit.pt --input "/home/datasets/RoadAnomaly21/images/*.png" --output ../results
+# ========================================================================
+
+import os
+import glob
+import json
+import time
+import numpy as np
+
+from PIL import Image
+from argparse import ArgumentParser
+
+
+class TorchScriptRunner:
+    """TorchScript graph and its export metadata."""
+    def __init__(self, path, device='cpu', threads=None):
+        import torch
+
+        self.torch = torch
+        if threads:
+            torch.set_num_threads(threads)
+        extra_files = {'meta.json': ''}
+        self.model = torch.jit.load(path, map_location=device, _extra_files=extra_files)
+        self.metadata = json.loads(extra_files['meta.json'])
+        self.device = device
+
+    def __call__(self, images):
+        with self.torch.inference_mode():
+            return self.model(self.torch.from_numpy(images).to(self.device)).float().cpu().numpy()
+
+
+class OnnxRunner:
+    """ONNX graph run by onnxruntime, and its export metadata."""
+    def __init__(self, path, device='cpu', threads=None):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        providers = ['CUDAExecutionProvider', 'CPUExecutionProvider'] if device == 'cuda' else ['CPUExecutionProvider']
+        self.session = onnxruntime.InferenceSession(path, options, providers=providers)
+        props = self.session.get_modelmeta().custom_metadata_map
+        self.metadata = {key: json.loads(value) for key, value in props.items()}
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, images):
+        return self.session.run(None, {self.input_name: images})[0]
+
+
+def load_runner(path, device='cpu', threads=None):
+    Runner = OnnxRunner if path.endswith('.onnx') else TorchScriptRunner
+    return Runner(path, device, threads)
+
+
+def load_images(filenames, height, width):
+    """float32 batch [B, 3, H, W] in [0, 1], resized (bilinear) as the evaluation transforms."""
+    images = [np.asarray(Image.open(f).convert('RGB').resize((width, height), Image.BILINEAR)) for f in filenames]
+    return np.ascontiguousarray(np.stack(images).transpose(0, 3, 1, 2), dtype=np.float32) / 255.0
+
+
+def main(args):
+    start = time.perf_counter()
+    runner = load_runner(args.model, 'cpu' if args.cpu else 'cuda', args.threads)
+    meta = runner.metadata
+    print(f"Loaded {meta['model']} ({meta['output']}{', ' + meta['method'] if meta['method'] else ''}) "
+          f"in {time.perf_counter() - start:.2f} s")
+
+    filenames = sorted(f for pattern in args.input for f in glob.glob(os.path.expanduser(pattern)))
+    os.makedirs(args.output, exist_ok=True)
+    forward_time = 0.0
+    for i in range(0, len(filenames), args.batch_size):
+        batch = filenames[i:i + args.batch_size]
+        images = load_images(batch, meta['height'], meta['width'])
+        start = time.perf_counter()
+        outputs = runner(images)
+        forward_time += time.perf_counter() - start
+
+        for filename, output in zip(batch, outputs):
+            name = os.path.splitext(os.path.basename(filename))[0]
+            if meta['output'] == 'anomaly':
+                np.save(os.path.join(args.output, name + '.npy'), output.astype(np.float32))
+            else:
+                Image.fromarray(output.argmax(0).astype(np.uint8)).save(os.path.join(args.output, name + '.png'))
+
+    if filenames:
+        print(f"{len(filenames)} images, {1000.0 * forward_time / len(filenames):.2f} ms per image (forward)")
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+
+    parser.add_argument('--model', required=True)  # .pt (TorchScript) or .onnx file of export_model.py
+    parser.add_argument('--input', nargs='+', required=True)  # image paths or glob patterns
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--cpu', action='store_true')
+
+    main(parser.parse_args())
@@ -0,0 +1,110 @@
+# ========================================================================
+# Process-parallel sharded evaluation on many-core CPUs
+#
+# A single PyTorch process evaluating one image at a time does not use a
+# 64-core machine well: the intra-op parallelism of a 512x1024 forward pass
+# saturates long before the core count. run_sharded() instead splits the
+# image list in contiguous shards, one per worker process, each pinned to its
+# own subset of the available cores and running as many intra-op threads as
+# it has cores.
+#
+# Every worker returns its partial metric state (the confusion matrices of
+# iouEval, the score histograms of AnomalyHistogram), which the caller merges
+# with their merge() method. Both are integer counts, so the merged metrics
+# are identical to those of a single-process run. Worker processes are
+# started with 'spawn' (no fork of an initialized OpenMP runtime) and each of
+# them loads its own copy of the model. They are plain, non-daemonic
+# processes rather than a Pool (whose daemonic workers cannot start the
+# DataLoader workers of --num-workers), and send their state back pickled by
+# value, so it stays readable after the worker has exited.
+# ========================================================================
+
+import os
+import queue
+import pickle
+import traceback
+import torch
+import torch.multiprocessing as mp
+
+
+def shard_items(items, index, num_shards):
+    """Contiguous 'index'-th of 'num_shards' slices of a list, sizes differing by at most one."""
+    base, extra = divmod(len(items), num_shards)
+    start = index * base + min(index, extra)
+    return items[start:start + base + (index < extra)]
+
+
+def available_cores():
+    """Cores this process may run on (its affinity mask where supported)."""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+def core_sets(num_shards, cores=None):
+    """Split the available cores in 'num_shards' disjoint contiguous sets (neighbouring cores share caches)."""
+    cores = available_cores() if cores is None else list(cores)
+    if num_shards > len(cores):
+        raise ValueError(f"Error: {num_shards} shards but only {len(cores)} cores available")
+    return [shard_items(cores, i, num_shards) for i in range(num_shards)]
+
+
+def pin_process(cores, threads=None):
+    """Restrict the current process to 'cores' and set its intra-op thread count (default one per core)."""
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(threads or len(cores))
+
+
+def _run_shard(results, fn, args, index, num_shards, cores, threads):
+    try:
+        pin_process(cores, threads)
+        # plain pickle: tensors by value, not as shared memory handles owned by this process
+        results.put((index, pickle.dumps(fn(args, index, num_shards)), None))
+    except BaseException:
+        results.put((index, None, traceback.format_exc()))
+
+
+def run_sharded(fn, args, num_shards, threads=None, cores=None):
+    """
+    Run fn(args, shard_index, num_shards) in 'num_shards' pinned worker processes.
+
+    Parameters:
+        - fn (callable): Module-level function evaluating one shard and returning its partial state.
+        - args (argparse.Namespace): Arguments passed to every worker.
+        - num_shards (int): Number of worker processes.
+        - threads (int): Intra-op threads per worker, default the number of cores of the worker.
+        - cores (list[int]): Cores to split between the workers, default all the available ones.
+
+    Returns:
+        - list: The partial states returned by the workers, in shard order.
+    """
+    context = mp.get_context('spawn')
+    results = context.Queue()
+    workers = []
+    for i, shard_cores in enumerate(core_sets(num_shards, cores)):
+        print(f"Shard {i}: cores {shard_cores[0]}-{shard_cores[-1]}, {threads or len(shard_cores)} threads")
+        workers.append(context.Process(target=_run_shard, name=f"shard-{i}",
+                                       args=(results, fn, args, i, num_shards, shard_cores, threads)))
+    for worker in workers:
+        worker.start()
+
+    states = {}
+    try:
+        while len(states) < num_shards:
+            try:
+                index, state, error = results.get(timeout=1)
+            except queue.Empty:
+                for i, worker in enumerate(workers):
+                    if i not in states and worker.exitcode not in (None, 0):
+                        raise RuntimeError(f"Error: shard {i} exited with code {worker.exitcode}")
+                continue
+            if error is not None:
+                raise RuntimeError(f"Error: shard {index} failed:\n{error}")
+            states[index] = pickle.loads(state)
+    finally:
+        for worker in workers:
+            if len(states) < num_shards and worker.is_alive():
+                worker.terminate()
+            worker.join()
+    return [states[i] for i in range(num_shards)]
@@ -0,0 +1,222 @@
+# ========================================================================
+# Sliding-window and multi-scale inference of the segmentation models
+#
+# The evaluation scripts resize every image to 512x1024, losing the detail of
+# small road obstacles. TiledInference evaluates images at their native
+# resolution (e.g. 1024x2048) instead:
+# - the image is split in overlapping tiles of the training size, and the
+#   tiles of the whole batch are stacked and run through the model together,
+#   'tile_batch' tiles per forward pass;
+# - the tile logits are blended on a canvas with a weighting window (Gaussian
+#   by default), so the tile borders, where the context is truncated, weigh
+#   less than the tile centers;
+# - optionally the image is also evaluated at other scales and horizontally
+#   flipped (in the same tile batches), and the logits are averaged.
+# The tile batch size follows a memory budget (default: half of the free
+# RAM, or of the free CUDA memory): the peak memory of one tile is probed once
+# and as many tiles as fit in the budget go through each forward pass.
+#
+# Tile sizes must be accepted by the model: multiples of 8 for ERFNet and
+# ENet, of 32 for BiSeNet. Images smaller than a tile are padded (replicated
+# borders) and the padding is cropped from the logits.
+# ========================================================================
+
+import os
+import math
+import torch
+import weakref
+import torch.nn.functional as F
+
+from eval_utils import WINDOWS, tensors
+
+
+def tile_starts(length, tile, stride):
+    """Start offsets of tiles of size 'tile' covering [0, length), the last one aligned to the end."""
+    if length <= tile:
+        return [0]
+    return list(range(0, length - tile, stride)) + [length - tile]
+
+
+def blend_window(height, width, kind="gaussian", device=None):
+    """Weights [height, width] of the logits of a tile, highest at the center and never zero."""
+    if kind == "uniform":
+        return torch.ones(height, width, device=device)
+
+    def profile(n):
+        x = torch.arange(n, dtype=torch.float32, device=device) + 0.5
+        if kind == "hann":
+            w = torch.sin(math.pi * x / n) ** 2
+        else:   # gaussian, sigma 1/4 of the tile
+            w = torch.exp(-0.5 * ((x - n / 2) / (n / 4)) ** 2)
+        return w.clamp_min(1e-3)     # pixels covered by a single tile (image borders) keep a weight
+    return profile(height)[:, None] * profile(width)[None, :]
+
+
+def available_memory(device):
+    """Free memory in bytes: CUDA free memory, or MemAvailable of /proc/meminfo on the CPU."""
+    if device.type == 'cuda':
+        return torch.cuda.mem_get_info(device)[0]
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
+
+def probe_tile_memory(model, tile_size, device):
+    """
+    Peak memory in bytes of the forward pass of a single tile.
+
+    On CUDA it is measured by the allocator. On the CPU it is estimated from the module
+    outputs alive at the same time, doubled for the tensors created outside modules
+    (functional ReLUs, concatenations, residual additions).
+    """
+    tile = torch.zeros(1, 3, *tile_size, device=device)
+    with torch.inference_mode():
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+            torch.cuda.reset_peak_memory_stats(device)
+            base = torch.cuda.memory_allocated(device)
+            model(tile)
+            torch.cuda.synchronize(device)
+            return torch.cuda.max_memory_allocated(device) - base
+
+        live = {'bytes': tile.numel() * tile.element_size(), 'peak': 0}
+
+        def release(size):
+            live['bytes'] -= size
+
+        def hook(module, inputs, output):
+            for t in tensors(output):
+                size = t.numel() * t.element_size()
+                live['bytes'] += size
+                weakref.finalize(t, release, size)
+            live['peak'] = max(live['peak'], live['bytes'])
+
+        handles = [m.register_forward_hook(hook) for m in model.modules() if next(m.children(), None) is None]
+        try:
+            model(tile)
+        finally:
+            for handle in handles:
+                handle.remove()
+        return 2 * live['peak']
+
+
+class TiledInference:
+    """
+    Sliding-window, multi-scale and flip inference with batched tiles.
+
+    Parameters:
+        - model (torch.nn.Module): Segmentation model in eval mode (a tuple output keeps its first element).
+        - tile_size (tuple[int]): Tile height and width, e.g. the training resolution.
+        - overlap (float): Fraction of a tile shared with its neighbour, in [0, 1).
+        - scales (list[float]): Scales the images are evaluated at; logits are averaged at the input size.
+        - flip (bool): Also evaluate the horizontally flipped images.
+        - window (str): Blending window of the tile logits, one of WINDOWS.
+        - memory_budget_mb (float): Memory for the tiles of one forward pass, default half of the free memory.
+        - tile_batch (int): Fixed number of tiles per forward pass, instead of the memory budget.
+        - verbose (bool): Print the tile batch size once it is chosen.
+    """
+    def __init__(self, model, tile_size=(512, 1024), overlap=0.25, scales=(1.0,), flip=False, window="gaussian",
+                 memory_budget_mb=None, tile_batch=None, verbose=True):
+        if not 0 <= overlap < 1:
+            raise ValueError(f"Tile overlap must be in [0, 1), got {overlap}")
+        if window not in WINDOWS:
+            raise ValueError(f"Unsupported blending window: {window}. Use one of {WINDOWS}.")
+        self.model = model
+        self.tile_size = tuple(tile_size)
+        self.stride = tuple(max(1, int(t * (1 - overlap))) for t in self.tile_size)
+        self.scales = list(scales)
+        self.flip = flip
+        self.window = window
+        self.memory_budget_mb = memory_budget_mb
+        self.tile_batch = tile_batch
+        self.verbose = verbose
+        self.tile_bytes = None      # probed at the first batch
+
+    def key(self):
+        """Configuration tuple, identifying the logits it produces (e.g. in a LogitCache)."""
+        return ('tiled',) + self.tile_size + self.stride + tuple(self.scales) + (self.flip, self.window)
+
+    def forward(self, tiles):
+        output = self.model(tiles)
+        if isinstance(output, (tuple, list)):
+            output = output[0]
+        return output.float()
+
+    def batch_size(self, images, num_tiles, num_classes):
+        """Tiles per forward pass fitting in the memory budget, next to the logit canvas of the images."""
+        if self.tile_batch is not None:
+            return max(1, min(self.tile_batch, num_tiles))
+        first = self.tile_bytes is None
+        if first:
+            th, tw = self.tile_size
+            # forward peak, plus the stacked input tile and its weighted logits
+            self.tile_bytes = probe_tile_memory(self.model, self.tile_size, images.device) + 4 * th * tw * (3 + 2 * num_classes)
+        budget = self.memory_budget_mb * 2**20 if self.memory_budget_mb else available_memory(images.device) / 2
+        canvas = 4 * images.size(0) * (num_classes + 1) * images.size(-2) * images.size(-1)
+        size = max(1, min(int(max(budget - canvas, 0) // self.tile_bytes), num_tiles))
+        if self.verbose and first:
+            print(f"Tiled inference: {size} tiles of {self.tile_size[0]}x{self.tile_size[1]} per forward pass "
+                  f"({self.tile_bytes / 2**20:.0f} MB per tile, {budget / 2**20:.0f} MB budget)")
+        return size
+
+    def tiled(self, images):
+        """Blended logits [B, C, H, W] of a batch, evaluated tile by tile at its own resolution."""
+        B, _, H, W = images.shape
+        th, tw = self.tile_size
+        pad_h, pad_w = max(th - H, 0), max(tw - W, 0)
+        if pad_h or pad_w:
+            images = F.pad(images, (0, pad_w, 0, pad_h), mode='replicate')
+        Hp, Wp = images.shape[-2:]
+
+        ys = tile_starts(Hp, th, self.stride[0])
+        xs = tile_starts(Wp, tw, self.stride[1])
+        positions = [(b, y, x) for b in range(B) for y in ys for x in xs]
+        window = blend_window(th, tw, self.window, images.device)
+
+        weights = torch.zeros(Hp, Wp, device=images.device)
+        for y in ys:
+            for x in xs:
+                weights[y:y + th, x:x + tw] += window
+
+        canvas = None
+        batch = 1   # first tile alone, its logits give the number of classes for the memory budget
+        i = 0
+        while i < len(positions):
+            chunk = positions[i:i + batch]
+            tiles = torch.stack([images[b, :, y:y + th, x:x + tw] for b, y, x in chunk])
+            logits = self.forward(tiles) * window
+            if canvas is None:
+                canvas = torch.zeros(B, logits.size(1), Hp, Wp, device=images.device)
+                batch = self.batch_size(images, len(positions) - 1, logits.size(1))
+            for (b, y, x), tile_logits in zip(chunk, logits):
+                canvas[b, :, y:y + th, x:x + tw] += tile_logits
+            i += len(chunk)
+
+        return (canvas / weights)[..., :H, :W]
+
+    def __call__(self, images):
+        """Logits [B, C, H, W] of a batch of images [B, 3, H, W], at the input resolution."""
+        B, _, H, W = images.shape
+        logits = None
+        for scale in self.scales:
+            scaled = images if scale == 1.0 else F.interpolate(
+                images, scale_factor=scale, mode='bilinear', align_corners=False, recompute_scale_factor=False)
+            if self.flip:   # flipped images in the same tile batches
+                output = self.tiled(torch.cat([scaled, scaled.flip(-1)]))
+                output = (output[:B] + output[B:].flip(-1)) / 2
+            else:
+                output = self.tiled(scaled)
+            if scale != 1.0:
+                output = F.interpolate(output, size=(H, W), mode='bilinear', align_corners=False)
+            logits = output if logits is None else logits + output
+        return logits / len(self.scales)
+
+
+def tiled_from_args(model, args):
+    return TiledInference(model, args.tile_size, args.tile_overlap, args.scales, args.flip, args.window,
+                          args.memory_budget_mb)
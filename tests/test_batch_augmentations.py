@@ -0,0 +1,72 @@
+# ========================================================================
+# Parity of the batched augmentations (train/utils/batch_augmentations.py)
+# with the PIL transforms of train/utils/augmentations.py, through the
+# cityscapes dataset and the default DataLoader collation, as main_v2.py
+# runs them with and without --batch-augment.
+#   python -m pytest tests/test_batch_augmentations.py
+# ========================================================================
+
+import os
+import sys
+import pytest
+
+torch = pytest.importorskip("torch")
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+pytest.importorskip("cv2")   # imported by utils/augmentations.py
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../train')))
+from torch.utils.data import DataLoader
+from dataset import cityscapes
+from utils.augmentations import ErfNetTransform
+from utils.batch_augmentations import ErfNetBatchTransform, ENetBatchTransform, BiSeNetBatchTransform
+
+HEIGHT = 32
+NUM_SAMPLES = 6
+
+
+@pytest.fixture(scope="module")
+def datadir(tmp_path_factory):
+    """Cityscapes-like tree of random images and trainId labels (including void 255)."""
+    root = tmp_path_factory.mktemp("cityscapes")
+    rng = np.random.default_rng(0)
+    for subset in ("train", "val"):
+        images = root / "leftImg8bit" / subset / "city"
+        labels = root / "gtFine" / subset / "city"
+        images.mkdir(parents=True)
+        labels.mkdir(parents=True)
+        for i in range(NUM_SAMPLES):
+            image = rng.integers(0, 256, size=(64, 128, 3), dtype=np.uint8)
+            label = rng.choice(np.r_[np.arange(19), 255], size=(64, 128)).astype(np.uint8)
+            Image.fromarray(image, 'RGB').save(images / f"city_{i:06}_000019_leftImg8bit.png")
+            Image.fromarray(label, 'L').save(labels / f"city_{i:06}_000019_gtFine_labelTrainIds.png")
+    return str(root)
+
+
+def load_batch(datadir, transform, subset="train"):
+    loader = DataLoader(cityscapes(datadir, transform, subset), batch_size=NUM_SAMPLES, shuffle=False)
+    return next(iter(loader))
+
+
+@pytest.mark.parametrize("enc", [False, True])
+@pytest.mark.parametrize("augment", [True, False])
+def test_erfnet_batch_transform_matches_pil(datadir, enc, augment):
+    images, labels = load_batch(datadir, ErfNetTransform(enc, augment=augment, height=HEIGHT))
+    transform = ErfNetBatchTransform(enc, augment=augment, height=HEIGHT)
+    batch = load_batch(datadir, transform)
+    assert len(batch) == 3
+
+    batch_images, batch_labels = transform.batch(*batch)
+    assert batch_images.dtype == images.dtype and batch_labels.dtype == labels.dtype
+    assert torch.equal(batch_images, images)
+    assert torch.equal(batch_labels, labels)
+
+
+@pytest.mark.parametrize("Transform", [ENetBatchTransform, BiSeNetBatchTransform])
+def test_batch_transforms_collate(datadir, Transform):
+    transform = Transform(augment=True, height=HEIGHT)
+    images, labels, params = load_batch(datadir, transform)
+    images, labels = transform.batch(images, labels, params)
+    assert images.shape[:2] == (NUM_SAMPLES, 3) and labels.shape[:2] == (NUM_SAMPLES, 1)
+    assert images.dtype == torch.float32 and 0 <= images.min() and images.max() <= 1
+    assert labels.dtype == torch.long and labels.max() <= 19
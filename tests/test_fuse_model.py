@@ -0,0 +1,35 @@
+# ========================================================================
+# Numerical equivalence of the fused inference models (eval/fuse_model.py)
+# with the original ones, for every registered model with random BatchNorm
+# statistics and affine parameters, bare and wrapped in DataParallel.
+#   python -m pytest tests/test_fuse_model.py
+# ========================================================================
+
+import os
+import sys
+import pytest
+
+torch = pytest.importorskip("torch")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../eval')))
+from fuse_model import fuse_model, randomize_batchnorms, check_equivalence, count_batchnorms
+from train.model_registry import MODELS, build_model
+
+RTOL = 1e-4
+
+
+@pytest.mark.parametrize("data_parallel", [False, True])
+@pytest.mark.parametrize("name", list(MODELS))
+def test_fused_model_is_equivalent(name, data_parallel):
+    torch.manual_seed(0)
+    model = randomize_batchnorms(build_model(name)).eval()
+    if data_parallel:
+        model = torch.nn.DataParallel(model)
+
+    fused = fuse_model(model)
+    assert isinstance(fused, torch.nn.DataParallel) == data_parallel
+    assert count_batchnorms(fused) < count_batchnorms(model)
+
+    images = torch.rand(2, 3, 64, 128)
+    result = check_equivalence(model, fused, images)
+    assert result['max_rel_diff'] < RTOL, result
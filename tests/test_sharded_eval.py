@@ -0,0 +1,64 @@
+# ========================================================================
+# Smoke test of the process-parallel evaluation (eval/sharded_eval.py):
+# eval_iou.py with --shards 2 --num-workers 1, i.e. DataLoader workers
+# started inside the shard processes, gives the metrics of a single-process
+# run on a random checkpoint and a small Cityscapes-like tree.
+#   python -m pytest tests/test_sharded_eval.py
+# ========================================================================
+
+import os
+import re
+import sys
+import subprocess
+import pytest
+
+torch = pytest.importorskip("torch")
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+
+EVAL_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../eval'))
+sys.path.insert(0, EVAL_DIR)
+sys.path.insert(0, os.path.dirname(EVAL_DIR))
+from sharded_eval import available_cores, shard_items
+from train.model_registry import build_model
+
+NUM_SAMPLES = 3
+
+
+def test_shard_items_cover_every_item_once():
+    items = list(range(10))
+    shards = [shard_items(items, i, 3) for i in range(3)]
+    assert sum(shards, []) == items
+    assert max(map(len, shards)) - min(map(len, shards)) <= 1
+
+
+@pytest.fixture(scope="module")
+def workdir(tmp_path_factory):
+    """Random ERFNet checkpoint and Cityscapes-like val tree of random images and trainId labels."""
+    root = tmp_path_factory.mktemp("sharded")
+    torch.manual_seed(0)
+    torch.save(build_model("erfnet").state_dict(), root / "erfnet.pth")
+    rng = np.random.default_rng(0)
+    images = root / "leftImg8bit" / "val" / "city"
+    labels = root / "gtFine" / "val" / "city"
+    images.mkdir(parents=True)
+    labels.mkdir(parents=True)
+    for i in range(NUM_SAMPLES):
+        image = rng.integers(0, 256, size=(64, 128, 3), dtype=np.uint8)
+        label = rng.choice(np.r_[np.arange(19), 255], size=(64, 128)).astype(np.uint8)
+        Image.fromarray(image, 'RGB').save(images / f"city_{i:06}_000019_leftImg8bit.png")
+        Image.fromarray(label, 'L').save(labels / f"city_{i:06}_000019_gtFine_labelTrainIds.png")
+    return str(root)
+
+
+def mean_iou(workdir, *extra):
+    command = [sys.executable, "eval_iou.py", "--loadDir", workdir + "/", "--loadWeights", "erfnet.pth",
+               "--model", "erfnet", "--datadir", workdir, "--subset", "val", "--cpu", *extra]
+    run = subprocess.run(command, cwd=EVAL_DIR, capture_output=True, text=True, timeout=600)
+    assert run.returncode == 0, run.stdout + run.stderr
+    return re.search(r"MEAN IoU:.*?(\d+\.\d+)", run.stdout).group(1)
+
+
+@pytest.mark.skipif(len(available_cores()) < 2, reason="needs 2 cores")
+def test_sharded_eval_iou_with_loader_workers(workdir):
+    assert mean_iou(workdir, "--shards", "2", "--num-workers", "1") == mean_iou(workdir, "--num-workers", "0")
@@ -0,0 +1,106 @@
+# ========================================================================
+# Validation-time benchmark of the deferred loss/IoU accumulation
+#
+# Runs the validation loop of main_v2.py (forward, loss, IoU accumulation) on
+# synthetic batches in two ways and reports the wall time per validation epoch:
+# - per-batch: loss.item() on every batch and the original one-hot iouEval
+#   (legacy=True), whose TP/FP/FN are copied to the host at every batch, as
+#   main_v2.py did before the deferred accumulation;
+# - deferred: losses summed as device tensors and the bincount confusion matrix
+#   of iouEval kept on the device, read back once at the end of the epoch.
+# The two are interleaved over --repeats epochs and the medians compared, e.g.
+# on a CPU-only machine:
+#   python benchmark_validation.py --cpu --model erfnet --batches 50 --batch-size 6
+# With --batches 84 --batch-size 6 an epoch has the size of the 500 images of
+# the Cityscapes validation set.
+# ========================================================================
+
+import os
+import sys
+import json
+import time
+import torch
+import numpy as np
+
+from argparse import ArgumentParser
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from iouEval import iouEval
+from model_registry import MODELS, build_model
+from utils.losses.ce_loss import CrossEntropyLoss2d
+from utils.weights import calculate_erfnet_weights_hard
+
+NUM_CLASSES = 20
+
+
+def synthetic_batches(count, batch_size, height, width, device, seed=0):
+    """Random images and labels (void pixels included), generated once so both modes see the same data."""
+    generator = torch.Generator().manual_seed(seed)
+    return [(torch.rand(batch_size, 3, height, width, generator=generator).to(device),
+             torch.randint(0, NUM_CLASSES, (batch_size, 1, height, width), generator=generator).to(device))
+            for _ in range(count)]
+
+
+def validation_epoch(model, criterion, batches, deferred):
+    """Wall time (s), average loss and mean IoU of one validation pass, with per-batch or deferred host reads."""
+    evaluator = iouEval(NUM_CLASSES, legacy=not deferred)
+    epoch_loss, epoch_steps = 0.0, 0
+    start = time.perf_counter()
+    with torch.inference_mode():
+        for inputs, targets in batches:
+            outputs = model(inputs)
+            if isinstance(outputs, (list, tuple)):  # BiSeNet principal output
+                outputs = outputs[0]
+            loss = criterion(outputs, targets[:, 0])
+            epoch_loss += loss.detach() if deferred else loss.item()
+            epoch_steps += 1
+            evaluator.addBatch(outputs.max(1)[1].unsqueeze(1), targets)
+    average = float(epoch_loss) / epoch_steps
+    iou, _ = evaluator.getIoU()
+    if targets.is_cuda:
+        torch.cuda.synchronize()
+    return time.perf_counter() - start, average, float(iou)
+
+
+def main(args):
+    device = torch.device('cpu' if args.cpu else 'cuda')
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    model = build_model(args.model, NUM_CLASSES, **({'aux_mode': 'eval'} if args.model == 'bisenet' else {}))
+    model = model.to(device).eval()
+    criterion = CrossEntropyLoss2d(calculate_erfnet_weights_hard(False, NUM_CLASSES).to(device))
+    batches = synthetic_batches(args.batches, args.batch_size, args.height, args.width, device)
+
+    validation_epoch(model, criterion, batches[:2], deferred=True)     # warmup
+    times = {'per-batch': [], 'deferred': []}
+    for _ in range(args.repeats):
+        for mode in times:
+            seconds, loss, iou = validation_epoch(model, criterion, batches, deferred=(mode == 'deferred'))
+            times[mode].append(seconds)
+            print(f"{mode:<9} | {seconds:8.3f} s | loss {loss:.4f} | IoU {iou:.4f}")
+
+    per_batch, deferred = np.median(times['per-batch']), np.median(times['deferred'])
+    print(f"Validation epoch ({args.batches} batches of {args.batch_size}, {args.height}x{args.width}, {device.type}, "
+          f"{torch.get_num_threads()} threads): per-batch {per_batch:.3f} s, deferred {deferred:.3f} s, "
+          f"saving {per_batch - deferred:.3f} s ({100 * (per_batch - deferred) / per_batch:.1f} %)")
+
+    if args.output_json:
+        with open(args.output_json, 'w') as f:
+            json.dump({'config': vars(args), 'torch': torch.__version__, 'seconds': times,
+                       'median_per_batch_s': float(per_batch), 'median_deferred_s': float(deferred)}, f, indent=2)
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+
+    parser.add_argument('--model', default="erfnet", choices=list(MODELS))
+    parser.add_argument('--batches', type=int, default=20)  # validation batches per epoch
+    parser.add_argument('--batch-size', type=int, default=6)
+    parser.add_argument('--height', type=int, default=512)
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--repeats', type=int, default=3)   # epochs per mode, interleaved
+    parser.add_argument('--threads', type=int, default=0)   # intra-op threads, 0: torch default
+    parser.add_argument('--cpu', action='store_true')
+    parser.add_argument('--output-json', default=None)
+
+    main(parser.parse_args())
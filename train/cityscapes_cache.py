@@ -0,0 +1,159 @@
+# ========================================================================
+# Memory-mapped cache of pre-decoded, resized Cityscapes images and labels
+#
+# cityscapes.__getitem__ decodes a 2048x1024 PNG image and its label and
+# resizes them at every access, for every epoch. This script does it once:
+# the images and labels of a subset are resized to 'height' (smaller edge,
+# as torchvision Resize) and written as raw uint8 arrays into a single file
+# - {subset}.bin   image [H, W, 3] then label [H, W] of every sample
+# - {subset}.json  height, paths relative to the dataset root and, for each
+#                  sample, the offsets and shapes of its image and label
+# The dataset then maps the file and reads the slices of a sample from it, so
+# the loader workers only copy the pixels into a PIL image (no decoding, no
+# resize) before running the augmentations.
+#
+# The augmentations still resize to their own height: with a cache built at
+# the training height (ERFNet, ENet) that resize is a no-op and batches are
+# identical to decoding the PNGs; for BiSeNet, whose random scales go up to
+# 2x, build the cache at the largest scaled height (e.g. 1024). The dataset
+# refuses a cache below the training height and warns below the scaled one.
+#
+# Build command:
+#   python cityscapes_cache.py --datadir /home/datasets/cityscapes/ --subset train val --height 512 --output ../cache/cityscapes_512
+# ========================================================================
+
+import os
+import json
+import numpy as np
+
+from PIL import Image
+from argparse import ArgumentParser
+from torch.utils.data import Dataset, DataLoader
+from torchvision.transforms import Resize
+
+from dataset import cityscapes, load_image
+
+
+class CityscapesCache:
+    """
+    Read-only view of a cache built by build_cityscapes_cache.
+
+    Parameters:
+        - cache_dir (str): Directory containing {subset}.bin and {subset}.json.
+        - subset (str): Cityscapes subset ('train', 'val', ...).
+    """
+    def __init__(self, cache_dir, subset):
+        self.path = os.path.join(cache_dir, f'{subset}.bin')
+        with open(os.path.join(cache_dir, f'{subset}.json')) as f:
+            index = json.load(f)
+        self.height = index['height']
+        self.files = index['files']
+        self.entries = index['entries']
+        self.data = None    # opened lazily, so that every loader worker maps the file itself
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['data'] = None    # a pickled memmap would copy the whole cache to the workers
+        return state
+
+    def __len__(self):
+        return len(self.entries)
+
+    def arrays(self, index):
+        """uint8 image [H, W, 3] and label [H, W] of a sample, as views on the memory map."""
+        if self.data is None:
+            self.data = np.memmap(self.path, dtype=np.uint8, mode='r')
+        entry = self.entries[index]
+        image = self.data[entry['image_offset']:entry['label_offset']].reshape(entry['image_shape'])
+        label = self.data[entry['label_offset']:entry['label_offset'] + np.prod(entry['label_shape'])]
+        return image, label.reshape(entry['label_shape'])
+
+    def get(self, index):
+        """PIL image ('RGB') and label ('L') of a sample, copied from the memory map."""
+        image, label = self.arrays(index)
+        return Image.fromarray(image, 'RGB'), Image.fromarray(label, 'L')
+
+
+class ResizedCityscapes(Dataset):
+    """Decode and resize the samples of a cityscapes dataset, used by the loader workers of the build."""
+    def __init__(self, dataset, height):
+        self.dataset = dataset
+        self.resize_image = Resize(height, Image.BILINEAR)
+        self.resize_label = Resize(height, Image.NEAREST)
+
+    def __getitem__(self, index):
+        with open(self.dataset.filenames[index], 'rb') as f:
+            image = self.resize_image(load_image(f).convert('RGB'))
+        with open(self.dataset.filenamesGt[index], 'rb') as f:
+            label = self.resize_label(load_image(f).convert('P'))
+        return index, np.array(image), np.array(label)
+
+    def __len__(self):
+        return len(self.dataset)
+
+
+def build_cityscapes_cache(root, subset, cache_dir, height=512, num_workers=4):
+    """
+    Decode and resize a Cityscapes subset once and write it to 'cache_dir'.
+
+    Parameters:
+        - root (str): Cityscapes root directory (containing leftImg8bit and gtFine).
+        - subset (str): Subset to cache ('train', 'val', ...).
+        - cache_dir (str): Output directory, created if needed.
+        - height (int): Height the images and labels are resized to.
+        - num_workers (int): Loader workers decoding the samples.
+    """
+    dataset = cityscapes(root, None, subset)
+    resized = ResizedCityscapes(dataset, height)
+
+    # output shapes from the image headers, without decoding
+    entries = []
+    offset = 0
+    for filename in dataset.filenames:
+        with Image.open(filename) as image:
+            w, h = image.size
+        shape = [height, int(height * w / h)] if h <= w else [int(height * h / w), height]
+        entries.append({
+            'image_offset': offset, 'image_shape': shape + [3],
+            'label_offset': offset + shape[0] * shape[1] * 3, 'label_shape': shape,
+        })
+        offset += shape[0] * shape[1] * 4
+
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f'{subset}.bin')
+    tmp_path = path + '.tmp'
+    data = np.memmap(tmp_path, dtype=np.uint8, mode='w+', shape=(offset,))
+    loader = DataLoader(resized, num_workers=num_workers, batch_size=None, shuffle=False)
+    for index, image, label in loader:
+        entry = entries[index]
+        assert list(image.shape) == entry['image_shape'], f"Error: unexpected size of {dataset.filenames[index]}"
+        data[entry['image_offset']:entry['label_offset']] = image.numpy().ravel()
+        data[entry['label_offset']:entry['label_offset'] + label.numel()] = label.numpy().ravel()
+    data.flush()
+    del data
+    # renamed once complete, readers never see a partial cache
+    os.replace(tmp_path, path)
+
+    with open(os.path.join(cache_dir, f'{subset}.json'), 'w') as f:
+        json.dump({
+            'height': height,
+            'files': [os.path.relpath(filename, root) for filename in dataset.filenames],
+            'entries': entries,
+        }, f)
+    print(f"Cached {len(entries)} {subset} samples ({offset / 2**30:.2f} GB) in {cache_dir}")
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--datadir', default=os.getenv("HOME") + "/datasets/cityscapes/")
+    parser.add_argument('--subset', nargs='+', default=['train', 'val'])
+    parser.add_argument('--height', type=int, default=512)
+    parser.add_argument('--output', required=True)  # cache directory, passed to main_v2.py --cache-dir
+    parser.add_argument('--num-workers', type=int, default=4)
+    args = parser.parse_args()
+
+    for subset in args.subset:
+        build_cityscapes_cache(args.datadir, subset, args.output, args.height, args.num_workers)
+
+if __name__ == '__main__':
+    main()
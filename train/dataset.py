@@ -78,7 +78,7 @@ class VOC12(Dataset):
 
 class cityscapes(Dataset):
 
-    def __init__(self, root, co_transform=None, subset='train'):
+    def __init__(self, root, co_transform=None, subset='train', cache_dir=None):
         self.images_root = os.path.join(root, 'leftImg8bit/')
         self.labels_root = os.path.join(root, 'gtFine/')
         
@@ -97,19 +97,44 @@ class cityscapes(Dataset):
 
         self.co_transform = co_transform # ADDED THIS
 
+        # pre-decoded samples built by cityscapes_cache.py, read in place of the PNGs
+        self.cache = None
+        if cache_dir is not None:
+            from cityscapes_cache import CityscapesCache
+            self.cache = CityscapesCache(cache_dir, subset)
+            assert self.cache.files == [os.path.relpath(f, root) for f in self.filenames], \
+                f"Error: cache {cache_dir} does not match the {subset} images of {root}, rebuild it"
+            self.check_cache_height(cache_dir, co_transform)
+
+    def check_cache_height(self, cache_dir, co_transform):
+        """A cache smaller than the transform height would be silently upsampled: fail below it, warn below the random scales."""
+        height = getattr(co_transform, 'height', None)
+        if height is None:
+            return
+        assert self.cache.height >= height, \
+            f"Error: cache {cache_dir} built at height {self.cache.height}, below the training height {height}, rebuild it with --height {height}"
+        scales = getattr(co_transform, 'scales', (1.0,)) if getattr(co_transform, 'augment', False) else (1.0,)
+        scaled_height = int(height * max(scales))
+        if self.cache.height < scaled_height:
+            print(f"Warning: cache {cache_dir} built at height {self.cache.height}, images scaled up to {scaled_height} "
+                  f"are upsampled from it, rebuild it with --height {scaled_height} to match the decoded PNGs")
 
     def __getitem__(self, index):
         filename = self.filenames[index]
         filenameGt = self.filenamesGt[index]
 
-        with open(filename, 'rb') as f:
-            image = load_image(f).convert('RGB')
-        with open(filenameGt, 'rb') as f:
-            label = load_image(f).convert('P')
+        if self.cache is not None:
+            image, label = self.cache.get(index)
+        else:
+            with open(filename, 'rb') as f:
+                image = load_image(f).convert('RGB')
+            with open(filenameGt, 'rb') as f:
+                label = load_image(f).convert('P')
 
         if self.co_transform is not None:
             seed = get_seed_from_path(filename)
-            image, label = self.co_transform(image, label, seed)
+            # (image, label), or (image, label, params) for the batched transforms of utils/batch_augmentations.py
+            return self.co_transform(image, label, seed)
         else:   # ADDED THIS FOR INITIAL MEAN COMPUTATION
             image = ToTensor()(image)
             label = ToLabel()(label)
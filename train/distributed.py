@@ -0,0 +1,135 @@
+# ========================================================================
+# Distributed data-parallel training helpers (torchrun)
+#
+# "main_v2.py --distributed" runs one process per GPU, or per group of CPU
+# cores with the gloo backend, launched by torchrun:
+#   torchrun --nproc_per_node 4 main_v2.py --distributed --cpu ...
+# instead of the single-process, GIL-bound nn.DataParallel:
+# - the model is wrapped in DistributedDataParallel (optionally with its
+#   BatchNorms converted to SyncBatchNorm, CUDA only);
+# - every process loads its own shard of the training set (DistributedSampler,
+#   reshuffled each epoch) and of the validation set (ShardedSampler, no
+#   padding, so no image is counted twice); augmentations stay seeded by the
+#   image path (get_seed_from_path), whatever the process loading the image;
+# - losses and IoU confusion matrices are summed over the processes before
+#   being reported, checkpoints and logs are written by rank 0 only.
+# Without torchrun (no WORLD_SIZE in the environment) every helper falls back
+# to the single-process behaviour.
+# ========================================================================
+
+import os
+import builtins
+import torch
+import torch.distributed as dist
+
+from torch.utils.data import Sampler
+from torch.nn.parallel import DistributedDataParallel
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def init_distributed(cuda):
+    """
+    Join the process group set up by torchrun: nccl on CUDA (one GPU per process), gloo on the CPU.
+
+    Returns:
+        - tuple[int, int, int]: rank, local rank and world size ((0, 0, 1) when not launched by torchrun).
+    """
+    if 'WORLD_SIZE' not in os.environ:
+        print("Warning: --distributed without torchrun, training in a single process")
+        return 0, 0, 1
+    rank, local_rank, world_size = int(os.environ['RANK']), int(os.environ['LOCAL_RANK']), int(os.environ['WORLD_SIZE'])
+    if cuda:
+        torch.cuda.set_device(local_rank)
+    dist.init_process_group('nccl' if cuda else 'gloo')
+    silence_other_ranks(rank == 0)
+    print(f"Distributed training: {world_size} processes ({'nccl' if cuda else 'gloo'})")
+    return rank, local_rank, world_size
+
+
+def silence_other_ranks(is_main):
+    """Only rank 0 prints, unless print(..., force=True)."""
+    builtin_print = builtins.print
+
+    def print(*args, **kwargs):
+        force = kwargs.pop('force', False)
+        if is_main or force:
+            builtin_print(*args, **kwargs)
+    builtins.print = print
+
+
+def cleanup_distributed():
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+def wrap_ddp(model, cuda, sync_bn=False, find_unused_parameters=False):
+    """
+    DistributedDataParallel wrapper of a model, on the GPU of the process or on the CPU.
+
+    Parameters:
+        - model (nn.Module): Bare model (parameters identical on every rank after the wrap: rank 0 broadcasts them).
+        - cuda (bool): Train on the GPU of the local rank.
+        - sync_bn (bool): Convert the BatchNorms to SyncBatchNorm (batch statistics over all processes).
+        - find_unused_parameters (bool): Needed when some parameters get no gradient (frozen layers of
+            fine-tuning, ERFNet decoder during the encoder training).
+    """
+    if sync_bn:
+        if cuda:
+            model = torch.nn.SyncBatchNorm.convert_sync_batchnorm(model)
+        else:
+            print("Warning: SyncBatchNorm needs CUDA, keeping per-process BatchNorm statistics on the CPU")
+    if cuda:
+        model = model.cuda()
+        return DistributedDataParallel(model, device_ids=[torch.cuda.current_device()],
+                                       find_unused_parameters=find_unused_parameters)
+    return DistributedDataParallel(model, find_unused_parameters=find_unused_parameters)
+
+
+def all_reduce_sum(tensor):
+    """Sum of a tensor over all processes (in place), the tensor itself when not distributed."""
+    if is_distributed():
+        dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor
+
+
+def all_reduce_iou(evaluator, device):
+    """Sum the iouEval confusion matrix (or legacy TP/FP/FN) of every process into each of them."""
+    if not is_distributed():
+        return evaluator
+    if evaluator.legacy:
+        for name in ('tp', 'fp', 'fn'):
+            setattr(evaluator, name, all_reduce_sum(getattr(evaluator, name).to(device)).cpu())
+    else:
+        if evaluator.conf is None:     # no batch on this process
+            evaluator.conf = torch.zeros(evaluator.nClasses, evaluator.nClasses, dtype=torch.long, device=device)
+        all_reduce_sum(evaluator.conf)
+    return evaluator
+
+
+class ShardedSampler(Sampler):
+    """Indices rank, rank + world_size, ... of a dataset: every sample seen once over all processes (evaluation)."""
+    def __init__(self, dataset, rank=None, world_size=None):
+        self.length = len(dataset)
+        self.rank = get_rank() if rank is None else rank
+        self.world_size = get_world_size() if world_size is None else world_size
+
+    def __iter__(self):
+        return iter(range(self.rank, self.length, self.world_size))
+
+    def __len__(self):
+        return len(range(self.rank, self.length, self.world_size))
@@ -3,9 +3,14 @@
 # URL: https://arxiv.org/abs/1606.02147 by Adam Paszke, Abhishek Chaurasia, et al.
 # ===============================================================================
 
+import os
+import sys
 import torch.nn as nn
 import torch
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from train.utils.checkpointing import run_checkpointed
+
 
 class InitialBlock(nn.Module):
 
@@ -273,6 +278,15 @@ class UpsamplingBottleneck(nn.Module):
 
 class ENet(nn.Module):
     ''' Generate the ENet model '''
+    # RegularBottleneck runs of the stages that can be checkpointed (utils/checkpointing.py)
+    CHECKPOINT_STAGES = {
+        1: ('regular1_1', 'regular1_2', 'regular1_3', 'regular1_4'),
+        2: ('regular2_1', 'dilated2_2', 'asymmetric2_3', 'dilated2_4', 'regular2_5', 'dilated2_6', 'asymmetric2_7', 'dilated2_8'),
+        3: ('regular3_0', 'dilated3_1', 'asymmetric3_2', 'dilated3_3', 'regular3_4', 'dilated3_5', 'asymmetric3_6', 'dilated3_7'),
+        4: ('regular4_1', 'regular4_2'),
+        5: ('regular5_1',),
+    }
+
     def __init__(self, num_classes, encoder_relu=False, decoder_relu=True):
         super().__init__()
         self.initial_block = InitialBlock(3, 16, relu=encoder_relu)
@@ -314,6 +328,13 @@ class ENet(nn.Module):
         self.regular5_1 = RegularBottleneck(16, padding=1, dropout_prob=0.1, relu=decoder_relu)
         self.transposed_conv = nn.ConvTranspose2d(16, num_classes, kernel_size=3, stride=2, padding=1, bias=False)
 
+        self.checkpoint_segments = {}   # stage -> checkpointed segments, set by set_activation_checkpointing
+
+    def stage(self, index, x):
+        """Bottleneck run of a stage, checkpointed if enabled for it."""
+        blocks = [getattr(self, name) for name in self.CHECKPOINT_STAGES[index]]
+        return run_checkpointed(blocks, x, self.checkpoint_segments.get(index, 0))
+
     def forward(self, x):
         #initial block
         input_size = x.size()
@@ -322,40 +343,22 @@ class ENet(nn.Module):
         #Stage 1 (Encoder)
         stage1_input_size = x.size()
         x, max_indices1 = self.downsample1_0(x)
-        x = self.regular1_1(x)
-        x = self.regular1_2(x)
-        x = self.regular1_3(x)
-        x = self.regular1_4(x)
+        x = self.stage(1, x)
 
         #Stage 2 (Encoder)
         stage2_input_size = x.size()
         x, max_indices2 = self.downsample2_0(x)
-        x = self.regular2_1(x)
-        x = self.dilated2_2(x)
-        x = self.asymmetric2_3(x)
-        x = self.dilated2_4(x)
-        x = self.regular2_5(x)
-        x = self.dilated2_6(x)
-        x = self.asymmetric2_7(x)
-        x = self.dilated2_8(x)
+        x = self.stage(2, x)
 
         #Stage 3 (Encoder)
-        x = self.regular3_0(x)
-        x = self.dilated3_1(x)
-        x = self.asymmetric3_2(x)
-        x = self.dilated3_3(x)
-        x = self.regular3_4(x)
-        x = self.dilated3_5(x)
-        x = self.asymmetric3_6(x)
-        x = self.dilated3_7(x)
+        x = self.stage(3, x)
 
         #Stage 4 (Decoder)
         x = self.upsample4_0(x, max_indices2, output_size=stage2_input_size)
-        x = self.regular4_1(x)
-        x = self.regular4_2(x)
+        x = self.stage(4, x)
 
         #Stage 5 (Decoder)
         x = self.upsample5_0(x, max_indices1, output_size=stage1_input_size)
-        x = self.regular5_1(x)
+        x = self.stage(5, x)
         x = self.transposed_conv(x, output_size=input_size)
         return x
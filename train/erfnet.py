@@ -12,6 +12,7 @@ import torch.nn.functional as F
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from train.utils.losses.isomax_plus_loss import IsoMaxPlusLossSecondPart, IsoMaxPlusLossFirstPart
+from train.utils.checkpointing import run_checkpointed
 
 class DownsamplerBlock (nn.Module):
     def __init__(self, ninput, noutput):
@@ -66,6 +67,9 @@ class non_bottleneck_1d (nn.Module):
 
 
 class Encoder(nn.Module):
+    # indices in self.layers of the stages that can be checkpointed (utils/checkpointing.py)
+    CHECKPOINT_STAGES = {1: range(0, 6), 2: range(6, 15)}
+
     def __init__(self, num_classes):
         super().__init__()
         self.initial_block = DownsamplerBlock(3,16)
@@ -88,11 +92,17 @@ class Encoder(nn.Module):
         # Only in encoder mode:
         self.output_conv = nn.Conv2d(128, num_classes, 1, stride=1, padding=0, bias=True)
 
+        self.checkpoint_segments = {}   # stage -> checkpointed segments, set by set_activation_checkpointing
+
     def forward(self, input, predict=False):
         output = self.initial_block(input)
 
-        for layer in self.layers:
-            output = layer(output)
+        if self.checkpoint_segments:
+            for stage, indices in self.CHECKPOINT_STAGES.items():
+                output = run_checkpointed([self.layers[i] for i in indices], output, self.checkpoint_segments.get(stage, 0))
+        else:
+            for layer in self.layers:
+                output = layer(output)
 
         if predict:
             output = self.output_conv(output)
@@ -1,17 +1,19 @@
 import os
 import sys
+import glob
+import copy
+import contextlib
 import math
 import time
 import torch
+import itertools
 import random
-import importlib
 import numpy as np
 
 from PIL import Image, ImageOps
 from argparse import ArgumentParser
 
-from torch.autograd import Variable
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, DistributedSampler
 from torch.optim import SGD, Adam, lr_scheduler
 from torchvision.transforms import Compose, CenterCrop, Normalize, Resize, Pad
 from torchvision.transforms import ToTensor, ToPILImage
@@ -21,6 +23,9 @@ from transform import Relabel, ToLabel, Colorize
 from visualize import Dashboard
 
 from iouEval import iouEval, getColorEntry
+from model_registry import MODELS, build_model, load_model, load_checkpoint, read_checkpoint, unwrap
+from distributed import (init_distributed, cleanup_distributed, wrap_ddp, is_main_process,
+                         all_reduce_sum, all_reduce_iou, ShardedSampler)
 from shutil import copyfile
 
 # Import loss functions
@@ -34,6 +39,10 @@ from utils.losses.isomax_plus_loss import IsoMaxPlusLossSecondPart
 # Import functions for class weights computation and data augmentation
 from utils.weights import calculate_enet_weights, calculate_erfnet_weights, calculate_erfnet_weights_hard
 from utils.augmentations import ErfNetTransform, BiSeNetTransform, ENetTransform
+from utils.batch_augmentations import ErfNetBatchTransform, BiSeNetBatchTransform, ENetBatchTransform
+from utils.memory import SavedTensorMeter, peak_memory, reset_peak_memory, synchronize
+from utils.checkpointing import set_activation_checkpointing
+from utils.checkpoint_manager import CheckpointManager, cpu_snapshot, latest_valid_checkpoint
 
 NUM_CHANNELS = 3
 NUM_CLASSES = 20    # Cityscapes dataset (19 + 1)
@@ -58,23 +67,35 @@ def train(args, model, enc=False):
     assert os.path.exists(args.datadir), "Error: datadir (dataset directory) could not be loaded" 
 
     # ========== DATA AUGMENTATION ==========
+    # batched transforms: resize in the loader workers, augmentations on the collated batch (on the device)
     if args.model == "erfnet" or args.model == "erfnet_isomaxplus":
-        co_transform = ErfNetTransform(enc, augment=True, height=args.height)
-        co_transform_val = ErfNetTransform(enc, augment=False, height=args.height)
+        Transform = ErfNetBatchTransform if args.batch_augment else ErfNetTransform
+        co_transform = Transform(enc, augment=True, height=args.height)
+        co_transform_val = Transform(enc, augment=False, height=args.height)
     elif args.model == "enet":
-        co_transform = ENetTransform(augment=True, height=args.height)
-        co_transform_val = ENetTransform(augment=False, height=args.height)
+        Transform = ENetBatchTransform if args.batch_augment else ENetTransform
+        co_transform = Transform(augment=True, height=args.height)
+        co_transform_val = Transform(augment=False, height=args.height)
     else:   # BiSeNet
-        co_transform = BiSeNetTransform(augment=True)
-        co_transform_val = BiSeNetTransform(augment=False)
+        Transform = BiSeNetBatchTransform if args.batch_augment else BiSeNetTransform
+        co_transform = Transform(augment=True)
+        co_transform_val = Transform(augment=False)
 
     # ========== TRAIN AND VAL DATASET ==========
-    dataset_train = cityscapes(args.datadir, co_transform, 'train')
-    dataset_val = cityscapes(args.datadir, co_transform_val, 'val')
-    loader = DataLoader(dataset_train, num_workers=args.num_workers, batch_size=args.batch_size, shuffle=True)
-    loader_val = DataLoader(dataset_val, num_workers=args.num_workers, batch_size=args.batch_size, shuffle=False)
+    dataset_train = cityscapes(args.datadir, co_transform, 'train', cache_dir=args.cache_dir)
+    dataset_val = cityscapes(args.datadir, co_transform_val, 'val', cache_dir=args.cache_dir)
+    # --distributed: each process loads its shard (augmentations stay seeded by the image path), --batch-size per process
+    sampler = DistributedSampler(dataset_train, shuffle=True) if args.distributed else None
+    sampler_val = ShardedSampler(dataset_val) if args.distributed else None
+    loader = DataLoader(dataset_train, num_workers=args.num_workers, batch_size=args.batch_size, shuffle=sampler is None, sampler=sampler)
+    loader_val = DataLoader(dataset_val, num_workers=args.num_workers, batch_size=args.batch_size, shuffle=False, sampler=sampler_val)
 
     # ========== CLASS WEIGHTS ==========
+    # the class histograms cover the whole training set on every process, so all of them use the same weights
+    loader_hist = DataLoader(dataset_train, num_workers=args.num_workers, batch_size=args.batch_size) if args.distributed else loader
+    if args.batch_augment:
+        # histograms of the labels the network is trained on: batch() downscales them (ERFNet encoder) and fills the translations
+        loader_hist = (co_transform.batch(*batch) for batch in loader_hist)
     if args.model == "erfnet" or args.model == "erfnet_isomaxplus":
         if args.class_weights == "hard":
             weights = calculate_erfnet_weights_hard(enc, NUM_CLASSES)
@@ -82,7 +103,7 @@ def train(args, model, enc=False):
             mode = "encoder" if enc else "decoder"
             if not os.path.exists(f"./utils/class_distribution/erfnet_class_weights_{mode}.npy"):
                 print("Calculating class weights...")
-                weights = calculate_erfnet_weights(loader, NUM_CLASSES, enc)
+                weights = calculate_erfnet_weights(loader_hist, NUM_CLASSES, enc)
             else:
                 weights = torch.tensor(np.load(f"./utils/class_distribution/erfnet_class_weights_{mode}.npy"))
         else:
@@ -90,7 +111,7 @@ def train(args, model, enc=False):
     elif args.model == "enet":
         if not os.path.exists("./utils/class_distribution/enet_class_weights.npy"):
             print("Calculating class weights...")
-            weights = calculate_enet_weights(loader, NUM_CLASSES)
+            weights = calculate_enet_weights(loader_hist, NUM_CLASSES)
         else:
             weights = torch.tensor(np.load("./utils/class_distribution/enet_class_weights.npy"))   
     else: 
@@ -145,6 +166,45 @@ def train(args, model, enc=False):
 
     print(f"Criterion: {type(criterion_principal) if args.model == 'bisenet' else criterion}")
 
+    def forward(inputs):
+        if args.model == "erfnet" or args.model == "erfnet_isomaxplus":
+            return model(inputs, only_encode = enc)
+        return model(inputs)
+
+    def compute_loss(outputs, targets):
+        # compute loss (for BiSeNet combination of three components)
+        if args.model == "bisenet":
+            loss_principal = criterion_principal(outputs[0], targets[:, 0])
+            loss_aux16 = criterion_aux16(outputs[1], targets[:, 0])
+            loss_aux32 = criterion_aux32(outputs[2], targets[:, 0])
+            return loss_principal + 0.4 * loss_aux16 + 0.4 * loss_aux32
+        # for ERFNet (also IsoMaxPlus) and ENet
+        return criterion(outputs, targets[:, 0])
+
+    def prepare(batch, transform):
+        images, labels = batch[0], batch[1]
+        if args.cuda:
+            images = images.cuda()
+            labels = labels.cuda()
+        if args.batch_augment:
+            images, labels = transform.batch(images, labels, batch[2].to(images.device))
+        return images, labels
+
+    # ========== MIXED PRECISION ==========
+    # autocast of the forward pass and the losses (computed in fp32 inside, see utils/losses), bf16 by default on
+    # the CPU and fp16 on CUDA; fp16 gradients are scaled to avoid underflows
+    device = torch.device('cuda' if args.cuda else 'cpu')
+    amp_dtype = autocast_dtype(args)
+    precision = str(amp_dtype).replace('torch.', '') if args.amp else 'fp32'
+    scaler = grad_scaler(device, enabled=args.amp and amp_dtype == torch.float16)
+
+    # ========== ACTIVATION CHECKPOINTING ==========
+    # stages of the ERFNet encoder / ENet bottlenecks recomputed in backward instead of keeping their activations
+    if args.checkpoint_segments > 0:
+        stages = set_activation_checkpointing(model, args.checkpoint_segments, args.checkpoint_stages)
+        print(f"Activation checkpointing: {args.checkpoint_segments} segments per stage, stages {stages}")
+    saved_meter = SavedTensorMeter(model.parameters())  # memory kept for backward, measured on the first batch of each epoch
+
     savedir = f'../save/{args.savedir}'
 
     # ========== ENCODER/DECODER ==========
@@ -155,12 +215,13 @@ def train(args, model, enc=False):
         automated_log_path = savedir + "/automated_log.txt"
         modeltxtpath = savedir + "/model.txt"    
 
-    if (not os.path.exists(automated_log_path)):    # do not add first line if it exists 
-        with open(automated_log_path, "a") as myfile:
-            myfile.write("Epoch\t\tTrain-loss\t\tTest-loss\t\tTrain-IoU\t\tTest-IoU\t\tlearningRate")
+    if is_main_process():   # logs and checkpoints are written by rank 0 only
+        if (not os.path.exists(automated_log_path)):    # do not add first line if it exists 
+            with open(automated_log_path, "a") as myfile:
+                myfile.write("Epoch\t\tTrain-loss\t\tTest-loss\t\tTrain-IoU\t\tTest-IoU\t\tlearningRate")
 
-    with open(modeltxtpath, "w") as myfile:
-        myfile.write(str(model))
+        with open(modeltxtpath, "w") as myfile:
+            myfile.write(str(model))
 
     # ========== FINE-TUNING ========== 
     if args.FineTune:
@@ -169,13 +230,13 @@ def train(args, model, enc=False):
             param.requires_grad = False
         
         if args.model == "erfnet" or args.model == "erfnet_isomaxplus":
-            for param in model.module.decoder.output_conv.parameters():
+            for param in unwrap(model).decoder.output_conv.parameters():
                 param.requires_grad = True
         elif args.model == "enet":
-            for param in model.module.transposed_conv.parameters():
+            for param in unwrap(model).transposed_conv.parameters():
                 param.requires_grad = True
         else: # BiSeNet
-            for param in model.module.conv_out.parameters():
+            for param in unwrap(model).conv_out.parameters():
                 param.requires_grad = True
         
     # ========== OPTIMIZER ==========
@@ -197,6 +258,10 @@ def train(args, model, enc=False):
     else:   # BiSeNet
         optimizer = SGD(model.parameters(), lr=2.5e-3 if args.FineTune else 2.5e-2, momentum=0.9, weight_decay=1e-4)
 
+    # ========== CHECKPOINTS ==========
+    # CPU snapshots written atomically in a background thread, --keep-checkpoints epoch-numbered files kept
+    checkpoints = CheckpointManager(args.keep_checkpoints, asynchronous=not args.sync_checkpoints)
+
     start_epoch = 1
     if args.resume:
         # Must load weights, optimizer, epoch and best value. 
@@ -205,17 +270,19 @@ def train(args, model, enc=False):
         else:
             filenameCheckpoint = savedir + '/checkpoint.pth.tar'
 
-        assert os.path.exists(filenameCheckpoint), "Error: resume option was used but checkpoint was not found in folder"
-        checkpoint = torch.load(filenameCheckpoint)
+        # newest checkpoint that loads, older epoch-numbered ones if the latest is unreadable
+        filenameCheckpoint, checkpoint = latest_valid_checkpoint(
+            [filenameCheckpoint] + glob.glob(checkpoint_series(filenameCheckpoint)), read_checkpoint)
+        assert checkpoint is not None, "Error: resume option was used but no valid checkpoint was found in folder"
         start_epoch = checkpoint['epoch']
 
-        state_dict = {key.replace("module.", ""): value for key, value in checkpoint['state_dict'].items()}
-        
-        model.load_state_dict(checkpoint['state_dict'])
+        load_checkpoint(model, checkpoint)
         optimizer.load_state_dict(checkpoint['optimizer'])
+        if checkpoint.get('scaler') and scaler.is_enabled():     # empty when saved without fp16 scaling
+            scaler.load_state_dict(checkpoint['scaler'])
         best_acc = checkpoint['best_acc']
         
-        print("=> Loaded checkpoint at epoch {})".format(checkpoint['epoch']))
+        print("=> Loaded checkpoint {} at epoch {})".format(filenameCheckpoint, checkpoint['epoch']))
             
 
     # ========== LEARNING RATE SCHEDULER ==========
@@ -230,6 +297,12 @@ def train(args, model, enc=False):
         for _ in range(start_epoch-1):
             scheduler.step()
 
+    if args.amp_benchmark > 0:
+        batches = [prepare(batch, co_transform) for batch in itertools.islice(loader, args.amp_benchmark + 1)]
+        benchmark_precision(model, batches, lambda inputs, targets: compute_loss(forward(inputs), targets),
+                            device, amp_dtype)
+        del batches
+
     # ========== MODEL VISUALIZATION ==========
     if args.visualize and args.steps_plot > 0:
         board = Dashboard(args.port)
@@ -241,8 +314,11 @@ def train(args, model, enc=False):
         print("----- TRAINING - EPOCH", epoch, "-----")
 
         scheduler.step()    
+        if sampler is not None:
+            sampler.set_epoch(epoch)    # new shuffle of the shards at each epoch, the same on every process
 
-        epoch_loss = []
+        epoch_loss = 0.0    # summed on the device, read back only at logging steps and at the end of the epoch
+        epoch_steps = 0
         time_train = []
      
         doIouTrain = args.iouTrain   
@@ -257,46 +333,44 @@ def train(args, model, enc=False):
             usedLr = float(param_group['lr'])
 
         model.train()
-        for step, (images, labels) in enumerate(loader):
+        reset_peak_memory(device)
+        for step, batch in enumerate(loader):
             start_time = time.time()
-
-            if args.cuda:
-                images = images.cuda()
-                labels = labels.cuda()
-
-            inputs = Variable(images)
-            targets = Variable(labels)
+            images, labels = prepare(batch, co_transform)
             optimizer.zero_grad()
 
-            if args.model == "erfnet" or args.model == "erfnet_isomaxplus":
-                outputs = model(inputs, only_encode = enc)
-            else:
-                outputs = model(inputs)
-
-            # compute loss (for BiSeNet combination of three components)
-            if args.model == "bisenet":
-                loss_principal = criterion_principal(outputs[0], targets[:, 0])
-                loss_aux16 = criterion_aux16(outputs[1], targets[:, 0])
-                loss_aux32 = criterion_aux32(outputs[2], targets[:, 0])
-                loss = loss_principal + 0.4 * loss_aux16 + 0.4 * loss_aux32
-            else:   # for ERFNet (also IsoMaxPlus) and ENet
-                loss = criterion(outputs, targets[:, 0])
+            # micro-batches: the gradients of the chunks of the batch are accumulated, each loss weighted by
+            # its share of the batch, then a single optimizer step is taken for the whole batch
+            # with DDP the gradients are all-reduced in the backward of the last micro-batch only
+            loss = 0.0
+            chunks = list(zip(images.chunk(args.micro_batches), labels.chunk(args.micro_batches)))
+            for micro, (inputs, targets) in enumerate(chunks):
+                meter = saved_meter if step == 0 and micro == 0 else contextlib.nullcontext()
+                sync = model.no_sync() if hasattr(model, 'no_sync') and micro < len(chunks) - 1 else contextlib.nullcontext()
+                with sync:
+                    with meter, torch.autocast(device.type, dtype=amp_dtype, enabled=args.amp):
+                        outputs = forward(inputs)
+                        micro_loss = compute_loss(outputs, targets) * (inputs.size(0) / images.size(0))
+
+                    scaler.scale(micro_loss).backward()
+                loss += micro_loss.detach()
+
+                if (doIouTrain):
+                    if args.model == "bisenet":
+                        iouEvalTrain.addBatch(outputs[0].max(1)[1].unsqueeze(1).data, targets.data)
+                    else:
+                        iouEvalTrain.addBatch(outputs.max(1)[1].unsqueeze(1).data, targets.data)
 
-            loss.backward()
-            optimizer.step()
+            scaler.step(optimizer)
+            scaler.update()
 
-            epoch_loss.append(loss.data.item())
+            epoch_loss += loss
+            epoch_steps += 1
             time_train.append(time.time() - start_time)
 
-            if (doIouTrain):
-                if args.model == "bisenet":
-                    iouEvalTrain.addBatch(outputs[0].max(1)[1].unsqueeze(1).data, targets.data)
-                else:
-                    iouEvalTrain.addBatch(outputs.max(1)[1].unsqueeze(1).data, targets.data)
-                
             if args.visualize and args.steps_plot > 0 and step % args.steps_plot == 0:
                 start_time_plot = time.time()
-                image = inputs[0].cpu().data
+                image = inputs[0].cpu().data    # first image of the last micro-batch
                 
                 board.image(image, f'input (epoch: {epoch}, step: {step})')
                 if isinstance(outputs, list):   # merge gpu tensors
@@ -309,15 +383,22 @@ def train(args, model, enc=False):
                     f'target (epoch: {epoch}, step: {step})')
                 print ("Time to paint images: ", time.time() - start_time_plot)
             if args.steps_loss > 0 and step % args.steps_loss == 0:
-                average = sum(epoch_loss) / len(epoch_loss)
+                average = float(epoch_loss) / epoch_steps
                 print(f'loss: {average:0.4} (epoch: {epoch}, step: {step})', 
                         "// Avg time/img: %.4f s" % (sum(time_train) / len(time_train) / args.batch_size))
 
             
-        average_epoch_loss_train = sum(epoch_loss) / len(epoch_loss)
+        # losses and IoU counts summed over the processes (unchanged without --distributed)
+        totals = all_reduce_sum(torch.tensor([float(epoch_loss), epoch_steps], dtype=torch.float64, device=device))
+        average_epoch_loss_train = float(totals[0] / totals[1])
+        synchronize(device)
+        print(f"Train throughput: {epoch_steps * args.batch_size / sum(time_train):.2f} img/s "
+              f"| peak memory: {peak_memory(device) / 2**20:.0f} MB "
+              f"| saved for backward: {saved_meter.bytes / 2**20:.0f} MB per micro-batch ({precision}, epoch: {epoch})")
         
         iouTrain = 0
         if (doIouTrain):
+            all_reduce_iou(iouEvalTrain, device)
             iouTrain, iou_classes = iouEvalTrain.getIoU()
             iouStr = getColorEntry(iouTrain)+'{:0.2f}'.format(iouTrain*100) + '\033[0m'
             print ("EPOCH IoU on TRAIN set: ", iouStr, "%")  
@@ -325,36 +406,25 @@ def train(args, model, enc=False):
         # Validate on 500 val images after each epoch of training
         print("----- VALIDATING - EPOCH", epoch, "-----")
         model.eval()
-        epoch_loss_val = []
+        epoch_loss_val = 0.0
+        epoch_steps_val = 0
         time_val = []
+        start_time_val = time.time()
 
         if (doIouVal):
             iouEvalVal = iouEval(NUM_CLASSES)
 
-        for step, (images, labels) in enumerate(loader_val):
+        for step, batch in enumerate(loader_val):
             start_time = time.time()
-            if args.cuda:
-                images = images.cuda()
-                labels = labels.cuda()
+            inputs, targets = prepare(batch, co_transform_val)
 
-            inputs = Variable(images, volatile=True)    # volatile flag makes it free backward or outputs for eval
-            targets = Variable(labels, volatile=True)
-            
-            if args.model == "erfnet" or args.model == "erfnet_isomaxplus":
-                outputs = model(inputs, only_encode = enc)
-            else:
-                outputs = model(inputs)
-
-            # compute loss (for BiSeNet combination of three components)
-            if args.model == "bisenet":
-                loss_principal = criterion_principal(outputs[0], targets[:, 0])
-                loss_aux16 = criterion_aux16(outputs[1], targets[:, 0])
-                loss_aux32 = criterion_aux32(outputs[2], targets[:, 0])
-                loss = loss_principal + 0.4 * loss_aux16 + 0.4 * loss_aux32
-            else:   # for ERFNet and ENet
-                loss = criterion(outputs, targets[:, 0])
-
-            epoch_loss_val.append(loss.item())
+            # no autograd state at all (the former Variable(volatile=True) is a no-op since PyTorch 0.4)
+            with torch.inference_mode(), torch.autocast(device.type, dtype=amp_dtype, enabled=args.amp):
+                outputs = forward(inputs)
+                loss = compute_loss(outputs, targets)
+
+            epoch_loss_val += loss.detach()
+            epoch_steps_val += 1
             time_val.append(time.time() - start_time)
 
 
@@ -380,18 +450,21 @@ def train(args, model, enc=False):
                     f'VAL target (epoch: {epoch}, step: {step})')
                 print ("Time to paint images: ", time.time() - start_time_plot)
             if args.steps_loss > 0 and step % args.steps_loss == 0:
-                average = sum(epoch_loss_val) / len(epoch_loss_val)
+                average = float(epoch_loss_val) / epoch_steps_val
                 print(f'VAL loss: {average:0.4} (epoch: {epoch}, step: {step})', 
                         "// Avg time/img: %.4f s" % (sum(time_val) / len(time_val) / args.batch_size))
                        
 
-        average_epoch_loss_val = sum(epoch_loss_val) / len(epoch_loss_val)
+        totals = all_reduce_sum(torch.tensor([float(epoch_loss_val), epoch_steps_val], dtype=torch.float64, device=device))
+        average_epoch_loss_val = float(totals[0] / totals[1])
 
         iouVal = 0
         if (doIouVal):
+            all_reduce_iou(iouEvalVal, device)
             iouVal, iou_classes = iouEvalVal.getIoU()
             iouStr = getColorEntry(iouVal)+'{:0.2f}'.format(iouVal*100) + '\033[0m'
             print ("EPOCH IoU on VAL set: ", iouStr, "%") 
+        print(f"Validation time: {time.time() - start_time_val:.2f} s (epoch: {epoch})")
            
 
         # remember best valIoU and save checkpoint
@@ -408,17 +481,18 @@ def train(args, model, enc=False):
             filenameCheckpoint = savedir + '/checkpoint.pth.tar'
             filenameBest = savedir + '/model_best.pth.tar'
 
-        
+        memo = {}   # CPU copies of the tensors, shared by all the files of the epoch
         if args.model == "erfnet_isomaxplus":
             # only for saving also the loss first part dict
             save_checkpoint({
                 'epoch': epoch + 1,
                 'arch': str(model),
                 'state_dict': model.state_dict(),
-                'loss_first_part_state_dict': model.module.decoder.state_dict(),
+                'loss_first_part_state_dict': unwrap(model).decoder.state_dict(),
                 'best_acc': best_acc,
                 'optimizer' : optimizer.state_dict(),
-            }, is_best, filenameCheckpoint, filenameBest)
+                'scaler': scaler.state_dict(),
+            }, is_best, filenameCheckpoint, filenameBest, checkpoints, memo, epoch)
         else:
             save_checkpoint({
                 'epoch': epoch + 1,
@@ -426,27 +500,32 @@ def train(args, model, enc=False):
                 'state_dict': model.state_dict(),
                 'best_acc': best_acc,
                 'optimizer' : optimizer.state_dict(),
-            }, is_best, filenameCheckpoint, filenameBest)
+                'scaler': scaler.state_dict(),
+            }, is_best, filenameCheckpoint, filenameBest, checkpoints, memo, epoch)
 
         # SAVE MODEL AFTER EPOCH
         if (enc):
             filename = f'{savedir}/model_encoder-{epoch:03}.pth'
             filenamebest = f'{savedir}/model_encoder_best.pth'
+            filenameSeries = f'{savedir}/model_encoder-*.pth'
         else:
             filename = f'{savedir}/model-{epoch:03}.pth'
             filenamebest = f'{savedir}/model_best.pth'
+            filenameSeries = f'{savedir}/model-*.pth'
 
-        def save_model(model, filename, save_isomax=False):
+        def save_model(model, filename, save_isomax=False, retain=None):
+            if not is_main_process():
+                return
             state = {'state_dict': model.state_dict()}
-            if save_isomax and hasattr(model.module.decoder, 'loss_first_part'):
-                state['loss_first_part_state_dict'] = model.module.decoder.loss_first_part.state_dict()
-            torch.save(state, filename)
+            if save_isomax and hasattr(unwrap(model).decoder, 'loss_first_part'):
+                state['loss_first_part_state_dict'] = unwrap(model).decoder.loss_first_part.state_dict()
+            checkpoints.save(cpu_snapshot(state, memo), filename, retain=retain)
         
         if args.epochs_save > 0 and step > 0 and step % args.epochs_save == 0:
             if args.model == "erfnet_isomaxplus":
-                save_model(model, filename, save_isomax=True)
+                save_model(model, filename, save_isomax=True, retain=filenameSeries)
             else:
-                save_model(model, filename)
+                save_model(model, filename, retain=filenameSeries)
             print(f'save: {filename} (epoch: {epoch})')
 
         if (is_best):
@@ -455,45 +534,114 @@ def train(args, model, enc=False):
             else:
                 save_model(model, filenamebest)
             print(f'save: {filenamebest} (epoch: {epoch})')
-            if (not enc):
+            if (not enc) and is_main_process():
                 with open(savedir + "/best.txt", "w") as myfile:
                     myfile.write("Best epoch is %d, with Val-IoU= %.4f" % (epoch, iouVal))   
-            else:
+            elif is_main_process():
                 with open(savedir + "/best_encoder.txt", "w") as myfile:
                     myfile.write("Best epoch is %d, with Val-IoU= %.4f" % (epoch, iouVal))           
 
         #SAVE TO FILE A ROW WITH THE EPOCH RESULT (train loss, val loss, train IoU, val IoU)
         #Epoch		Train-loss		Test-loss	Train-IoU	Test-IoU		learningRate
-        with open(automated_log_path, "a") as myfile:
-            myfile.write("\n%d\t\t%.4f\t\t%.4f\t\t%.4f\t\t%.4f\t\t%.8f" % (epoch, average_epoch_loss_train, average_epoch_loss_val, iouTrain, iouVal, usedLr ))
+        if is_main_process():
+            with open(automated_log_path, "a") as myfile:
+                myfile.write("\n%d\t\t%.4f\t\t%.4f\t\t%.4f\t\t%.4f\t\t%.8f" % (epoch, average_epoch_loss_train, average_epoch_loss_val, iouTrain, iouVal, usedLr ))
     
+    checkpoints.close()     # files of the last epoch written, write errors raised
     return(model)   #return model (convenience for encoder-decoder training)
 
-def save_checkpoint(state, is_best, filenameCheckpoint, filenameBest):
-    torch.save(state, filenameCheckpoint)
+def autocast_dtype(args):
+    """Autocast dtype of --amp: bf16 on the CPU and fp16 on CUDA unless --amp-dtype is given."""
+    if args.amp_dtype == "auto":
+        return torch.float16 if args.cuda else torch.bfloat16
+    return getattr(torch, args.amp_dtype)
+
+def grad_scaler(device, enabled):
+    """GradScaler of fp16 autocast, a no-op one otherwise; torch.amp.GradScaler only exists since torch 2.3."""
+    if hasattr(torch.amp, 'GradScaler'):
+        return torch.amp.GradScaler(device.type, enabled=enabled)
+    if enabled and device.type != 'cuda':
+        raise RuntimeError("Error: fp16 --amp on the CPU needs torch >= 2.3, use --amp-dtype bfloat16")
+    return torch.cuda.amp.GradScaler(enabled=enabled)
+
+def benchmark_precision(model, batches, step_loss, device, amp_dtype):
+    """
+    Compare fp32 and autocast training steps on the same batches: throughput, memory saved for backward
+    and peak memory. The model is left unchanged (no optimizer step, BatchNorm statistics restored).
+
+    Parameters:
+        - model (torch.nn.Module): Model to train.
+        - batches (list[tuple]): (inputs, targets) already on the device; the first one is a warm-up.
+        - step_loss (callable): step_loss(inputs, targets) returns the loss of a batch.
+        - device (torch.device): Training device.
+        - amp_dtype (torch.dtype): Autocast dtype compared with fp32.
+    """
+    state = copy.deepcopy(model.state_dict())
+    model.train()
+    results = {}
+    for name, enabled in (("fp32", False), (str(amp_dtype).replace('torch.', ''), True)):
+        elapsed, images, saved = 0.0, 0, 0
+        for i, (inputs, targets) in enumerate(batches):
+            if i == 1:
+                reset_peak_memory(device)
+            synchronize(device)
+            start_time = time.perf_counter()
+            with SavedTensorMeter(model.parameters()) as meter:
+                with torch.autocast(device.type, dtype=amp_dtype, enabled=enabled):
+                    loss = step_loss(inputs, targets)
+            loss.backward()     # gradients discarded: no scaling needed
+            synchronize(device)
+            model.zero_grad(set_to_none=True)
+            if i > 0:
+                elapsed += time.perf_counter() - start_time
+                images += inputs.size(0)
+            saved = max(saved, meter.bytes)
+        results[name] = (images / elapsed if elapsed else 0.0, saved, peak_memory(device))
+    model.load_state_dict(state)
+
+    print(f"Precision benchmark ({len(batches) - 1} steps, {'CUDA peak' if device.type == 'cuda' else 'process peak RSS'}):")
+    base_speed, base_saved, _ = results["fp32"]
+    for name, (speed, saved, peak) in results.items():
+        print(f"    {name:<9} {speed:8.2f} img/s ({speed / base_speed if base_speed else 0:.2f}x) "
+              f"| saved for backward: {saved / 2**20:8.0f} MB ({saved / base_saved if base_saved else 0:.2f}x) "
+              f"| peak memory: {peak / 2**20:8.0f} MB")
+    return results
+
+def checkpoint_series(filenameCheckpoint, epoch=None):
+    """Epoch-numbered file of --keep-checkpoints (checkpoint-005.pth.tar), or glob pattern of all of them."""
+    return filenameCheckpoint.replace('.pth.tar', '-*.pth.tar' if epoch is None else f'-{epoch:03}.pth.tar')
+
+def save_checkpoint(state, is_best, filenameCheckpoint, filenameBest, checkpoints, memo=None, epoch=None):
+    """
+    Snapshot a training state to the CPU and queue its atomic write (utils/checkpoint_manager.py).
+
+    With --keep-checkpoints N the state goes to the epoch-numbered file, of which the last N are kept, and
+    filenameCheckpoint is a hard link to it. filenameBest, for the best epoch, is a hard link as well.
+    """
+    if not is_main_process():   # identical state on every process after the DDP all-reduce
+        return
+    state = cpu_snapshot(state, memo)
+    links = [filenameBest] if is_best else []
     if is_best:
         print ("Saving model as best")
-        torch.save(state, filenameBest)
+    if checkpoints.keep_last > 0:
+        checkpoints.save(state, checkpoint_series(filenameCheckpoint, epoch), [filenameCheckpoint] + links,
+                         retain=checkpoint_series(filenameCheckpoint))
+    else:
+        checkpoints.save(state, filenameCheckpoint, links)
 
 def ensemble_inference(args):
 
-    def load_model(model_name, class_name, weight_path):
-        model_file = importlib.import_module(model_name)
-        model = getattr(model_file, class_name)(NUM_CLASSES)
-        checkpoint = torch.load(weight_path, map_location="cuda" if args.cuda else "cpu", weights_only=False)
-        state_dict = checkpoint['state_dict'] if 'state_dict' in checkpoint else checkpoint
-        new_state = {k.replace("module.", ""): v for k, v in state_dict.items()}
-        model.load_state_dict(new_state, strict=False)
-        model = torch.nn.DataParallel(model)
+    def load_ensemble_model(name, weight_path):
+        model = load_model(name, weight_path, "cuda" if args.cuda else "cpu", strict=False)
         if args.cuda:
-            model = model.cuda()
-        model.eval()
+            model = torch.nn.DataParallel(model)
         return model
 
     print("Loading ensemble models...")
-    erfnet = load_model("erfnet", "ERFNet", "../save/erfnet_training_void/model_best.pth")
-    enet = load_model("enet", "ENet", "../save/enet_training_void/model_best.pth")
-    bisenet = load_model("bisenet", "BiSeNet", "../save/bisenet_training_void/model_best.pth")
+    erfnet = load_ensemble_model("erfnet", "../save/erfnet_training_void/model_best.pth")
+    enet = load_ensemble_model("enet", "../save/enet_training_void/model_best.pth")
+    bisenet = load_ensemble_model("bisenet", "../save/bisenet_training_void/model_best.pth")
 
     # Use BiSeNet transforms for consistent size
     co_transform_val = BiSeNetTransform(augment=False)
@@ -546,6 +694,18 @@ def ensemble_inference(args):
         print("Ensemble MEAN IoU:", meanIoUStr, "%")
 
 
+def parallelize(model, args, find_unused_parameters=False):
+    """
+    DistributedDataParallel with --distributed, DataParallel on CUDA, the bare model on the CPU.
+
+    The network inside is reached with model_registry.unwrap(model) whatever the wrapper, never model.module.
+    """
+    if args.distributed:
+        return wrap_ddp(model, args.cuda, args.sync_bn, find_unused_parameters)
+    if args.cuda:
+        return torch.nn.DataParallel(model).cuda()
+    return model
+
 def main(args):
 
     # ============ MODEL ENSEMBLE ============
@@ -554,76 +714,43 @@ def main(args):
         ensemble_inference(args)
         return
     
+    # ============ DISTRIBUTED (torchrun) ============
+    if args.distributed:
+        init_distributed(args.cuda)
+        args.visualize = args.visualize and is_main_process()
+
     savedir = f'../save/{args.savedir}'
 
-    if not os.path.exists(savedir):
-        os.makedirs(savedir)
+    if is_main_process():
+        if not os.path.exists(savedir):
+            os.makedirs(savedir)
 
-    with open(savedir + '/opts.txt', "w") as myfile:
-        myfile.write(str(args))
+        with open(savedir + '/opts.txt', "w") as myfile:
+            myfile.write(str(args))
 
     # Load Model
-    if args.model == "erfnet_isomaxplus":
-        model_file = importlib.import_module("erfnet")
-    else:
-        assert os.path.exists(args.model + ".py"), "Error: model definition NOT FOUND"
-        model_file = importlib.import_module(args.model)
-
-    if args.model == "erfnet":
-        model = model_file.ERFNet(NUM_CLASSES)
-    elif args.model == "erfnet_isomaxplus":
-        model = model_file.ERFNet(NUM_CLASSES, use_isomaxplus=True)
-    elif args.model == "bisenet":
-        model = model_file.BiSeNet(NUM_CLASSES)
-    else:   # ENet
-        model = model_file.ENet(NUM_CLASSES)
+    model = build_model(args.model, NUM_CLASSES)
 
     # copyfile(args.model + ".py", savedir + '/' + args.model + ".py")
     
     # weights for fine tuning 
     if args.FineTune:
         weightspath =f"../trained_models/{args.loadWeights}"
-        def load_my_state_dict(model, state_dict):
-            own_state = model.state_dict()
-            for name, param in state_dict.items():
-                stripped_name = name[7:] if name.startswith("module.") else name
-                if stripped_name in own_state:
-                    if own_state[stripped_name].size() == param.size():
-                        own_state[stripped_name].copy_(param)
-                    elif "conv_out" in stripped_name:
-                        # handles mismatches dimension conv_out
-                        new_param = torch.zeros_like(own_state[stripped_name])
-                        new_param[:param.size(0)] = param
-                        own_state[stripped_name].copy_(new_param)
-                    else:
-                        print(f"Size mismatch for {stripped_name}: {own_state[stripped_name].size()} vs {param.size()}")
-                else:
-                    print(f"Skipping {name} as {stripped_name} is not in the model's state dict")
-            return model
-        if args.model == "enet":
-          model = load_my_state_dict(model, torch.load(weightspath, map_location="cpu", weights_only=True)["state_dict"])
-        else:
-          model = load_my_state_dict(model, torch.load(weightspath, map_location="cpu", weights_only=True))
+        # conv_out of checkpoints with fewer classes is zero-padded to NUM_CLASSES
+        load_checkpoint(model, weightspath, strict=False, resize=("conv_out",))
         print(f"Import Model {args.model} with weights {args.loadWeights} to FineTune")
 
 
-    if args.cuda:
-        model = torch.nn.DataParallel(model).cuda()
+    # parameters without gradient under DDP: frozen layers (fine-tuning), ERFNet decoder (encoder training)
+    # and encoder output_conv (decoder training)
+    unused_parameters = args.FineTune or args.model in ("erfnet", "erfnet_isomaxplus")
+    model = parallelize(model, args, unused_parameters)
     
     if args.state:
         # if args.state is provided then load this state for training
         # Note: this only loads initialized weights. If you want to resume a training use "--resume" option!!
         
-        def load_my_state_dict(model, state_dict):  # custom function to load model when not all dict keys are there
-            own_state = model.state_dict()
-            for name, param in state_dict.items():
-                if name not in own_state:
-                     continue
-                own_state[name].copy_(param)
-            return model
-
-        #print(torch.load(args.state))
-        model = load_my_state_dict(model, torch.load(args.state))
+        load_checkpoint(model, args.state, strict=False)
 
 
     print("========== TRAINING ===========")
@@ -645,30 +772,34 @@ def main(args):
                     if (not args.cuda):
                         pretrainedEnc = pretrainedEnc.cpu()     #because loaded encoder is probably saved in cuda
                 else:
-                    pretrainedEnc = next(model.children()).encoder
-                model = model_file.ERFNet(NUM_CLASSES, encoder=pretrainedEnc)  #Add decoder to encoder
-                if args.cuda:
-                    model = torch.nn.DataParallel(model).cuda()
+                    pretrainedEnc = unwrap(model).encoder
+                model = build_model(args.model, NUM_CLASSES, encoder=pretrainedEnc)  #Add decoder to encoder
+                model = parallelize(model, args, unused_parameters)
                 # When loading encoder reinitialize weights for decoder because they are set to 0 when training dec
         model = train(args, model, False)   #Train decoder
     elif args.model == "bisenet" or args.model == "enet":
         model = train(args,model)   
     print("========== TRAINING FINISHED ===========")
+    cleanup_distributed()
 
 
 if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument('--cuda', action='store_true', default=True)  #NOTE: cpu-only has not been tested so you might have to change code if you deactivate this flag
-    parser.add_argument('--model', default="erfnet")
+    parser.add_argument('--cpu', action='store_true')   # overrides --cuda
+    parser.add_argument('--model', default="erfnet", choices=list(MODELS))
     parser.add_argument('--state')
 
     parser.add_argument('--port', type=int, default=8097)
     parser.add_argument('--datadir', default=os.getenv("HOME") + "/datasets/cityscapes/")
     parser.add_argument('--height', type=int, default=512)
+    parser.add_argument('--cache-dir', default=None)    # pre-decoded dataset built by cityscapes_cache.py
+    parser.add_argument('--batch-augment', action='store_true')     # tensor augmentations on whole batches (utils/batch_augmentations.py)
     parser.add_argument('--num-epochs', type=int, default=150)
     parser.add_argument('--stop-epoch', type=int, default=150)
     parser.add_argument('--num-workers', type=int, default=2)   # 4
     parser.add_argument('--batch-size', type=int, default=6)
+    parser.add_argument('--micro-batches', type=int, default=1)  # split each batch in K chunks with accumulated gradients (same batch size, 1/K of the activations)
     parser.add_argument('--steps-loss', type=int, default=50)
     parser.add_argument('--steps-plot', type=int, default=50)
     parser.add_argument('--epochs-save', type=int, default=0)    # You can use this value to save model every X epochs
@@ -687,5 +818,21 @@ if __name__ == '__main__':
     parser.add_argument('--loadWeights', default='erfnet_pretrained.pth')
     parser.add_argument('--class-weights', default='hard') # Use hard weights or calculating by hist for ERFNet
     parser.add_argument('--ensemble', action='store_true', default=False, help="Run ensemble inference only")
-
-    main(parser.parse_args())
\ No newline at end of file
+    parser.add_argument('--amp', action='store_true')  # mixed precision training (autocast, GradScaler for fp16)
+    parser.add_argument('--amp-dtype', default="auto", choices=["auto", "float16", "bfloat16"])  # auto: bf16 on CPU, fp16 on CUDA
+    parser.add_argument('--amp-benchmark', type=int, default=0)  # steps of an fp32 vs autocast comparison before training
+    parser.add_argument('--checkpoint-segments', type=int, default=0)  # activation checkpointing segments per stage, 0 disables it
+    parser.add_argument('--checkpoint-stages', type=int, nargs='+', default=None)  # ERFNet encoder 1-2, ENet 1-5, default all
+    parser.add_argument('--distributed', action='store_true')  # DistributedDataParallel, one process per GPU / CPU core group, launched by torchrun
+    parser.add_argument('--sync-bn', action='store_true')  # SyncBatchNorm with --distributed (CUDA only)
+    parser.add_argument('--keep-checkpoints', type=int, default=0)  # keep the last N epoch-numbered checkpoints (and model-XXX.pth), 0: only the latest
+    parser.add_argument('--sync-checkpoints', action='store_true')  # write checkpoints in the training thread instead of a background one
+
+    args = parser.parse_args()
+    if args.cpu:
+        args.cuda = False
+    if args.micro_batches < 1:
+        parser.error("--micro-batches must be at least 1")
+    if args.keep_checkpoints < 0:
+        parser.error("--keep-checkpoints must be at least 0")
+    main(args)
\ No newline at end of file
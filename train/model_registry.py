@@ -0,0 +1,157 @@
+# ========================================================================
+# Model registry and checkpoint loader shared by the train and eval scripts
+#
+# build_model(name) builds any of the architectures by name, on the CPU and
+# without a DataParallel wrapper. load_checkpoint(model, path) loads every
+# checkpoint format written by main_v2.py or shipped in trained_models/:
+# - a bare state dict, or a dict with 'state_dict' (plus 'epoch', 'optimizer', ...);
+# - keys with or without the DataParallel 'module.' prefix;
+# - the IsoMaxPlus head saved apart in 'loss_first_part_state_dict', either
+#   as the state dict of the head or of the whole decoder.
+# Files are memory-mapped and unpickled with weights_only (no code execution),
+# where the torch version supports it, and the keys are matched: missing,
+# unexpected and shape-mismatched tensors are reported, and raise with
+# strict=True (the evaluation scripts only report them unless --strict).
+# ========================================================================
+
+import os
+import sys
+import torch
+import importlib
+
+from collections import OrderedDict
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))   # flat imports of the model files (bisenet -> resnet)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+NUM_CLASSES = 20    # Cityscapes dataset (19 + 1)
+
+# name -> (module, class, constructor keyword arguments)
+MODELS = {
+    "erfnet": ("train.erfnet", "ERFNet", {}),
+    "erfnet_isomaxplus": ("train.erfnet", "ERFNet", {"use_isomaxplus": True}),
+    "enet": ("train.enet", "ENet", {}),
+    "bisenet": ("train.bisenet", "BiSeNet", {}),
+}
+
+# tensors a checkpoint may hold that the model legitimately lacks: BiSeNet auxiliary heads,
+# only built in aux_mode='train'
+OPTIONAL_PREFIXES = ("conv_out16.", "conv_out32.")
+
+
+def build_model(name, num_classes=NUM_CLASSES, **kwargs):
+    """
+    Build a registered model on the CPU.
+
+    Parameters:
+        - name (str): One of MODELS.
+        - num_classes (int): Number of output classes.
+        - kwargs: Extra constructor arguments (e.g. encoder for ERFNet, aux_mode for BiSeNet).
+
+    Returns:
+        - torch.nn.Module: The model, randomly initialized.
+    """
+    if name not in MODELS:
+        raise ValueError(f"Unsupported model: {name}. Use one of {list(MODELS)}.")
+    module_name, class_name, defaults = MODELS[name]
+    Model = getattr(importlib.import_module(module_name), class_name)
+    return Model(num_classes, **dict(defaults, **kwargs))
+
+
+def unwrap(model):
+    """Model inside a DataParallel / DistributedDataParallel wrapper, or the model itself."""
+    return model.module if hasattr(model, 'module') else model
+
+
+def read_checkpoint(path, weights_only=True):
+    """
+    Memory-mapped torch.load on the CPU. Falls back to a plain read for legacy (non-zip) files and
+    for torch versions without the mmap (< 2.1) or weights_only (< 1.13) arguments.
+    """
+    try:
+        return torch.load(path, map_location='cpu', mmap=True, weights_only=weights_only)
+    except (RuntimeError, TypeError) as e:
+        if 'mmap' not in str(e):
+            raise
+    try:
+        return torch.load(path, map_location='cpu', weights_only=weights_only)
+    except TypeError as e:
+        if 'weights_only' not in str(e):
+            raise
+        return torch.load(path, map_location='cpu')
+
+
+def checkpoint_state_dict(checkpoint):
+    """
+    Model state dict of a checkpoint in any of the supported formats, without 'module.' prefixes
+    and with the separately saved IsoMaxPlus head merged in as 'decoder.loss_first_part.*'.
+    """
+    state_dict = checkpoint['state_dict'] if 'state_dict' in checkpoint else checkpoint
+    state = OrderedDict((name[len('module.'):] if name.startswith('module.') else name, param)
+                        for name, param in state_dict.items() if name != 'loss_first_part_state_dict')
+
+    head = checkpoint.get('loss_first_part_state_dict', {})
+    for name, param in head.items():
+        # decoder state dict (main_v2 checkpoints) or head state dict (main_v2 saved models)
+        name = name[len('loss_first_part.'):] if name.startswith('loss_first_part.') else name
+        if '.' not in name:
+            state.setdefault('decoder.loss_first_part.' + name, param)
+    return state
+
+
+def load_checkpoint(model, checkpoint, strict=True, resize=(), verbose=True):
+    """
+    Load a checkpoint into a model.
+
+    Parameters:
+        - model (torch.nn.Module): Model, optionally wrapped in DataParallel.
+        - checkpoint (str or dict): Checkpoint path, or a checkpoint already read by read_checkpoint.
+        - strict (bool): Raise if any tensor is missing, unexpected or of a different shape.
+        - resize (tuple[str]): Key substrings (e.g. 'conv_out') whose smaller checkpoint tensors are
+            zero-padded along the first dimension instead of being reported as mismatched.
+        - verbose (bool): Print the key report.
+
+    Returns:
+        - dict: 'missing', 'unexpected', 'mismatched', 'resized' and 'ignored' (OPTIONAL_PREFIXES) key lists.
+    """
+    if isinstance(checkpoint, str):
+        checkpoint = read_checkpoint(checkpoint)
+    model = unwrap(model)
+    state = checkpoint_state_dict(checkpoint)
+    own_state = model.state_dict()
+
+    report = {'missing': [], 'unexpected': [], 'mismatched': [], 'resized': [], 'ignored': []}
+    for name in list(state):
+        if name not in own_state:
+            report['ignored' if name.startswith(OPTIONAL_PREFIXES) else 'unexpected'].append(name)
+            del state[name]
+        elif state[name].shape != own_state[name].shape:
+            param = state.pop(name)
+            if any(key in name for key in resize) and param.dim() == own_state[name].dim() \
+                    and param.shape[1:] == own_state[name].shape[1:] and param.size(0) < own_state[name].size(0):
+                padded = torch.zeros_like(own_state[name])
+                padded[:param.size(0)] = param
+                state[name] = padded
+                report['resized'].append(name)
+            else:
+                report['mismatched'].append(f"{name}: {tuple(param.shape)} vs {tuple(own_state[name].shape)}")
+    report['missing'] = [name for name in own_state if name not in state]
+
+    model.load_state_dict(state, strict=False)
+
+    if verbose:
+        for kind, names in report.items():
+            if names:
+                print(f"{kind.capitalize()} keys ({len(names)}): {', '.join(names[:10])}{' ...' if len(names) > 10 else ''}")
+    if strict and (report['missing'] or report['unexpected'] or report['mismatched']):
+        raise RuntimeError(f"Error: checkpoint does not match {type(model).__name__} "
+                           f"({len(report['missing'])} missing, {len(report['unexpected'])} unexpected, "
+                           f"{len(report['mismatched'])} mismatched keys)")
+    return report
+
+
+def load_model(name, checkpoint, device='cpu', strict=True, **kwargs):
+    """Build a registered model, load a checkpoint into it and move it to 'device', in eval mode."""
+    model = build_model(name, **kwargs)
+    load_checkpoint(model, checkpoint, strict=strict)
+    return model.to(device).eval()
@@ -47,16 +47,43 @@ def colormap(n):
 
     return cmap
 
+class LabelMap:
+    """
+    Relabel a label tensor through a 256-entry lookup table: a chain of relabels,
+    applied in sequence, is compiled once and costs a single gather per call.
+
+    Parameters:
+        - pairs (list[tuple[int, int]]): (olabel, nlabel) relabels, applied in order.
+    """
+
+    def __init__(self, pairs=()):
+        self.lut = torch.arange(256)
+        for olabel, nlabel in pairs:
+            self.lut[self.lut == olabel] = nlabel
+
+    @classmethod
+    def compile(cls, transforms):
+        """Single LabelMap equivalent to a sequence of Relabel / LabelMap transforms."""
+        label_map = cls()
+        for transform in transforms:
+            label_map.lut = getattr(transform, 'label_map', transform).lut[label_map.lut]
+        return label_map
+
+    def __call__(self, tensor):
+        lut = self.lut.to(tensor.device)
+        return lut[tensor.long()].to(tensor.dtype)
+
+
 class Relabel:
 
     def __init__(self, olabel, nlabel):
         self.olabel = olabel
         self.nlabel = nlabel
+        self.label_map = LabelMap([(olabel, nlabel)])
 
     def __call__(self, tensor):
         assert (isinstance(tensor, torch.LongTensor) or isinstance(tensor, torch.ByteTensor)) , 'tensor needs to be LongTensor'
-        tensor[tensor == self.olabel] = self.nlabel
-        return tensor
+        return self.label_map(tensor)
 
 
 class ToLabel:
@@ -65,27 +92,28 @@ class ToLabel:
         return torch.from_numpy(np.array(image)).long().unsqueeze(0)
 
 
-class Colorize:
+class PaletteColorize:
+    """
+    Colorize label maps with a single palette lookup (cmap[label]), on single images
+    [1, H, W] or batches [B, 1, H, W]; labels >= n are black.
+    """
 
     def __init__(self, n=22):
-        #self.cmap = colormap(256)
-        self.cmap = colormap_cityscapes(256)
-        self.cmap[n] = self.cmap[-1]
-        self.cmap = torch.from_numpy(self.cmap[:n])
+        cmap = colormap_cityscapes(256)
+        cmap[n:] = 0
+        self.cmap = torch.from_numpy(cmap)
 
     def __call__(self, gray_image):
-        size = gray_image.size()
-        #print(size)
-        color_image = torch.ByteTensor(3, size[1], size[2]).fill_(0)
-        #color_image = torch.ByteTensor(3, size[0], size[1]).fill_(0)
+        cmap = self.cmap.to(gray_image.device)
+        color_image = cmap[gray_image.select(-3, 0).long()]     # [..., H, W, 3]
+        return color_image.movedim(-1, -3).contiguous()
 
-        #for label in range(1, len(self.cmap)):
-        for label in range(0, len(self.cmap)):
-            mask = gray_image[0] == label
-            #mask = gray_image == label
 
-            color_image[0][mask] = self.cmap[label][0]
-            color_image[1][mask] = self.cmap[label][1]
-            color_image[2][mask] = self.cmap[label][2]
+class Colorize:
+
+    def __init__(self, n=22):
+        self.palette = PaletteColorize(n)
+        self.cmap = self.palette.cmap[:n]
 
-        return color_image
+    def __call__(self, gray_image):
+        return self.palette(gray_image)
@@ -0,0 +1,266 @@
+import torch
+import random
+import numpy as np
+import torch.nn.functional as F
+
+from PIL import Image
+from torchvision.transforms import Resize
+from torchvision.transforms import ColorJitter, RandomCrop
+import torchvision.transforms.functional as TF
+
+# ========================================================================
+# Tensor-native, batched versions of the transforms in augmentations.py
+#
+# Each transform is split in two halves:
+# - __call__(input, target, seed), run by the loader workers: only the per-sample
+#   resize (and for BiSeNet the scale/pad/crop, whose output size differs per
+#   sample) is done there, with Resize objects built once. All the random
+#   parameters are drawn with the same calls, in the same order, as the PIL
+#   version, so get_seed_from_path seeding gives the same parameters. It returns
+#   uint8 image [3, H, W], uint8 label [1, H, W] (255 already relabeled to 19)
+#   and a float64 parameter vector.
+# - batch(images, labels, params), run after collation on the whole uint8 batch,
+#   on the CPU or on the device: flip, translation, brightness, noise and color
+#   jitter as vectorized tensor ops reproducing the PIL arithmetic (truncation to
+#   uint8 after each blend, PIL grayscale weights, canvas fill of ImageOps.expand).
+#   It returns float images in [0, 1] and long labels, as ToTensor/ToLabel do.
+#
+# Parity with the PIL transforms: ERFNet batches are identical; ENet batches are
+# identical up to the Gaussian noise, drawn from a per-sample torch generator
+# (seeded from the sample) instead of the global numpy stream; BiSeNet draws the
+# crop and jitter parameters from the same torch calls as the PIL version.
+# ========================================================================
+
+IGNORE_LABEL = 19
+
+# uint8 lookup table relabeling 255 (void) to the ignore class, as Relabel(255, 19)
+RELABEL_LUT = np.arange(256, dtype=np.uint8)
+RELABEL_LUT[255] = IGNORE_LABEL
+
+
+def to_uint8_tensors(input, target):
+    """uint8 image [3, H, W] and relabeled uint8 label [1, H, W] from PIL images, without float conversion."""
+    image = torch.from_numpy(np.array(input, dtype=np.uint8)).permute(2, 0, 1).contiguous()
+    label = torch.from_numpy(RELABEL_LUT[np.asarray(target)]).unsqueeze(0)
+    return image, label
+
+
+def flip(x, mask):
+    """Horizontally flip the samples of a batch [B, C, H, W] selected by the boolean 'mask' [B]."""
+    return torch.where(mask.view(-1, 1, 1, 1), x.flip(-1), x)
+
+
+def translate(images, labels, trans_x, trans_y, fill=IGNORE_LABEL):
+    """
+    Per-sample integer translation of a batch, as ImageOps.expand(border=(transX, transY, 0, 0))
+    followed by a crop back to the original size: pixels padded by the expand get 0 (image) and
+    'fill' (label), pixels cropped outside a canvas shrunk by a negative shift get 0 in both.
+    """
+    B, _, H, W = images.shape
+    ys = torch.arange(H, device=images.device).view(1, H, 1) - trans_y.long().view(B, 1, 1)
+    xs = torch.arange(W, device=images.device).view(1, 1, W) - trans_x.long().view(B, 1, 1)
+    inside = ((ys >= 0) & (ys < H) & (xs >= 0) & (xs < W)).unsqueeze(1)
+    outside = ((ys >= H) | (xs >= W)).unsqueeze(1)
+
+    index = (ys.clamp(0, H - 1) * W + xs.clamp(0, W - 1)).view(B, 1, H * W)
+    images = images.flatten(2).gather(2, index.expand(-1, images.size(1), -1)).view_as(images)
+    labels = labels.flatten(2).gather(2, index).view_as(labels)
+
+    images = images.masked_fill(~inside, 0)
+    labels = labels.masked_fill(~inside, fill).masked_fill(outside, 0)
+    return images, labels
+
+
+def blend(degenerate, images, factor):
+    """PIL Image.blend on float 0-255 batches: truncated to integers and clipped, as for uint8 images."""
+    factor = factor.view(-1, 1, 1, 1)
+    return (degenerate + factor * (images - degenerate)).trunc().clamp(0, 255)
+
+
+def grayscale(images):
+    """PIL 'L' conversion of float 0-255 RGB batches [B, 3, H, W], keeping the channel dim."""
+    r, g, b = images.long().unbind(1)
+    return ((r * 19595 + g * 38470 + b * 7471 + 0x8000) >> 16).unsqueeze(1).float()
+
+
+def adjust_brightness(images, factor):
+    return blend(torch.zeros_like(images), images, factor)
+
+
+def adjust_contrast(images, factor):
+    mean = (grayscale(images).mean(dim=(1, 2, 3), keepdim=True) + 0.5).trunc()
+    return blend(mean.expand_as(images), images, factor)
+
+
+def adjust_saturation(images, factor):
+    return blend(grayscale(images).expand_as(images), images, factor)
+
+
+# ========== ERFNET DATA AUGMENTATION ==========
+class ErfNetBatchTransform(object):
+    """
+    Batched ErfNetTransform: resize in the workers, horizontal flip and translations
+    on the collated batch. Parameters: [flip, transX, transY].
+    """
+    def __init__(self, enc, augment=True, height=512):
+        self.enc = enc
+        self.augment = augment
+        self.height = height
+        self.resize_input = Resize(height, Image.BILINEAR)
+        self.resize_target = Resize(height, Image.NEAREST)
+
+    def __call__(self, input, target, seed=None):
+        # Set seed for reproducibility
+        if seed is not None:
+          random.seed(seed)
+          np.random.seed(seed)
+
+        input = self.resize_input(input)
+        target = self.resize_target(target)
+
+        params = [0, 0, 0]
+        if self.augment:
+            params[0] = float(random.random() < 0.5)
+            params[1] = random.randint(-2, 2)
+            params[2] = random.randint(-2, 2)
+
+        input, target = to_uint8_tensors(input, target)
+        return input, target, torch.tensor(params, dtype=torch.float64)
+
+    def batch(self, images, labels, params):
+        if self.augment:
+            images, labels = flip(images, params[:, 0] > 0), flip(labels, params[:, 0] > 0)
+            images, labels = translate(images, labels, params[:, 1], params[:, 2])
+
+        images = images.float().div_(255)
+        if (self.enc):
+            # Resize(height/8, NEAREST) of the label, PIL nearest samples the pixel centers
+            h, w = labels.shape[-2:]
+            size = int(self.height/8)
+            size = (size, int(size * w / h)) if h <= w else (int(size * h / w), size)
+            labels = F.interpolate(labels.float(), size=size, mode='nearest-exact').to(torch.uint8)
+        return images, labels.long()
+
+# ========== BISENET DATA AUGMENTATION ==========
+class BiSeNetBatchTransform(object):
+    """
+    Batched BiSeNetTransform: scale, pad and crop in the workers (the scaled size differs per
+    sample), horizontal flip and color jitter on the collated batch.
+    Parameters: [flip, jitter order (4), brightness, contrast, saturation].
+    """
+    def __init__(self, augment=True, height=512, scales=(0.75, 2.0)):
+        self.augment = augment
+        self.height = height
+        self.scales = scales
+        self.color_jitter = ColorJitter(brightness=0.4, contrast=0.4, saturation=0.4)
+        self.resize_input = Resize(height, Image.BILINEAR)
+        self.resize_target = Resize(height, Image.NEAREST)
+
+    def __call__(self, input, target, seed=None):
+        # Set seed for reproducibility
+        if seed is not None:
+          random.seed(seed)
+          np.random.seed(seed)
+
+        scale = random.uniform(*self.scales)
+        scaled_height = int(self.height * scale)
+        input = Resize(scaled_height, Image.BILINEAR)(input)
+        target = Resize(scaled_height, Image.NEAREST)(target)
+
+        params = [0.0, 0, 1, 2, 3, 1.0, 1.0, 1.0]
+        if self.augment:
+            pad_h = max(0, self.height - input.height)
+            pad_w = max(0, self.height - input.width)
+
+            if pad_h > 0 or pad_w > 0:
+                input = TF.pad(input, padding=(0, 0, pad_w, pad_h), fill=0)
+                target = TF.pad(target, padding=(0, 0, pad_w, pad_h), fill=255)
+
+            i, j, h, w = RandomCrop.get_params(input, output_size=(self.height, self.height))
+            input = TF.crop(input, i, j, h, w)
+            target = TF.crop(target, i, j, h, w)
+
+            params[0] = float(random.random() < 0.5)
+
+            # same draws as ColorJitter.forward
+            fn_idx, b, c, s, _ = ColorJitter.get_params(self.color_jitter.brightness, self.color_jitter.contrast,
+                                                        self.color_jitter.saturation, self.color_jitter.hue)
+            params[1:5] = fn_idx.tolist()
+            params[5:8] = [b, c, s]
+
+        # To ensure tensor of equal size PyTorch stack
+        input = self.resize_input(input)
+        target = self.resize_target(target)
+
+        input, target = to_uint8_tensors(input, target)
+        return input, target, torch.tensor(params, dtype=torch.float64)
+
+    def batch(self, images, labels, params):
+        if not self.augment:
+            return images.float().div_(255), labels.long()
+
+        images, labels = flip(images, params[:, 0] > 0), flip(labels, params[:, 0] > 0)
+
+        # color jitter, each sample applying its ops in its own random order (3 = hue, unused)
+        images = images.float()
+        adjust = [adjust_brightness, adjust_contrast, adjust_saturation]
+        factors = params[:, 5:8].float()
+        for slot in range(4):
+            order = params[:, 1 + slot].long()
+            for fn_id, fn in enumerate(adjust):
+                mask = order == fn_id
+                if mask.any():
+                    images[mask] = fn(images[mask], factors[mask, fn_id])
+
+        return images.div_(255), labels.long()
+
+# ========== ENET DATA AUGMENTATION ==========
+class ENetBatchTransform(object):
+    """
+    Batched ENetTransform: resize in the workers, horizontal flip, translations, brightness
+    and gaussian noise on the collated batch.
+    Parameters: [flip, transX, transY, brightness, noise seed].
+    """
+    def __init__(self, augment=True, height=512):
+        self.augment = augment
+        self.height = height
+        self.resize_input = Resize(height, Image.BILINEAR)
+        self.resize_target = Resize(height, Image.NEAREST)
+
+    def __call__(self, input, target, seed=None):
+        # Set seed for reproducibility
+        if seed is not None:
+          random.seed(seed)
+          np.random.seed(seed)
+
+        input = self.resize_input(input)
+        target = self.resize_target(target)
+
+        params = [0, 0, 0, 1.0, 0]
+        if self.augment:
+            params[0] = float(random.random() < 0.5)
+            params[1] = random.randint(-1, 1)
+            params[2] = random.randint(-1, 1)
+            params[3] = random.uniform(0.6, 1.2)
+            params[4] = random.randrange(2**31)     # seed of the noise generator of the sample
+
+        input, target = to_uint8_tensors(input, target)
+        return input, target, torch.tensor(params, dtype=torch.float64)
+
+    def batch(self, images, labels, params):
+        if not self.augment:
+            return images.float().div_(255), labels.long()
+
+        images, labels = flip(images, params[:, 0] > 0), flip(labels, params[:, 0] > 0)
+        images, labels = translate(images, labels, params[:, 1], params[:, 2])
+        images = adjust_brightness(images.float(), params[:, 3].float())
+
+        # gaussian noise (std 2) truncated to integers, wrapping around as the uint8 sum of the PIL version
+        noise = torch.empty_like(images)
+        generator = torch.Generator(device=images.device)
+        for i in range(images.size(0)):
+            generator.manual_seed(int(params[i, 4]))
+            noise[i] = torch.normal(0.0, 2.0, size=images.shape[1:], generator=generator, device=images.device)
+        images = (images + noise.trunc()).remainder_(256)
+
+        return images.div_(255), labels.long()
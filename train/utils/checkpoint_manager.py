@@ -0,0 +1,152 @@
+# ========================================================================
+# Atomic, asynchronous checkpoint writing
+#
+# At the end of each epoch main_v2.py writes the resume checkpoint, possibly
+# model_best.pth.tar, model_best.pth and a periodic model-XXX.pth. Instead of
+# up to four blocking torch.save calls on the training thread:
+# - the state is snapshotted to CPU memory (one copy per distinct tensor,
+#   shared by all the files of the epoch, so aliased tensors such as the
+#   IsoMaxPlus head in both state dicts are stored once per file);
+# - a background thread serializes the snapshots in order, each into a
+#   temporary file in the same directory, fsync-ed and renamed over the
+#   target (os.replace), so a crash never leaves a truncated checkpoint;
+# - files with the same content (the latest checkpoint and the best one) are
+#   written once and hard-linked (copied where links are not supported);
+# - epoch-numbered series (checkpoint-XXX.pth.tar, model-XXX.pth) keep only
+#   their last N files.
+# Write errors are raised on the training thread at the next save() or wait().
+# ========================================================================
+
+import os
+import glob
+import shutil
+import torch
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+def cpu_snapshot(obj, memo=None):
+    """
+    Copy of a (nested dict / list / tuple) state with every tensor detached and copied to the CPU.
+
+    Parameters:
+        - obj: State, e.g. a checkpoint dict with model, optimizer and scaler state dicts.
+        - memo (dict): Copies already made, shared between the snapshots of the same epoch.
+
+    Returns:
+        - Same structure, independent of the training tensors updated after the call.
+    """
+    memo = {} if memo is None else memo
+    if isinstance(obj, torch.Tensor):
+        key = (obj.device, obj.untyped_storage().data_ptr(), obj.storage_offset(),
+               tuple(obj.shape), tuple(obj.stride()), obj.dtype)
+        if key not in memo:
+            memo[key] = obj.detach().to('cpu', copy=True)
+        return memo[key]
+    if isinstance(obj, dict):
+        return type(obj)((k, cpu_snapshot(v, memo)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(cpu_snapshot(v, memo) for v in obj)
+    return obj
+
+
+def atomic_save(state, path):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        torch.save(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def atomic_link(source, path):
+    """'path' replaced by a hard link to 'source' (a copy on filesystems without hard links)."""
+    tmp = path + '.tmp'
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(source, tmp)
+    except OSError:
+        shutil.copyfile(source, tmp)
+    os.replace(tmp, path)
+
+
+def prune(pattern, keep_last):
+    """Remove all but the last 'keep_last' files matching 'pattern' (zero-padded epoch numbers sort by name)."""
+    for path in sorted(glob.glob(pattern))[:-keep_last]:
+        os.remove(path)
+
+
+def latest_valid_checkpoint(paths, load, required=('epoch', 'state_dict', 'optimizer', 'best_acc')):
+    """
+    Newest (by modification time) checkpoint among 'paths' that loads and has the 'required' keys.
+
+    Parameters:
+        - paths (list[str]): Candidate files, missing ones are skipped.
+        - load (callable): Checkpoint reader, e.g. model_registry.read_checkpoint.
+
+    Returns:
+        - tuple[str, dict]: Path and checkpoint, (None, None) when none is valid.
+    """
+    existing = {os.path.realpath(p): p for p in paths if os.path.exists(p)}
+    for path in sorted(existing.values(), key=os.path.getmtime, reverse=True):
+        try:
+            checkpoint = load(path)
+        except Exception as e:  # truncated or corrupted file
+            print(f"Warning: skipping unreadable checkpoint {path} ({type(e).__name__}: {e})")
+            continue
+        missing = [k for k in required if k not in checkpoint]
+        if missing:
+            print(f"Warning: skipping checkpoint {path} without {missing}")
+            continue
+        return path, checkpoint
+    return None, None
+
+
+class CheckpointManager:
+    """
+    Writes CPU snapshots of training states atomically, in a background thread.
+
+    Parameters:
+        - keep_last (int): Files kept per epoch-numbered series ('retain' pattern of save()), 0 for no series.
+        - asynchronous (bool): Write in a background thread, otherwise in save() itself.
+        - max_pending (int): Writes queued before save() blocks, bounding the snapshots held in memory.
+    """
+    def __init__(self, keep_last=0, asynchronous=True, max_pending=4):
+        self.keep_last = keep_last
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='checkpoint') if asynchronous else None
+        self.pending = []
+
+    def write(self, state, path, links, retain):
+        atomic_save(state, path)
+        for link in links:
+            atomic_link(path, link)
+        if retain and self.keep_last > 0:
+            prune(retain, self.keep_last)
+
+    def save(self, state, path, links=(), retain=None):
+        """
+        Write a snapshot (see cpu_snapshot) to 'path', then hard-link it to 'links'.
+
+        Parameters:
+            - state (dict): CPU snapshot, not modified afterwards.
+            - path (str): Target file.
+            - links (list[str]): Files with the same content as 'path'.
+            - retain (str): Glob pattern of the series of 'path', pruned to the last keep_last files.
+        """
+        if self.executor is None:
+            return self.write(state, path, list(links), retain)
+        while self.pending and (self.pending[0].done() or len(self.pending) >= self.max_pending):
+            self.pending.pop(0).result()     # raises the errors of the previous writes
+        self.pending.append(self.executor.submit(self.write, state, path, list(links), retain))
+
+    def wait(self):
+        """Block until every queued checkpoint is written."""
+        while self.pending:
+            self.pending.pop(0).result()
+
+    def close(self):
+        self.wait()
+        if self.executor is not None:
+            self.executor.shutdown()
@@ -0,0 +1,101 @@
+# ========================================================================
+# Activation checkpointing of the ERFNet encoder and ENet bottleneck stacks
+#
+# The long stacks of residual blocks (ERFNet Encoder.layers, the
+# RegularBottleneck runs of the ENet stages) keep every intermediate
+# activation alive until backward. With checkpointing, a stage of n blocks is
+# split in 'segments' contiguous segments: only the input of each segment is
+# kept, and the activations inside it are recomputed during backward.
+# Fewer segments mean less memory and the same recompute (one extra forward of
+# the checkpointed stages); segments == n checkpoints every block.
+#
+# The models declare their stages in CHECKPOINT_STAGES and read the segment
+# count of each stage from their 'checkpoint_segments' dict, set by
+# set_activation_checkpointing(); the state dicts are unchanged. During the
+# recomputation:
+# - the RNG state is replayed, so Dropout2d draws the same masks;
+# - the BatchNorm running statistics are frozen, so they are updated once per
+#   training step as without checkpointing.
+# Checkpointing only applies while autograd records (training), evaluation
+# runs the plain blocks.
+# ========================================================================
+
+import contextlib
+import torch
+import torch.nn as nn
+
+from torch.utils.checkpoint import checkpoint
+
+
+@contextlib.contextmanager
+def frozen_batchnorm_stats(blocks):
+    """BatchNorm running statistics of 'blocks' left untouched by the forward passes run inside."""
+    norms = [m for block in blocks for m in block.modules()
+             if isinstance(m, nn.modules.batchnorm._BatchNorm) and m.training and m.track_running_stats]
+    saved = [(m.momentum, m.num_batches_tracked.clone()) for m in norms]
+    for m in norms:
+        m.momentum = 0.0    # running = (1 - 0) * running + 0 * batch statistics
+    try:
+        yield
+    finally:
+        for m, (momentum, num_batches_tracked) in zip(norms, saved):
+            m.momentum = momentum
+            m.num_batches_tracked.copy_(num_batches_tracked)
+
+
+def run_blocks(blocks, x):
+    for block in blocks:
+        x = block(x)
+    return x
+
+
+def run_checkpointed(blocks, x, segments=0):
+    """
+    Run a chain of single-input blocks, checkpointed in 'segments' segments.
+
+    Parameters:
+        - blocks (list[nn.Module]): Blocks applied in order.
+        - x (torch.Tensor): Input of the first block.
+        - segments (int): Number of checkpointed segments, 0 to run the blocks plainly.
+
+    Returns:
+        - torch.Tensor: Output of the last block.
+    """
+    if segments <= 0 or not torch.is_grad_enabled():
+        return run_blocks(blocks, x)
+    blocks = list(blocks)
+    segments = min(segments, len(blocks))
+    base, extra = divmod(len(blocks), segments)
+    start = 0
+    for i in range(segments):
+        segment = blocks[start:start + base + (i < extra)]
+        start += len(segment)
+        x = checkpoint(run_blocks, segment, x, use_reentrant=False, preserve_rng_state=True,
+                       context_fn=lambda segment=segment: (contextlib.nullcontext(), frozen_batchnorm_stats(segment)))
+    return x
+
+
+def set_activation_checkpointing(model, segments, stages=None):
+    """
+    Enable activation checkpointing in the stages of every ERFNet encoder / ENet in a model.
+
+    Parameters:
+        - model (nn.Module): Model, optionally wrapped in DataParallel.
+        - segments (int): Checkpointed segments per stage, 0 to disable checkpointing.
+        - stages (list[int]): Stages to checkpoint (keys of CHECKPOINT_STAGES), default all of them.
+
+    Returns:
+        - dict[str, list[int]]: Checkpointed stages per module class.
+    """
+    enabled = {}
+    for module in model.modules():
+        if not hasattr(module, 'CHECKPOINT_STAGES'):
+            continue
+        selected = [s for s in module.CHECKPOINT_STAGES if stages is None or s in stages]
+        module.checkpoint_segments = {s: segments for s in selected} if segments > 0 else {}
+        if module.checkpoint_segments:
+            enabled[type(module).__name__] = selected
+    if segments > 0 and not enabled:
+        raise ValueError(f"Error: no checkpointable stage {stages} in {type(model).__name__} "
+                         "(ERFNet encoder stages 1-2, ENet stages 1-5)")
+    return enabled
@@ -11,7 +11,8 @@ class CrossEntropyLoss2d(torch.nn.Module):
         # self.loss = torch.nn.NLLLoss(weight)
 
     def forward(self, outputs, targets):
-        return self.loss(torch.nn.functional.log_softmax(outputs, dim=1), targets)
+        # fp32 log-softmax, also under autocast (fp16/bf16 logits, fp32 class weights)
+        return self.loss(torch.nn.functional.log_softmax(outputs.float(), dim=1), targets)
     
     def __str__(self):
         return "CrossEntropyLoss2d"
\ No newline at end of file
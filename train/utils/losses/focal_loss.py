@@ -18,13 +18,14 @@ class FocalLoss(nn.Module):
         self.size_average = size_average
 
     def forward(self, input, target):
+        input = input.float()   # fp32 under autocast: log-softmax, (1-pt)**gamma and alpha in full precision
         if input.dim()>2:
             input = input.view(input.size(0),input.size(1),-1)  # N,C,H,W => N,C,H*W
             input = input.transpose(1,2)    # N,C,H*W => N,H*W,C
             input = input.contiguous().view(-1,input.size(2))   # N,H*W,C => N*H*W,C
         target = target.view(-1,1)
 
-        logpt = F.log_softmax(input)
+        logpt = F.log_softmax(input, dim=1)
         logpt = logpt.gather(1,target)
         logpt = logpt.view(-1)
         pt = Variable(logpt.data.exp())
@@ -24,6 +24,7 @@ class IsoMaxPlusLossFirstPart(nn.Module):
 
     def forward(self, features):
         B, _, H, W = features.size()
+        features = features.float()     # fp32 normalization and distances, also under autocast
         features_flat = features.permute(0, 2, 3, 1).flatten(0, 2)  # [B*H*W, C]
         features_norm = F.normalize(features_flat)
         prototypes_norm = F.normalize(self.prototypes)
@@ -45,7 +46,8 @@ class IsoMaxPlusLossSecondPart(nn.Module):
         B, _, H, W = logits.size()
         logits = logits.permute(0, 2, 3, 1).flatten(0, 2)  # [B*H*W, num_classes]
         targets = targets.view(-1)  # [B*H*W]
-        distances = -logits
+        # fp32 under autocast: the 1e-12 below underflows to 0 in fp16, and bf16 probabilities are too coarse
+        distances = -logits.float()
         probabilities_for_training = nn.Softmax(dim=1)(-self.entropic_scale * distances)
         probabilities_at_targets = probabilities_for_training[range(distances.size(0)), targets] + 1e-12  # Add small value to avoid log(0)
         loss = -torch.log(probabilities_at_targets).mean()
@@ -14,6 +14,7 @@ class LogitNormLoss(nn.Module):
         self.t = t
 
     def forward(self, x, target):
+        x = x.float()   # fp32 norms under autocast
         norms = torch.norm(x, p=2, dim=-1, keepdim=True) + 1e-7
         logit_norm = torch.div(x, norms) / self.t
         # return F.cross_entropy(logit_norm, target)
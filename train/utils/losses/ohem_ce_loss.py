@@ -42,13 +42,13 @@ class OhemCELoss(nn.Module):
 
     def __init__(self, thresh=0.7, lb_ignore=255):
         super(OhemCELoss, self).__init__()
-        self.thresh = -torch.log(torch.tensor(thresh, requires_grad=False, dtype=torch.float)).cuda()
+        self.thresh = -torch.log(torch.tensor(thresh, requires_grad=False, dtype=torch.float))   # 0-dim, compared on any device
         self.lb_ignore = lb_ignore
         self.criteria = nn.CrossEntropyLoss(ignore_index=lb_ignore, reduction='none')
 
     def forward(self, logits, labels):
         n_min = labels[labels != self.lb_ignore].numel() // 16
-        loss = self.criteria(logits, labels).view(-1)
+        loss = self.criteria(logits.float(), labels).view(-1)    # fp32 under autocast
         loss_hard = loss[loss > self.thresh]
         if loss_hard.numel() < n_min:
             loss_hard, _ = loss.topk(n_min)
@@ -0,0 +1,69 @@
+# ========================================================================
+# Training memory measurements
+#
+# - SavedTensorMeter counts the bytes of the tensors autograd keeps for the
+#   backward pass (activations, autocast copies of the weights), the part of
+#   the training memory that mixed precision and activation checkpointing
+#   reduce. It works on any device: tensors are counted once per storage
+#   while the forward pass runs, the model parameters are excluded.
+# - peak_memory() is the peak allocated CUDA memory since reset_peak_memory(),
+#   or on the CPU the peak resident set size of the process, which cannot be
+#   reset and therefore only grows over a run.
+# ========================================================================
+
+import resource
+import torch
+
+
+class SavedTensorMeter:
+    """
+    Context manager counting the distinct storages saved for backward by the forward passes run inside it.
+
+    Parameters:
+        - exclude (iterable[torch.Tensor]): Tensors not counted, e.g. model.parameters().
+    """
+    def __init__(self, exclude=()):
+        self.exclude = {t.untyped_storage().data_ptr() for t in exclude}
+        self.storages = {}
+        self.hooks = torch.autograd.graph.saved_tensors_hooks(self.pack, self.unpack)
+
+    def pack(self, tensor):
+        storage = tensor.untyped_storage()
+        # saved tensors stay alive until backward, so their storage addresses are unique
+        if storage.data_ptr() not in self.exclude:
+            self.storages[storage.data_ptr()] = storage.nbytes()
+        return tensor
+
+    @staticmethod
+    def unpack(tensor):
+        return tensor
+
+    @property
+    def bytes(self):
+        return sum(self.storages.values())
+
+    def __enter__(self):
+        self.storages = {}
+        self.hooks.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self.hooks.__exit__(*exc)
+
+
+def reset_peak_memory(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+
+
+def peak_memory(device):
+    """Peak CUDA memory allocated since reset_peak_memory(), or peak resident set size of the process (bytes)."""
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(device)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024    # KB on Linux
+
+
+def synchronize(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
@@ -12,7 +12,8 @@ def calculate_erfnet_weights(loader: DataLoader, num_classes: int, enc: bool) ->
     depending on wheter the model is being used in encoder or decoder mode.
     
     Parameters:
-        - loader (DataLoader): A data loader to iterate over the dataset.
+        - loader (DataLoader): A data loader to iterate over the dataset, or any iterable of
+            (image, label) batches (e.g. the output of a batched transform).
         - num_classes (int): Number of classes in the dataset (19 + 1).
         - enc (bool): Boolean value for indicating if the model is in
             encoder (True) or decoder (False) mode.
@@ -22,7 +23,8 @@ def calculate_erfnet_weights(loader: DataLoader, num_classes: int, enc: bool) ->
     """
     class_counts = torch.zeros(num_classes)
 
-    for _, label in loader:
+    for batch in loader:
+        label = batch[1].long()
         hist = torch.bincount(label.view(-1), minlength=num_classes)
         class_counts += hist
         class_counts[class_counts == 0] = 1  # Avoid division by zero
@@ -112,7 +114,8 @@ def calculate_enet_weights(loader: DataLoader, num_classes: int, c: float = 1.02
     Segmentation', available at the following link: https://arxiv.org/abs/1606.02147.
     
     Parameters:
-        - loader (DataLoader): A data loader to iterate over the dataset.  
+        - loader (DataLoader): A data loader to iterate over the dataset, or any iterable of
+            (image, label) batches (e.g. the output of a batched transform).
         - num_classes (int): Number of classes in the dataset (19 + 1).
         - c (int): An additional hyper-parameter (default 1.02).
 
@@ -122,7 +125,8 @@ def calculate_enet_weights(loader: DataLoader, num_classes: int, c: float = 1.02
     class_counts = torch.zeros(num_classes)
 
     # Compute number of occurrences for each class (19 + 1)
-    for _, label in loader:
+    for batch in loader:
+        label = batch[1].long()
         label = label.view(-1)
         for c in range(num_classes):
             class_counts[c] += (label == c).sum().item()